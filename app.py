@@ -1,25 +1,47 @@
-from flask import Flask, render_template, jsonify, request, session, redirect, url_for
-from flask_session import Session
+from flask import Flask, Response, render_template, jsonify, request, session, redirect, url_for, stream_with_context
 import os
+import json
 from datetime import datetime
 import spotipy
-from spotipy.oauth2 import SpotifyOAuth
+from spotipy.oauth2 import SpotifyOAuth, SpotifyClientCredentials, SpotifyOauthError
+from spotipy.cache_handler import MemoryCacheHandler
 from dotenv import load_dotenv
 import logging
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
+import concurrency
+import log_pipeline
+import metrics
+import mood_detector as mood_detector_module
 from mood_detector import MoodDetector
+from redis_client import get_redis
+from search_cache import SearchCache
+from session_store import init_session
+from playlist_history import PlaylistHistory
+from playlist_jobs import PlaylistJobs
+from playlist_snapshots import PlaylistSnapshots, PLAYLIST_FIELDS
+from http_cache import cached_json
+from http_transport import get_session, get_timeout, pool_stats
+from token_manager import TokenManager
+from track_index import TrackIndex
+from track_model import encode_tracks, load_tracks, project_playlist_items, project_tracks, tracks_response
+from user_store import UserStore
+from spotify_client import INTERACTIVE, BACKGROUND, RateLimitedSpotify, SpotifyRateLimiter, SpotifyRateLimited, use_endpoints
 import time
+from concurrent.futures import ThreadPoolExecutor, wait, as_completed, TimeoutError as FuturesTimeoutError
 
-# Set up logging
-logging.basicConfig(level=logging.DEBUG)
+# Set up logging: queued, sampled per route, one summary per request
+log_pipeline.configure()
 logger = logging.getLogger(__name__)
 
 load_dotenv()
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'your-secret-key-here')  # Use environment variable or fallback
-app.config['SESSION_TYPE'] = 'filesystem'
-Session(app)
+app.config['SESSION_TYPE'] = 'filesystem'  # Used when REDIS_URL isn't set
+init_session(app)
+metrics.init_app(app)
+log_pipeline.init_app(app)
+concurrency_limiter = concurrency.init_app(app)
 
 # Initialize Flask-Login
 login_manager = LoginManager()
@@ -31,12 +53,14 @@ class User(UserMixin):
     def __init__(self, id):
         self.id = id
 
-# In-memory user store (for demonstration)
-users = {'user@example.com': User(id='user@example.com')}
+# Users are shared by all workers through SQLite, with a short-lived
+# in-process cache in front for the per-request user_loader
+user_store = UserStore(User)
+user_store.add('user@example.com')
 
 @login_manager.user_loader
 def load_user(user_id):
-    return users.get(user_id)
+    return user_store.get(user_id)
 
 # Spotify Configuration
 SPOTIPY_CLIENT_ID = os.getenv('SPOTIFY_CLIENT_ID')
@@ -44,37 +68,421 @@ SPOTIPY_CLIENT_SECRET = os.getenv('SPOTIFY_CLIENT_SECRET')
 SPOTIPY_REDIRECT_URI = 'https://mood-music-app-uwtu.onrender.com/callback'  # Hardcoding to ensure exact match
 SPOTIFY_SCOPE = 'user-library-read playlist-modify-public playlist-modify-private user-read-private user-read-email'
 
+def build_spotify_oauth():
+    """The app's Spotify OAuth client, shared by login, callback and token refresh"""
+    return use_endpoints(SpotifyOAuth(
+        client_id=SPOTIPY_CLIENT_ID,
+        client_secret=SPOTIPY_CLIENT_SECRET,
+        redirect_uri=SPOTIPY_REDIRECT_URI,
+        scope=SPOTIFY_SCOPE,
+        show_dialog=True,  # Force showing the Spotify login dialog
+        requests_session=get_session(),
+        requests_timeout=get_timeout(),
+        # Tokens live in the users' sessions, not in a shared cache file
+        cache_handler=MemoryCacheHandler()
+    ))
+
+# Refreshes each login's token once, however many requests or workers need it
+token_manager = TokenManager(build_spotify_oauth, redis_client=get_redis())
+
 mood_detector = MoodDetector()
 
-def get_spotify():
-    """Get Spotify client with fresh token"""
+# Map moods to search queries and genres
+MOOD_SETTINGS = {
+    'happy': {
+        'query': 'happy upbeat',
+        'genres': ['pop', 'dance'],
+        'artists': ['Taylor Swift', 'Pharrell Williams', 'Justin Timberlake']
+    },
+    'sad': {
+        'query': 'sad emotional',
+        'genres': ['piano', 'acoustic'],
+        'artists': ['Adele', 'Sam Smith', 'Lewis Capaldi']
+    },
+    'energetic': {
+        'query': 'party dance',
+        'genres': ['edm', 'dance'],
+        'artists': ['Avicii', 'David Guetta', 'Calvin Harris']
+    },
+    'calm': {
+        'query': 'relaxing peaceful',
+        'genres': ['classical', 'ambient'],
+        'artists': ['Ludovico Einaudi', 'Hans Zimmer', 'Max Richter']
+    },
+    'romantic': {
+        'query': 'love romantic',
+        'genres': ['pop', 'acoustic'],
+        'artists': ['Ed Sheeran', 'John Legend', 'Bruno Mars']
+    }
+}
+
+# Map moods to specific popular playlists
+MOOD_PLAYLISTS = {
+    'happy': '37i9dQZF1DXdPec7aLTmlC',      # Happy Hits
+    'sad': '37i9dQZF1DX7qK8ma5wgG1',        # Sad Songs
+    'energetic': '37i9dQZF1DX76Wlfdnj7AP',  # Beast Mode
+    'calm': '37i9dQZF1DWZd79rJ6a7lp',       # Sleep
+    'romantic': '37i9dQZF1DX50QitC6Oqtn'    # Love Pop
+}
+
+# Search results depend only on the query, market and limit, so they're
+# shared between users (and between workers when Redis is configured)
+search_cache = SearchCache(
+    redis_client=get_redis(),
+    max_entries=int(os.getenv('SEARCH_CACHE_SIZE', '1024')),
+    ttl=int(os.getenv('SEARCH_CACHE_TTL', '3600')),
+    stale_ttl=int(os.getenv('SEARCH_CACHE_STALE_TTL', '600')),
+    restore=load_tracks
+)
+
+# A longer query is answered from a cached query it extends when that
+# query's results hold at least this many matches for it, or hold fewer
+# results than the limit (so Spotify had no more to give)
+SEARCH_PREFIX_MIN_RESULTS = int(os.getenv('SEARCH_PREFIX_MIN_RESULTS', '10'))
+
+def load_track_index():
+    """The local track index, if TRACK_INDEX_PATH points at one"""
+    path = os.getenv('TRACK_INDEX_PATH')
+    if not path:
+        return None
     try:
-        if 'token_info' not in session:
-            print("No token in session")
-            return None
-
-        token_info = session['token_info']
-
-        # Check if token needs refresh
-        now = int(time.time())
-        is_expired = token_info['expires_at'] - now < 60
+        return TrackIndex(path)
+    except Exception as e:
+        logger.error("Failed to open track index at %s: %s", path, e)
+        return None
 
-        if is_expired:
-            print("Token expired, refreshing...")
-            sp_oauth = SpotifyOAuth(
-                client_id=SPOTIPY_CLIENT_ID,
-                client_secret=SPOTIPY_CLIENT_SECRET,
-                redirect_uri=SPOTIPY_REDIRECT_URI,
-                scope=SPOTIFY_SCOPE
-            )
-            token_info = sp_oauth.refresh_access_token(token_info['refresh_token'])
-            session['token_info'] = token_info
+# Memory-mapped, so workers forked from a preloading master share its pages
+track_index = load_track_index()
+
+# Calls from every worker share one Spotify request budget
+spotify_limiter = SpotifyRateLimiter(redis_client=get_redis())
+
+def spotify_client(access_token, priority=INTERACTIVE):
+    """Build a rate-limited Spotify client on the shared pooled HTTP transport"""
+    sp = use_endpoints(spotipy.Spotify(
+        auth=access_token,
+        requests_session=get_session(),
+        requests_timeout=get_timeout()
+    ))
+    return RateLimitedSpotify(sp, spotify_limiter, priority=priority)
+
+def search_track_items(sp, query, market, limit=10, refine=None):
+    """Search Spotify for tracks through the shared search cache.
+
+    Only the projected tracks are cached, not Spotify's full track objects.
+    """
+    def fetch():
+        results = sp.search(query, type='track', market=market, limit=limit)
+        if results and 'tracks' in results and results['tracks']['items']:
+            return project_tracks(results['tracks']['items'])
+        return []
+
+    return search_cache.get_or_fetch(query, market, limit, fetch, refine=refine)
+
+def refine_search_results(tracks, query, limit):
+    """The tracks of a shorter query's results whose name, artist or album
+    contain every word of query, or None if they can't stand in for a search"""
+    words = query.split()
+    matches = [track for track in tracks
+               if all(word in f"{track.name} {track.artist} {track.album}".lower() for word in words)]
+    if matches and (len(tracks) < limit or len(matches) >= SEARCH_PREFIX_MIN_RESULTS):
+        return matches
+    return None
+
+def app_spotify_client():
+    """Spotify client authenticated as the app itself, for public data"""
+    auth_manager = use_endpoints(SpotifyClientCredentials(
+        client_id=SPOTIPY_CLIENT_ID,
+        client_secret=SPOTIPY_CLIENT_SECRET,
+        requests_session=get_session(),
+        requests_timeout=get_timeout(),
+        cache_handler=MemoryCacheHandler()
+    ))
+    sp = use_endpoints(spotipy.Spotify(
+        auth_manager=auth_manager,
+        requests_session=get_session(),
+        requests_timeout=get_timeout()
+    ))
+    return RateLimitedSpotify(sp, spotify_limiter, priority=BACKGROUND)
+
+# The editorial mood playlists change a few times a day at most, so they
+# are served from snapshots refreshed in the background
+playlist_snapshots = PlaylistSnapshots(
+    MOOD_PLAYLISTS,
+    client_factory=app_spotify_client,
+    project=project_playlist_items,
+    restore=load_tracks,
+    redis_client=get_redis()
+)
+
+@app.before_first_request
+def start_background_refresh():
+    playlist_snapshots.start()
+
+def wants_stream(data):
+    """Whether the client asked for NDJSON streaming"""
+    if str(data.get('stream', '')).lower() in ('1', 'true', 'yes'):
+        return True
+    return request.accept_mimetypes.best == 'application/x-ndjson'
+
+def stream_mood_tracks(sp, settings, market, mood, limit=20):
+    """Yield NDJSON records for a mood: each new track as soon as its search
+    returns, then a summary record"""
+    genre_queries, artist_queries = mood_queries(settings)
+    queries = genre_queries + artist_queries
+    futures = [search_executor.submit(metrics.propagate(search_track_items), sp, query, market)
+               for query in queries]
+
+    seen = set()
+    completed = 0
+    failed = 0
+    try:
+        for future in as_completed(futures, timeout=SEARCH_DEADLINE):
+            completed += 1
+            try:
+                items = future.result()
+            except Exception as e:
+                logger.warning("Search failed: %s", e)
+                failed += 1
+                continue
 
-        return spotipy.Spotify(auth=token_info['access_token'])
+            for track in items:
+                if len(seen) >= limit:
+                    break
+                if track.id in seen:
+                    continue
+                seen.add(track.id)
+                yield '{"type":"track","track":' + track.to_json() + '}\n'
+
+            if len(seen) >= limit:
+                break
+    except FuturesTimeoutError:
+        logger.warning("Searches missed the deadline")
+    finally:
+        for future in futures:
+            future.cancel()
+
+    if queries and failed == len(queries):
+        yield json.dumps({'type': 'error', 'error': 'Failed to get recommendations'}) + '\n'
+
+    yield json.dumps({
+        'type': 'summary',
+        'mood': mood,
+        'count': len(seen),
+        'searches': len(queries),
+        'completed': completed,
+        'failed': failed,
+        'message': f'Found {len(seen)} tracks for {mood} mood' if seen else 'No tracks found'
+    }) + '\n'
+
+# Saved playlists live outside the session so it stays a small token record
+playlist_history = PlaylistHistory()
+
+def migrate_session_playlists(user_id):
+    """Move playlist history saved in the session by older versions into the store"""
+    if 'playlists' in session:
+        playlist_history.add_many(user_id, session.pop('playlists'))
+
+# Playlist creation runs in the background so large playlists don't tie
+# up a request worker
+playlist_jobs = PlaylistJobs(redis_client=get_redis())
+
+# Bounded pool shared by all requests in this worker for upstream fan-out
+search_executor = ThreadPoolExecutor(max_workers=int(os.getenv('SEARCH_WORKERS', '8')))
+SEARCH_DEADLINE = float(os.getenv('SEARCH_DEADLINE', '8'))
+
+def run_searches(sp, searches, deadline=SEARCH_DEADLINE):
+    """Run (query, market) track searches concurrently and return their
+    items in order.
+
+    Searches that haven't finished (or that failed) by the deadline are
+    left out, so the caller merges whatever arrived in time.
+    """
+    futures = [search_executor.submit(metrics.propagate(search_track_items), sp, query, market)
+               for query, market in searches]
+    done, not_done = wait(futures, timeout=deadline)
+    for future in not_done:
+        future.cancel()
+        logger.warning("Search missed the deadline")
+
+    results = []
+    rate_limited = []
+    for (query, _), future in zip(searches, futures):
+        if future not in done:
+            results.append([])
+            continue
+        try:
+            results.append(future.result())
+        except Exception as e:
+            logger.warning("Search failed for %s: %s", query, e)
+            if isinstance(e, SpotifyRateLimited):
+                rate_limited.append(e)
+            results.append([])
+
+    # Nothing to show because Spotify is throttling us: let the caller say so
+    if rate_limited and not any(results):
+        raise rate_limited[0]
+    return results
+
+def mood_queries(settings):
+    """Genre and artist search queries for a mood"""
+    return ([f"{settings['query']} {genre}" for genre in settings['genres']],
+            [f"{settings['query']} {artist}" for artist in settings['artists']])
+
+def pick_mood_tracks(genre_results, artist_results, limit=20):
+    """Up to limit distinct tracks, from the genre searches first and the
+    artist searches when genres come up short"""
+    all_tracks = [track for items in genre_results for track in items]
+    if len(all_tracks) < limit:
+        all_tracks += [track for items in artist_results for track in items]
+    return list({track.id: track for track in all_tracks}.values())[:limit]
+
+def search_mood_tracks(sp, settings, market):
+    """Get tracks for a mood, genre searches first and then artists"""
+    genre_queries, artist_queries = mood_queries(settings)
+
+    # Artist searches are only needed when genres come up short, but
+    # issuing them up front keeps the request at one round-trip
+    results = run_searches(sp, [(query, market) for query in genre_queries + artist_queries])
+    return pick_mood_tracks(results[:len(genre_queries)], results[len(genre_queries):])
+
+MAX_BULK_ITEMS = int(os.getenv('BULK_RECOMMENDATIONS_MAX', '50'))
+
+def bulk_items(data, market):
+    """The (mood, market, user) items of a bulk request.
+
+    Accepts {"moods": [...]} (or a comma-separated string in the query
+    string) for the logged-in user's market, or {"items": [{"mood": ...,
+    "market": ..., "user": ...}]} where market defaults to the user's and
+    user is an optional label echoed back in the results.
+    """
+    if 'items' in data:
+        items = data['items']
+        if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+            raise ValueError('items must be a list of objects')
+    else:
+        moods = data.get('moods', [])
+        if isinstance(moods, str):
+            moods = [mood for mood in moods.split(',') if mood.strip()]
+        if not isinstance(moods, list):
+            raise ValueError('moods must be a list')
+        items = [{'mood': mood} for mood in moods]
+
+    if not items:
+        raise ValueError('No moods provided')
+    if len(items) > MAX_BULK_ITEMS:
+        raise ValueError(f'At most {MAX_BULK_ITEMS} moods per request')
+    return [
+        (str(item.get('mood', '')).strip().lower(), item.get('market') or market, item.get('user'))
+        for item in items
+    ]
+
+def plan_mood_searches(items):
+    """The distinct (query, market) searches the items need, and for each
+    item its genre and artist search positions in that list"""
+    searches = {}
+    plans = []
+    for mood, market, _ in items:
+        if mood not in MOOD_SETTINGS:
+            plans.append(None)
+            continue
+        plans.append(tuple(
+            [searches.setdefault((query, market), len(searches)) for query in queries]
+            for queries in mood_queries(MOOD_SETTINGS[mood])
+        ))
+    return list(searches), plans
+
+# How long the cached Spotify profile is trusted before re-verifying the token
+PROFILE_TTL = int(os.getenv('SPOTIFY_PROFILE_TTL', '3600'))
+
+def cache_profile(token_info, user):
+    """Store the parts of the Spotify profile we use alongside the token"""
+    token_info['profile'] = {
+        'id': user['id'],
+        'country': user.get('country'),
+        'product': user.get('product'),
+        'fetched_at': int(time.time())
+    }
+    session['token_info'] = token_info
+    return token_info['profile']
+
+def get_spotify_profile(sp, token_info):
+    """Get the user's Spotify profile, only calling Spotify when the cached
+    copy is missing, older than PROFILE_TTL or the token is about to expire"""
+    profile = token_info.get('profile')
+    now = int(time.time())
+    near_expiry = token_info.get('expires_at', 0) - now < 60
+
+    if profile and not near_expiry and now - profile['fetched_at'] < PROFILE_TTL:
+        metrics.cache_result('profile', 'hit')
+        return profile
+
+    metrics.cache_result('profile', 'miss')
+    return cache_profile(token_info, sp.current_user())
+
+def is_auth_error(e):
+    """Check whether Spotify rejected the token, dropping it from the session if so"""
+    if isinstance(e, spotipy.exceptions.SpotifyException) and e.http_status == 401:
+        session.pop('token_info', None)
+        return True
+    return False
+
+def rate_limited_response(e):
+    """429 telling the client when it can retry, instead of a generic 500"""
+    response = jsonify({'error': 'Spotify is busy right now, please try again shortly'})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
+def fresh_token_info():
+    """The session's token info, refreshed first if it expires soon.
+
+    Returns None when there's no token or Spotify rejected the refresh.
+    """
+    token_info = session.get('token_info')
+    if not token_info:
+        return None
+    if not token_manager.needs_refresh(token_info):
+        return token_info
 
+    try:
+        token_info = token_manager.fresh(token_info)
     except Exception as e:
-        print(f"Error getting Spotify client: {str(e)}")
+        if isinstance(e, SpotifyOauthError) and e.error == 'invalid_grant':
+            # The user revoked access, or the refresh token was replaced
+            logger.warning("Token refresh rejected: %s", e)
+            session.pop('token_info', None)
+            return None
+        # Refreshing ahead of expiry leaves time to retry on a later request
+        logger.warning("Token refresh failed: %s", e)
+        return token_info if token_info['expires_at'] > time.time() else None
+    session['token_info'] = token_info
+    return token_info
+
+def get_spotify():
+    """Get Spotify client with fresh token"""
+    token_info = fresh_token_info()
+    if not token_info:
+        logger.debug("No token in session")
         return None
+    return spotify_client(token_info['access_token'])
+
+def warm_up():
+    """Load shared data and compile templates before serving traffic.
+
+    Run once in the gunicorn master when the app is preloaded (so workers
+    inherit the result), otherwise once per worker.
+    """
+    mood_detector_module.preload()
+    for template in ('index.html', 'login.html', 'register.html', 'profile.html'):
+        app.jinja_env.get_template(template)
+
+def request_data():
+    """Query parameters for GET requests (so responses can be revalidated
+    with ETags), the JSON body otherwise"""
+    if request.method == 'GET':
+        return request.args.to_dict()
+    return request.get_json()
 
 @app.route('/')
 def index():
@@ -84,46 +492,31 @@ def index():
 def register():
     if request.method == 'POST':
         email = request.form['email']
-        # Here you would save the user to a database
-        users[email] = User(id=email)
-        login_user(users[email])
+        login_user(user_store.add(email))
         return redirect(url_for('profile'))
     return render_template('register.html')
 
 @app.route('/spotify-login')
 def spotify_login():
     try:
-        sp_oauth = SpotifyOAuth(
-            client_id=SPOTIPY_CLIENT_ID,
-            client_secret=SPOTIPY_CLIENT_SECRET,
-            redirect_uri=SPOTIPY_REDIRECT_URI,
-            scope=SPOTIFY_SCOPE,
-            show_dialog=True  # Force showing the Spotify login dialog
-        )
-        auth_url = sp_oauth.get_authorize_url()
+        auth_url = token_manager.oauth.get_authorize_url()
         return redirect(auth_url)
     except Exception as e:
-        print(f"Login error: {str(e)}")
+        logger.error("Login error: %s", e)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/callback')
 def callback():
     try:
-        sp_oauth = SpotifyOAuth(
-            client_id=SPOTIPY_CLIENT_ID,
-            client_secret=SPOTIPY_CLIENT_SECRET,
-            redirect_uri=SPOTIPY_REDIRECT_URI,
-            scope=SPOTIFY_SCOPE
-        )
-        
         code = request.args.get('code')
         if not code:
-            print("No code in callback")
+            logger.info("No code in callback")
             return redirect('/')
             
-        token_info = sp_oauth.get_access_token(code, check_cache=False)
+        with metrics.span('spotify', 'get_access_token'):
+            token_info = token_manager.oauth.get_access_token(code, check_cache=False)
         if not token_info:
-            print("Failed to get token info")
+            logger.warning("Failed to get token info")
             return redirect('/')
             
         # Store token info in session
@@ -131,34 +524,34 @@ def callback():
         
         # Test the token
         try:
-            sp = spotipy.Spotify(auth=token_info['access_token'])
-            sp.current_user()
-            print("Successfully authenticated user")
+            sp = spotify_client(token_info['access_token'])
+            cache_profile(token_info, sp.current_user())
+            logger.info("Successfully authenticated user")
         except Exception as e:
-            print(f"Token test failed: {str(e)}")
+            logger.warning("Token test failed: %s", e)
             session.pop('token_info', None)
             return redirect('/')
         
         return redirect('/')
         
     except Exception as e:
-        print(f"Callback error: {str(e)}")
+        logger.error("Callback error: %s", e)
         return redirect('/')
 
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         email = request.form['email']
-        logger.debug(f"Login attempt for email: {email}")
-        if email in users:
-            logger.debug(f"User found: {email}")
-            login_user(users[email])
+        logger.debug("Login attempt for email: %s", email)
+        user = user_store.get(email)
+        if user is not None:
+            logger.debug("User found: %s", email)
+            login_user(user)
             return redirect(url_for('profile'))
         else:
-            logger.warning(f"User not found: {email}")
+            logger.warning("User not found: %s", email)
             # If user not found, create a new one
-            users[email] = User(id=email)
-            login_user(users[email])
+            login_user(user_store.add(email))
             return redirect(url_for('profile'))
     return render_template('login.html')
 
@@ -167,339 +560,298 @@ def login():
 def profile():
     return render_template('profile.html', user=current_user)
 
-@app.route('/api/get-recommendations', methods=['POST'])
+@app.route('/api/get-recommendations', methods=['GET', 'POST'])
+@cached_json('private, max-age=300')
 def get_recommendations():
     try:
         if 'token_info' not in session:
-            print("No token in session")
+            logger.debug("No token in session")
             return jsonify({'error': 'Please login first'}), 401
 
-        token_info = session['token_info']
+        token_info = fresh_token_info()
         if not token_info:
-            print("Token info is empty")
+            logger.debug("Token info is empty")
             return jsonify({'error': 'Invalid session, please login again'}), 401
 
-        sp = spotipy.Spotify(auth=token_info['access_token'])
+        sp = spotify_client(token_info['access_token'])
         
         # Verify the token works
         try:
-            sp.current_user()
+            get_spotify_profile(sp, token_info)
         except Exception as e:
-            print(f"Token verification failed: {str(e)}")
+            logger.warning("Token verification failed: %s", e)
+            if isinstance(e, SpotifyRateLimited):
+                return rate_limited_response(e)
             session.pop('token_info', None)
             return jsonify({'error': 'Session expired, please login again'}), 401
 
-        data = request.get_json()
+        data = request_data()
         if not data:
-            print("No data in request")
+            logger.debug("No data in request")
             return jsonify({'error': 'No data provided'}), 400
             
         mood = data.get('mood', '').lower()
         if not mood:
-            print("No mood specified")
+            logger.debug("No mood specified")
             return jsonify({'error': 'Please select a mood'}), 400
 
-        print(f"Processing request for mood: {mood}")
-
-        # Map moods to specific popular playlists
-        mood_to_playlist = {
-            'happy': '37i9dQZF1DXdPec7aLTmlC',      # Happy Hits
-            'sad': '37i9dQZF1DX7qK8ma5wgG1',        # Sad Songs
-            'energetic': '37i9dQZF1DX76Wlfdnj7AP',  # Beast Mode
-            'calm': '37i9dQZF1DWZd79rJ6a7lp',       # Sleep
-            'romantic': '37i9dQZF1DX50QitC6Oqtn'    # Love Pop
-        }
+        log_pipeline.annotate(mood=mood)
 
-        playlist_id = mood_to_playlist.get(mood)
+        playlist_id = MOOD_PLAYLISTS.get(mood)
         if not playlist_id:
-            print(f"Invalid mood selected: {mood}")
+            logger.debug("Invalid mood selected: %s", mood)
             return jsonify({'error': 'Invalid mood selected'}), 400
 
-        print(f"Getting tracks from playlist: {playlist_id}")
+        # Serve the local snapshot when we have one
+        tracks = playlist_snapshots.get(mood)
+        metrics.cache_result('playlist_snapshot', 'hit' if tracks else 'miss')
+        if tracks:
+            return tracks_response(tracks, mood=mood, message=f'Found {len(tracks)} tracks for {mood} mood')
+
+        logger.debug("Getting tracks from playlist %s", playlist_id)
 
         try:
             # Get tracks from the mood-specific playlist
             results = sp.playlist_tracks(
                 playlist_id,
-                fields='items(track(id,name,artists,album(name,images),preview_url,external_urls))',
+                fields=PLAYLIST_FIELDS,
                 limit=20
             )
             
             if not results:
-                print("No results from playlist")
+                logger.warning("No results from playlist %s", playlist_id)
                 return jsonify({'error': 'Failed to get playlist'}), 500
                 
             if 'items' not in results:
-                print("No items in results")
+                logger.warning("No items in playlist %s", playlist_id)
                 return jsonify({'error': 'No tracks in playlist'}), 404
 
-            tracks = []
-            for item in results['items']:
-                if not item:
-                    continue
-                    
-                if 'track' not in item:
-                    continue
-                    
-                track = item['track']
-                if not track:
-                    continue
-
-                try:
-                    # Get track data
-                    track_data = {
-                        'id': track['id'],
-                        'name': track['name'],
-                        'artist': track['artists'][0]['name'] if track['artists'] else 'Unknown Artist',
-                        'album': track['album']['name'] if track['album'] else 'Unknown Album',
-                        'album_image': track['album']['images'][0]['url'] if track['album'].get('images') else None,
-                        'preview_url': track['preview_url'],
-                        'external_url': track['external_urls'].get('spotify', '')
-                    }
-                    tracks.append(track_data)
-                    print(f"Added track: {track_data['name']}")
-                except Exception as e:
-                    print(f"Error processing track: {str(e)}")
-                    continue
+            tracks = project_playlist_items(results['items'])
 
             if not tracks:
-                print("No valid tracks found")
+                logger.info("No valid tracks found")
                 return jsonify({'error': 'No valid tracks found'}), 404
 
-            print(f"Successfully found {len(tracks)} tracks")
-            return jsonify({
-                'tracks': tracks,
-                'mood': mood,
-                'message': f'Found {len(tracks)} tracks for {mood} mood'
-            })
+            log_pipeline.annotate(tracks=len(tracks), source='playlist')
+            return tracks_response(tracks, mood=mood, message=f'Found {len(tracks)} tracks for {mood} mood')
 
         except spotipy.exceptions.SpotifyException as e:
-            print(f"Spotify API error: {str(e)}")
+            logger.error("Spotify API error: %s", e)
+            if is_auth_error(e):
+                return jsonify({'error': 'Session expired, please login again'}), 401
+            if isinstance(e, SpotifyRateLimited):
+                return rate_limited_response(e)
             return jsonify({'error': f'Spotify API error: {str(e)}'}), 500
         except Exception as e:
-            print(f"Error getting playlist tracks: {str(e)}")
+            logger.error("Error getting playlist tracks: %s", e)
             return jsonify({'error': 'Failed to get playlist tracks'}), 500
 
     except Exception as e:
-        print(f"General error in get_recommendations: {str(e)}")
+        logger.error("General error in get_recommendations: %s", e)
         return jsonify({'error': f'An error occurred: {str(e)}'}), 500
 
-@app.route('/api/mood-based-recommendations', methods=['POST'])
+@app.route('/api/mood-based-recommendations', methods=['GET', 'POST'])
+@cached_json('private, max-age=300')
 def get_mood_recommendations():
     try:
         if 'token_info' not in session:
             return jsonify({'error': 'Please login first'}), 401
 
-        token_info = session['token_info']
-        sp = spotipy.Spotify(auth=token_info['access_token'])
+        token_info = fresh_token_info()
+        if not token_info:
+            return jsonify({'error': 'Session expired, please login again'}), 401
+        sp = spotify_client(token_info['access_token'])
         
         try:
-            user = sp.current_user()
-            print(f"User verified: {user['id']}")
+            profile = get_spotify_profile(sp, token_info)
         except Exception as e:
-            if 'token expired' in str(e).lower():
-                token_info = get_token()
-                session['token_info'] = token_info
-                sp = spotipy.Spotify(auth=token_info['access_token'])
+            if isinstance(e, SpotifyRateLimited):
+                return rate_limited_response(e)
             else:
                 session.pop('token_info', None)
                 return jsonify({'error': str(e)}), 401
 
-        data = request.get_json()
+        data = request_data()
         if not data or 'mood' not in data:
             return jsonify({'error': 'No mood provided'}), 400
 
         mood = data['mood'].lower()
-        print(f"Getting tracks for mood: {mood}")
-
-        # Map moods to search queries and genres
-        mood_settings = {
-            'happy': {
-                'query': 'happy upbeat',
-                'genres': ['pop', 'dance'],
-                'artists': ['Taylor Swift', 'Pharrell Williams', 'Justin Timberlake']
-            },
-            'sad': {
-                'query': 'sad emotional',
-                'genres': ['piano', 'acoustic'],
-                'artists': ['Adele', 'Sam Smith', 'Lewis Capaldi']
-            },
-            'energetic': {
-                'query': 'party dance',
-                'genres': ['edm', 'dance'],
-                'artists': ['Avicii', 'David Guetta', 'Calvin Harris']
-            },
-            'calm': {
-                'query': 'relaxing peaceful',
-                'genres': ['classical', 'ambient'],
-                'artists': ['Ludovico Einaudi', 'Hans Zimmer', 'Max Richter']
-            },
-            'romantic': {
-                'query': 'love romantic',
-                'genres': ['pop', 'acoustic'],
-                'artists': ['Ed Sheeran', 'John Legend', 'Bruno Mars']
-            }
-        }
-
-        if mood not in mood_settings:
+        log_pipeline.annotate(mood=mood)
+
+        if mood not in MOOD_SETTINGS:
             return jsonify({'error': 'Invalid mood'}), 400
 
-        settings = mood_settings[mood]
+        settings = MOOD_SETTINGS[mood]
 
         try:
             # Get user's market
-            market = sp.current_user()['country']
-            print(f"Using market: {market}")
-
-            all_tracks = []
-            
-            # Try searching with mood and genre
-            for genre in settings['genres']:
-                search_query = f"{settings['query']} {genre}"
-                print(f"Searching for: {search_query}")
-                
-                results = sp.search(
-                    search_query,
-                    type='track',
-                    market=market,
-                    limit=10
+            market = profile['country']
+            log_pipeline.annotate(market=market)
+
+            # Match against the local index when there is one: no Spotify calls
+            if track_index is not None:
+                matches = track_index.recommend(mood, market=market)
+                if matches:
+                    tracks, scores = zip(*matches)
+                    return tracks_response(tracks, scores, message=f'Found {len(tracks)} tracks for {mood} mood',
+                                           source='index')
+
+            # Opt-in streaming: one NDJSON record per track as searches return
+            if wants_stream(data):
+                return Response(
+                    stream_with_context(stream_mood_tracks(sp, settings, market, mood)),
+                    mimetype='application/x-ndjson',
+                    headers={'Cache-Control': 'no-store'}
                 )
-                
-                if results and 'tracks' in results and results['tracks']['items']:
-                    all_tracks.extend(results['tracks']['items'])
-
-            # If we don't have enough tracks, try searching with artists
-            if len(all_tracks) < 20:
-                for artist in settings['artists']:
-                    search_query = f"{settings['query']} {artist}"
-                    print(f"Searching with artist: {search_query}")
-                    
-                    results = sp.search(
-                        search_query,
-                        type='track',
-                        market=market,
-                        limit=10
-                    )
-                    
-                    if results and 'tracks' in results and results['tracks']['items']:
-                        all_tracks.extend(results['tracks']['items'])
-
-            # Remove duplicates based on track ID
-            unique_tracks = {track['id']: track for track in all_tracks}.values()
-            
-            # Take only the first 20 tracks
-            tracks = []
-            for track in list(unique_tracks)[:20]:
-                try:
-                    track_data = {
-                        'id': track['id'],
-                        'name': track['name'],
-                        'artist': track['artists'][0]['name'],
-                        'album': track['album']['name'],
-                        'album_image': track['album']['images'][0]['url'] if track['album']['images'] else None,
-                        'preview_url': track['preview_url'],
-                        'external_url': track['external_urls']['spotify'],
-                        'uri': track['uri']
-                    }
-                    tracks.append(track_data)
-                except Exception as e:
-                    print(f"Error processing track: {str(e)}")
-                    continue
+
+            tracks = search_mood_tracks(sp, settings, market)
 
             if not tracks:
                 return jsonify({'error': 'No tracks found'}), 404
 
-            print(f"Found {len(tracks)} tracks")
-            return jsonify({
-                'tracks': tracks,
-                'message': f'Found {len(tracks)} tracks for {mood} mood'
-            })
+            log_pipeline.annotate(tracks=len(tracks), source='search')
+            return tracks_response(tracks, message=f'Found {len(tracks)} tracks for {mood} mood')
 
         except Exception as e:
-            print(f"Error: {str(e)}")
+            logger.error("Error getting mood recommendations: %s", e)
+            if is_auth_error(e):
+                return jsonify({'error': 'Session expired, please login again'}), 401
+            if isinstance(e, SpotifyRateLimited):
+                return rate_limited_response(e)
             return jsonify({'error': str(e)}), 500
 
     except Exception as e:
-        print(f"General error: {str(e)}")
+        logger.error("General error in get_mood_recommendations: %s", e)
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/search', methods=['POST'])
+@app.route('/api/bulk-recommendations', methods=['GET', 'POST'])
+@cached_json('private, max-age=300')
+def get_bulk_recommendations():
+    """Recommendations for many moods, or (user, mood) items, in one response.
+
+    Every distinct (query, market) search the items need runs once and its
+    results are shared by the items that need it.
+    """
+    try:
+        if 'token_info' not in session:
+            return jsonify({'error': 'Please login first'}), 401
+
+        token_info = fresh_token_info()
+        if not token_info:
+            return jsonify({'error': 'Session expired, please login again'}), 401
+        sp = spotify_client(token_info['access_token'])
+
+        try:
+            profile = get_spotify_profile(sp, token_info)
+        except Exception as e:
+            if isinstance(e, SpotifyRateLimited):
+                return rate_limited_response(e)
+            session.pop('token_info', None)
+            return jsonify({'error': str(e)}), 401
+
+        try:
+            items = bulk_items(request_data() or {}, profile['country'])
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        # Answer from the local index where it can, and search for the rest
+        matches = [None] * len(items)
+        if track_index is not None:
+            for i, (mood, market, _) in enumerate(items):
+                if mood in MOOD_SETTINGS:
+                    matches[i] = track_index.recommend(mood, market=market) or None
+        pending = [i for i, match in enumerate(matches) if match is None]
+        searches, plans = plan_mood_searches([items[i] for i in pending])
+        plans = dict(zip(pending, plans))
+        requested = sum(len(genres) + len(artists) for genres, artists in filter(None, plans.values()))
+        results = run_searches(sp, searches) if searches else []
+        log_pipeline.annotate(moods=len(items), searches=len(searches), requested_searches=requested)
+
+        encoded = []
+        for i, (mood, market, user) in enumerate(items):
+            fields = {'mood': mood, 'market': market}
+            if user is not None:
+                fields['user'] = user
+            if mood not in MOOD_SETTINGS:
+                encoded.append(json.dumps(dict(fields, error='Invalid mood')))
+                continue
+
+            if matches[i]:
+                tracks, scores = zip(*matches[i])
+                fields['source'] = 'index'
+            else:
+                genres, artists = plans[i]
+                tracks = pick_mood_tracks([results[j] for j in genres], [results[j] for j in artists])
+                scores = None
+                fields['source'] = 'search'
+            fields['message'] = f'Found {len(tracks)} tracks for {mood} mood' if tracks else 'No tracks found'
+            encoded.append(encode_tracks(tracks, scores, **fields))
+
+        body = '{"results":[' + ','.join(encoded) + '],' + json.dumps({
+            'searches': len(searches),
+            'requested_searches': requested
+        })[1:]
+        return Response(body, mimetype='application/json')
+
+    except Exception as e:
+        logger.error("Bulk recommendations error: %s", e)
+        if is_auth_error(e):
+            return jsonify({'error': 'Session expired, please login again'}), 401
+        if isinstance(e, SpotifyRateLimited):
+            return rate_limited_response(e)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/search', methods=['GET', 'POST'])
+@cached_json('private, max-age=60')
 def search_tracks():
     try:
         if 'token_info' not in session:
-            print("No token in session")
+            logger.debug("No token in session")
             return jsonify({'error': 'Please login first'}), 401
 
-        token_info = session['token_info']
+        token_info = fresh_token_info()
         if not token_info:
-            print("Token info is empty")
+            logger.debug("Token info is empty")
             return jsonify({'error': 'Invalid session, please login again'}), 401
 
-        sp = spotipy.Spotify(auth=token_info['access_token'])
+        sp = spotify_client(token_info['access_token'])
         
-        # Verify the token works
+        # Verify the token works (and keep its cached profile warm)
         try:
-            user = sp.current_user()
-            print(f"User verified: {user['id']}")
+            get_spotify_profile(sp, token_info)
         except Exception as e:
-            print(f"Token verification failed: {str(e)}")
+            logger.warning("Token verification failed: %s", e)
+            if isinstance(e, SpotifyRateLimited):
+                return rate_limited_response(e)
             session.pop('token_info', None)
             return jsonify({'error': 'Session expired, please login again'}), 401
 
-        data = request.get_json()
+        data = request_data()
         if not data or 'query' not in data:
-            print("No search query provided")
+            logger.debug("No search query provided")
             return jsonify({'error': 'No search query provided'}), 400
 
         query = data['query']
-        print(f"Searching for: {query}")
-
-        # Search for tracks with market and popularity filters
-        results = sp.search(
-            q=query,
-            type='track',
-            market='US',  # Add market parameter
-            limit=20
-        )
-        
-        if not results or 'tracks' not in results or not results['tracks']['items']:
-            print("No results found")
-            return jsonify({'error': 'No results found'}), 404
+        if not query.strip():
+            return jsonify({'error': 'No search query provided'}), 400
 
-        tracks = []
-        for track in results['tracks']['items']:
-            try:
-                track_data = {
-                    'id': track['id'],
-                    'name': track['name'],
-                    'artist': track['artists'][0]['name'] if track['artists'] else 'Unknown Artist',
-                    'album': track['album']['name'] if track['album'] else 'Unknown Album',
-                    'album_image': track['album']['images'][0]['url'] if track['album'].get('images') else None,
-                    'preview_url': track['preview_url'],
-                    'external_url': track['external_urls'].get('spotify', ''),
-                    'uri': track['uri']
-                }
-                tracks.append(track_data)
-                print(f"Found track: {track_data['name']} by {track_data['artist']}")
-            except Exception as e:
-                print(f"Error processing track: {str(e)}")
-                continue
+        # As the user refines a query, results already fetched for the
+        # start of it can often answer it without calling Spotify
+        tracks = search_track_items(sp, query, 'US', limit=20, refine=refine_search_results)
 
         if not tracks:
-            print("No valid tracks found")
-            return jsonify({'error': 'No valid tracks found'}), 404
+            logger.info("No search results")
+            return jsonify({'error': 'No results found'}), 404
 
-        # Sort by popularity if available
-        tracks.sort(key=lambda x: x.get('popularity', 0), reverse=True)
-        print(f"Returning {len(tracks)} tracks")
-
-        return jsonify({
-            'tracks': tracks,
-            'message': f'Found {len(tracks)} tracks'
-        })
+        log_pipeline.annotate(tracks=len(tracks))
+        return tracks_response(tracks, message=f'Found {len(tracks)} tracks')
 
     except Exception as e:
-        print(f"Search error: {str(e)}")
+        logger.error("Search error: %s", e)
+        if is_auth_error(e):
+            return jsonify({'error': 'Session expired, please login again'}), 401
+        if isinstance(e, SpotifyRateLimited):
+            return rate_limited_response(e)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/create-playlist', methods=['POST'])
@@ -508,8 +860,10 @@ def create_playlist():
         if 'token_info' not in session:
             return jsonify({'error': 'Please login first'}), 401
 
-        token_info = session['token_info']
-        sp = spotipy.Spotify(auth=token_info['access_token'])
+        token_info = fresh_token_info()
+        if not token_info:
+            return jsonify({'error': 'Session expired, please login again'}), 401
+        sp = spotify_client(token_info['access_token'])
 
         data = request.get_json()
         if not data or 'name' not in data or 'tracks' not in data:
@@ -526,41 +880,30 @@ def create_playlist():
 
         # Get user ID
         try:
-            user = sp.current_user()
-            user_id = user['id']
+            user_id = get_spotify_profile(sp, token_info)['id']
         except Exception as e:
-            print(f"Failed to get user: {str(e)}")
+            logger.error("Failed to get user: %s", e)
+            if isinstance(e, SpotifyRateLimited):
+                return rate_limited_response(e)
             return jsonify({'error': 'Failed to get user info'}), 500
 
-        # Create playlist
-        try:
-            playlist = sp.user_playlist_create(
-                user=user_id,
-                name=playlist_name,
-                public=True,
-                description=f'Created with Mood Music App on {datetime.now().strftime("%Y-%m-%d")}'
-            )
-        except Exception as e:
-            print(f"Failed to create playlist: {str(e)}")
-            return jsonify({'error': 'Failed to create playlist'}), 500
-
-        # Add tracks to playlist (in batches of 100 as per Spotify API limits)
-        try:
-            for i in range(0, len(track_uris), 100):
-                batch = track_uris[i:i + 100]
-                sp.playlist_add_items(playlist['id'], batch)
-        except Exception as e:
-            print(f"Failed to add tracks: {str(e)}")
-            return jsonify({'error': 'Failed to add tracks to playlist'}), 500
+        # Create the playlist and add its tracks in the background
+        job_id = playlist_jobs.submit(
+            spotify_client(token_info['access_token'], priority=BACKGROUND),
+            user_id, playlist_name, track_uris,
+            public=True,
+            description=f'Created with Mood Music App on {datetime.now().strftime("%Y-%m-%d")}'
+        )
 
         return jsonify({
             'success': True,
-            'message': 'Playlist created successfully!',
-            'playlist_url': playlist['external_urls']['spotify']
-        })
+            'message': 'Creating your playlist...',
+            'job_id': job_id,
+            'status_url': url_for('get_playlist_job', job_id=job_id)
+        }), 202
 
     except Exception as e:
-        print(f"Create playlist error: {str(e)}")
+        logger.error("Create playlist error: %s", e)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/save-playlist', methods=['POST'])
@@ -570,16 +913,13 @@ def save_playlist():
         if not sp:
             return jsonify({'error': 'Please login first'}), 401
 
-        user = sp.current_user()
-        user_id = user['id']
+        user_id = get_spotify_profile(sp, session['token_info'])['id']
         
         playlist_data = request.json
         mood = playlist_data.get('mood', 'Unknown Mood')
         songs = playlist_data.get('songs', [])
         
-        # Create a new playlist in Spotify
         playlist_name = f"{mood.capitalize()} Mood - {datetime.now().strftime('%Y-%m-%d %H:%M')}"
-        playlist = sp.user_playlist_create(user_id, playlist_name, public=True)
         
         # Get track URIs
         track_uris = []
@@ -588,29 +928,111 @@ def save_playlist():
             track_id = song['link'].split('/')[-1]
             track_uris.append(f"spotify:track:{track_id}")
         
-        # Add tracks to the playlist
-        if track_uris:
-            sp.playlist_add_items(playlist['id'], track_uris)
-        
-        # Also save to session for local reference
-        if 'playlists' not in session:
-            session['playlists'] = []
+        # Also keep it in the user's history for local reference, once
+        # the background job has created it in Spotify
         playlist_data['timestamp'] = datetime.now().isoformat()
-        playlist_data['spotify_url'] = playlist['external_urls']['spotify']
-        session['playlists'].append(playlist_data)
+        migrate_session_playlists(user_id)
+
+        def record_history(job):
+            playlist_data['spotify_url'] = job['playlist_url']
+            playlist_history.add(user_id, playlist_data)
+
+        background_sp = spotify_client(session['token_info']['access_token'], priority=BACKGROUND)
+        job_id = playlist_jobs.submit(background_sp, user_id, playlist_name, track_uris,
+                                      public=True, on_created=record_history)
         
         return jsonify({
-            'status': 'success',
-            'message': 'Playlist saved to Spotify!',
-            'spotify_url': playlist['external_urls']['spotify']
-        })
+            'status': 'accepted',
+            'message': 'Saving playlist to Spotify...',
+            'job_id': job_id,
+            'status_url': url_for('get_playlist_job', job_id=job_id)
+        }), 202
         
     except Exception as e:
+        if is_auth_error(e):
+            return jsonify({'error': 'Session expired, please login again'}), 401
+        if isinstance(e, SpotifyRateLimited):
+            return rate_limited_response(e)
         return jsonify({'error': str(e)}), 500
 
+def get_user_job(job_id):
+    """Look up a playlist job belonging to the logged-in Spotify user"""
+    profile = session.get('token_info', {}).get('profile')
+    job = playlist_jobs.get(job_id)
+    if not profile or not job or job['user_id'] != profile['id']:
+        return None
+    return job
+
+@app.route('/api/playlist-jobs/<job_id>')
+def get_playlist_job(job_id):
+    if 'token_info' not in session:
+        return jsonify({'error': 'Please login first'}), 401
+
+    job = get_user_job(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(playlist_jobs.public_view(job))
+
+@app.route('/api/playlist-jobs/<job_id>/retry', methods=['POST'])
+def retry_playlist_job(job_id):
+    if 'token_info' not in session:
+        return jsonify({'error': 'Please login first'}), 401
+
+    job = get_user_job(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+
+    token_info = fresh_token_info()
+    if not token_info:
+        return jsonify({'error': 'Session expired, please login again'}), 401
+
+    sp = spotify_client(token_info['access_token'], priority=BACKGROUND)
+    if not playlist_jobs.retry(sp, job_id):
+        return jsonify({'error': 'Nothing to retry'}), 409
+    return jsonify({
+        'success': True,
+        'job_id': job_id,
+        'status_url': url_for('get_playlist_job', job_id=job_id)
+    }), 202
+
 @app.route('/api/saved-playlists')
+@cached_json('private, no-cache')
 def get_saved_playlists():
-    return jsonify(session.get('playlists', []))
+    """A page of saved playlists, newest first; pass next_cursor back as
+    ?cursor= for the next page"""
+    try:
+        limit = min(max(int(request.args.get('limit', 20)), 1), 100)
+    except ValueError:
+        return jsonify({'error': 'Invalid limit'}), 400
+
+    profile = session.get('token_info', {}).get('profile')
+    if not profile:
+        return jsonify({'playlists': list(reversed(session.get('playlists', [])))[:limit], 'next_cursor': None})
+
+    migrate_session_playlists(profile['id'])
+    try:
+        playlists, next_cursor = playlist_history.list(profile['id'], limit, request.args.get('cursor'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'playlists': playlists, 'next_cursor': next_cursor})
+
+@app.route('/api/stats')
+def get_stats():
+    return jsonify({
+        'search_cache': search_cache.stats(),
+        'http_pool': pool_stats(),
+        'spotify_rate_limit': spotify_limiter.stats(),
+        'playlist_snapshots': playlist_snapshots.status(),
+        'track_index': track_index.stats() if track_index is not None else None,
+        'spotify_tokens': token_manager.stats(),
+        'users': user_store.stats(),
+        'concurrency': concurrency_limiter.stats()
+    })
+
+@app.route('/metrics')
+def get_metrics():
+    """Prometheus metrics, summed over all workers when Redis is configured"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/logout')
 def logout():
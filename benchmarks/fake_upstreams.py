@@ -0,0 +1,237 @@
+"""Local stand-ins for the Spotify Web API, Spotify accounts service and
+OpenWeatherMap, for load testing without touching the real services.
+
+Responses are deterministic (tracks and weather are derived from the
+query), and every request can be delayed and can fail with a 500 or a 429
+with Retry-After. Run on its own and point the app at it with:
+
+    SPOTIFY_API_URL=http://127.0.0.1:8900/v1
+    SPOTIFY_ACCOUNTS_URL=http://127.0.0.1:8900
+    OPENWEATHER_BASE_URL=http://127.0.0.1:8900/data/2.5/weather
+
+    python benchmarks/fake_upstreams.py [--port 8900] [--latency 0.08] [--rate-limit-rate 0.01]
+
+GET /_stats returns the number of calls per endpoint.
+"""
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+WEATHER = ('Clear', 'Rain', 'Clouds', 'Snow', 'Thunderstorm')
+
+
+class Faults:
+    """Latency and failure injection for the fake upstreams"""
+
+    def __init__(self, latency=0.08, jitter=0.5, error_rate=0.0, rate_limit_rate=0.0, retry_after=1):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+
+    def delay(self):
+        spread = self.latency * self.jitter
+        return max(0.0, random.uniform(self.latency - spread, self.latency + spread))
+
+    def failure(self):
+        """(status, headers) to fail with, or None"""
+        roll = random.random()
+        if roll < self.rate_limit_rate:
+            return 429, {'Retry-After': str(self.retry_after)}
+        if roll < self.rate_limit_rate + self.error_rate:
+            return 500, {}
+        return None
+
+
+def _seed(*parts):
+    return hashlib.sha1(':'.join(str(part) for part in parts).encode()).hexdigest()[:12]
+
+
+def fake_track(seed, i):
+    track_id = _seed(seed, i)
+    return {
+        'id': track_id,
+        'name': f"Track {track_id[:6]}",
+        'uri': f"spotify:track:{track_id}",
+        'artists': [{'name': f"Artist {track_id[6:9]}"}],
+        'album': {'name': f"Album {track_id[9:]}", 'images': [{'url': f"https://i.scdn.co/image/{track_id}"}]},
+        'preview_url': f"https://p.scdn.co/mp3-preview/{track_id}" if i % 3 else None,
+        'external_urls': {'spotify': f"https://open.spotify.com/track/{track_id}"}
+    }
+
+
+class FakeUpstreamHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def _handle(self, method):
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+
+        if url.path == '/_stats':
+            return self._send(200, dict(self.server.calls))
+
+        route = self._route(method, url.path)
+        if route is None:
+            return self._send(404, {'error': {'status': 404, 'message': 'Not found'}})
+        name, handler, args = route
+        with self.server.lock:
+            self.server.calls[name] += 1
+
+        faults = self.server.weather_faults if name == 'weather' else self.server.spotify_faults
+        time.sleep(faults.delay())
+        failure = faults.failure()
+        if failure:
+            status, headers = failure
+            with self.server.lock:
+                self.server.calls[f"{name}:{status}"] += 1
+            return self._send(status, {'error': {'status': status, 'message': 'Injected failure'}}, headers)
+
+        status, payload = handler(self, params, body, *args)
+        self._send(status, payload)
+
+    def _route(self, method, path):
+        # spotipy adds a trailing slash to some paths
+        path = path.rstrip('/')
+        for route_method, pattern, name, handler in ROUTES:
+            match = re.fullmatch(pattern, path)
+            if route_method == method and match:
+                return name, handler, match.groups()
+        return None
+
+    def _send(self, status, payload, headers=None):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _user(self):
+        token = self.headers.get('Authorization', '').split(' ')[-1]
+        return token[len('token-'):] if token.startswith('token-') else 'app'
+
+    def token(self, params, body):
+        form = {key: values[0] for key, values in parse_qs(body.decode()).items()}
+        user = form.get('code') or form.get('refresh_token', '').replace('refresh-', '') or 'app'
+        return 200, {
+            'access_token': f"token-{user}",
+            'token_type': 'Bearer',
+            'expires_in': 3600,
+            'refresh_token': f"refresh-{user}",
+            'scope': form.get('scope', '')
+        }
+
+    def me(self, params, body):
+        user = self._user()
+        return 200, {'id': user, 'display_name': user, 'country': 'US', 'email': f"{user}@example.com"}
+
+    def search(self, params, body):
+        limit = int(params.get('limit', 10))
+        seed = _seed(params.get('q', ''), params.get('market'))
+        return 200, {'tracks': {'items': [fake_track(seed, i) for i in range(limit)], 'total': 1000}}
+
+    def playlist(self, params, body, playlist_id):
+        return 200, {'id': playlist_id, 'snapshot_id': _seed(playlist_id, 'snapshot')}
+
+    def playlist_tracks(self, params, body, playlist_id):
+        limit = int(params.get('limit', 100))
+        return 200, {'items': [{'track': fake_track(playlist_id, i)} for i in range(limit)]}
+
+    def create_playlist(self, params, body, user_id):
+        playlist_id = uuid.uuid4().hex[:22]
+        return 201, {
+            'id': playlist_id,
+            'name': json.loads(body or b'{}').get('name'),
+            'external_urls': {'spotify': f"https://open.spotify.com/playlist/{playlist_id}"}
+        }
+
+    def add_items(self, params, body, playlist_id):
+        return 201, {'snapshot_id': uuid.uuid4().hex}
+
+    def weather(self, params, body):
+        seed = int(_seed(params.get('q', '').lower()), 16)
+        return 200, {
+            'weather': [{'main': WEATHER[seed % len(WEATHER)]}],
+            'main': {'temp': seed % 35}
+        }
+
+
+ROUTES = [
+    ('POST', r'/api/token', 'token', FakeUpstreamHandler.token),
+    ('GET', r'/v1/me', 'me', FakeUpstreamHandler.me),
+    ('GET', r'/v1/search', 'search', FakeUpstreamHandler.search),
+    ('GET', r'/v1/playlists/([^/]+)', 'playlist', FakeUpstreamHandler.playlist),
+    ('GET', r'/v1/playlists/([^/]+)/tracks', 'playlist_tracks', FakeUpstreamHandler.playlist_tracks),
+    ('POST', r'/v1/users/([^/]+)/playlists', 'create_playlist', FakeUpstreamHandler.create_playlist),
+    ('POST', r'/v1/playlists/([^/]+)/tracks', 'add_items', FakeUpstreamHandler.add_items),
+    ('GET', r'/data/2\.5/weather', 'weather', FakeUpstreamHandler.weather),
+]
+
+
+def start(host='127.0.0.1', port=0, spotify_faults=None, weather_faults=None):
+    """Serve the fakes from a background thread; returns the server (see server_address)"""
+    server = ThreadingHTTPServer((host, port), FakeUpstreamHandler)
+    server.daemon_threads = True
+    server.spotify_faults = spotify_faults or Faults()
+    server.weather_faults = weather_faults or Faults()
+    server.calls = Counter()
+    server.lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def add_fault_arguments(parser):
+    parser.add_argument('--latency', type=float, default=0.08, help='mean Spotify latency in seconds')
+    parser.add_argument('--weather-latency', type=float, default=0.05, help='mean OpenWeather latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0.5, help='latency spread as a fraction of the mean')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of calls failing with 500')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='fraction of calls failing with 429')
+    parser.add_argument('--retry-after', type=int, default=1, help='Retry-After sent with 429s')
+
+
+def faults_from_args(args):
+    spotify = Faults(args.latency, args.jitter, args.error_rate, args.rate_limit_rate, args.retry_after)
+    weather = Faults(args.weather_latency, args.jitter, args.error_rate, args.rate_limit_rate, args.retry_after)
+    return spotify, weather
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    add_fault_arguments(parser)
+    args = parser.parse_args()
+
+    server = start(args.host, args.port, *faults_from_args(args))
+    print(f"Fake upstreams listening on http://{args.host}:{server.server_address[1]}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
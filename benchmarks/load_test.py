@@ -0,0 +1,316 @@
+"""Load test the app under gunicorn against local Spotify and OpenWeather fakes.
+
+Starts benchmarks/fake_upstreams.py in this process and the app with
+gunicorn.conf.py (4 workers, as deployed) pointed at it, logs virtual users
+in through the normal /callback flow, then runs each scenario for a fixed
+time and reports throughput, p50/p95/p99 latency and upstream calls per
+request as JSON. Run from the repository root:
+
+    python benchmarks/load_test.py [--duration 10] [--concurrency 16] [--output run.json]
+    python benchmarks/load_test.py --rate-limit-rate 0.05 --compare run.json
+    python benchmarks/load_test.py --worker-class gevent --concurrency 64 --compare run.json
+
+REDIS_URL and other settings in the environment are passed on to the app.
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import fake_upstreams  # noqa: E402
+
+MOODS = ('happy', 'sad', 'energetic', 'calm', 'romantic')
+QUERIES = ('summer', 'love songs', 'rainy day', 'workout', 'focus', 'road trip', 'sleep', 'party')
+# What a search box sends as the queries are typed, a keystroke at a time
+TYPED = tuple(query[:n] for query in QUERIES for n in range(2, len(query) + 1))
+TEXTS = (
+    'What a great day, everything is going well',
+    'Feeling a bit down and tired today',
+    'Not sure how I feel, just another day',
+    'I am so excited for the weekend!',
+)
+CITIES = ('London', 'Kathmandu', 'Tokyo', 'New York', 'Sydney', 'Berlin', 'Lagos', 'Lima')
+
+
+def mood_recommendations(http, base, i):
+    return http.get(f"{base}/api/mood-based-recommendations", params={'mood': MOODS[i % len(MOODS)]})
+
+
+def playlist_recommendations(http, base, i):
+    return http.get(f"{base}/api/get-recommendations", params={'mood': MOODS[i % len(MOODS)]})
+
+
+def bulk_recommendations(http, base, i):
+    # All five moods side by side, as the mood widget asks for them
+    return http.get(f"{base}/api/bulk-recommendations", params={'moods': ','.join(MOODS)})
+
+
+def search(http, base, i):
+    return http.get(f"{base}/api/search", params={'query': QUERIES[i % len(QUERIES)]})
+
+
+def typeahead(http, base, i):
+    return http.get(f"{base}/api/search", params={'query': TYPED[i % len(TYPED)]})
+
+
+def create_playlist(http, base, i):
+    tracks = [f"{i:06d}{n:016d}" for n in range(20)]
+    return http.post(f"{base}/api/create-playlist", json={'name': f"Load test {i}", 'tracks': tracks})
+
+
+HTTP_SCENARIOS = {
+    'mood-based-recommendations': mood_recommendations,
+    'get-recommendations': playlist_recommendations,
+    'bulk-recommendations': bulk_recommendations,
+    'search': search,
+    'typeahead': typeahead,
+    'create-playlist': create_playlist,
+}
+SCENARIOS = list(HTTP_SCENARIOS) + ['combine-moods']
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, max(0, math.ceil(p / 100 * len(values)) - 1))]
+
+
+def summarize(samples, elapsed, upstream_before, upstream_after):
+    latencies = sorted(latency for latency, _ in samples)
+    statuses = Counter(str(status) for _, status in samples)
+    errors = sum(count for status, count in statuses.items() if not status.startswith(('2', '3')))
+    upstream = {name: upstream_after.get(name, 0) - upstream_before.get(name, 0)
+                for name in upstream_after}
+    report = {
+        'requests': len(samples),
+        'errors': errors,
+        'statuses': dict(statuses),
+        'throughput_rps': round(len(samples) / elapsed, 2),
+        'latency_ms': {},
+        'upstream_calls_per_request': {
+            name: round(count / len(samples), 3) for name, count in sorted(upstream.items()) if count
+        } if samples else {}
+    }
+    if latencies:
+        report['latency_ms'] = {
+            'mean': round(sum(latencies) / len(latencies) * 1000, 2),
+            'p50': round(percentile(latencies, 50) * 1000, 2),
+            'p95': round(percentile(latencies, 95) * 1000, 2),
+            'p99': round(percentile(latencies, 99) * 1000, 2),
+            'max': round(latencies[-1] * 1000, 2)
+        }
+    return report
+
+
+def run_load(work, workers, duration):
+    """Call work(worker, i) from `workers` threads for `duration` seconds.
+
+    Returns the (latency, status) samples and the elapsed time.
+    """
+    samples = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def loop(worker):
+        local = []
+        i = worker
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                status = work(worker, i)
+            except Exception as e:
+                status = type(e).__name__
+            local.append((time.perf_counter() - start, status))
+            i += workers
+        with lock:
+            samples.extend(local)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=loop, args=(worker,)) for worker in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples, time.perf_counter() - started
+
+
+def upstream_calls(server):
+    return dict(server.calls)
+
+
+def start_app(port, workers, upstream_url, log, workdir, worker_class=None):
+    env = dict(os.environ)
+    if worker_class:
+        env['GUNICORN_WORKER_CLASS'] = worker_class
+    env.update({
+        'SPOTIFY_CLIENT_ID': env.get('SPOTIFY_CLIENT_ID', 'load-test'),
+        'SPOTIFY_CLIENT_SECRET': env.get('SPOTIFY_CLIENT_SECRET', 'load-test'),
+        'SPOTIFY_API_URL': f"{upstream_url}/v1",
+        'SPOTIFY_ACCOUNTS_URL': upstream_url,
+        'OPENWEATHER_BASE_URL': f"{upstream_url}/data/2.5/weather",
+        'SECRET_KEY': env.get('SECRET_KEY', 'load-test'),
+    })
+    # Run from a scratch directory so session files and spotipy's token
+    # cache don't land in the checkout
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', os.path.join(ROOT, 'gunicorn.conf.py'),
+         '--pythonpath', ROOT, '--bind', f"127.0.0.1:{port}", '--workers', str(workers), 'app:app'],
+        cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT
+    )
+    base = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with status {process.returncode}")
+        try:
+            if requests.get(base + '/', timeout=1).status_code == 200:
+                return process, base
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError('App did not start within 60 seconds')
+
+
+def log_in(base, http, user):
+    """Log a virtual user in through the OAuth callback, returning whether it worked"""
+    http.cookies.clear()
+    response = http.get(f"{base}/callback", params={'code': user}, allow_redirects=False, timeout=30)
+    if response.status_code != 302:
+        return False
+    # The callback redirects home whether or not it worked, and keeps the
+    # token only once the profile is fetched. Job lookups need that token:
+    # a logged-in user gets a 404 for an unknown job, anyone else a 401.
+    return http.get(f"{base}/api/playlist-jobs/load-test", timeout=30).status_code == 404
+
+
+def log_in_users(base, users):
+    """One logged-in HTTP session per virtual user"""
+    sessions = []
+    for n in range(users):
+        http = requests.Session()
+        if not log_in(base, http, f"user{n}"):
+            raise RuntimeError(f"Login for user{n} failed, see --app-log")
+        sessions.append(http)
+    return sessions
+
+
+def http_work(scenario, sessions, base):
+    def work(worker, i):
+        status = scenario(sessions[worker], base, i).status_code
+        if status == 401:
+            # The app drops the session on some upstream errors; log back in
+            # as a user would, the 401 still counts as an error
+            log_in(base, sessions[worker], f"user{worker}")
+        return status
+    return work
+
+
+def run_combine_moods(upstream_url, workers, duration):
+    from mood_detector import MoodDetector
+    detector = MoodDetector(base_url=f"{upstream_url}/data/2.5/weather")
+
+    def work(worker, i):
+        # Free-form text rarely repeats, so keep it out of the sentiment cache
+        detector.combine_moods(f"{TEXTS[i % len(TEXTS)]} ({i})", CITIES[i % len(CITIES)])
+        return 200
+
+    return run_load(work, workers, duration)
+
+
+def compare(report, baseline):
+    """Print p95 latency and throughput changes against a previous report"""
+    print(f"{'scenario':<28}{'p95 ms':>20}{'throughput rps':>24}", file=sys.stderr)
+    for name, current in report['scenarios'].items():
+        previous = baseline.get('scenarios', {}).get(name)
+        if not previous or not current['latency_ms'] or not previous['latency_ms']:
+            continue
+        p95 = (previous['latency_ms']['p95'], current['latency_ms']['p95'])
+        rps = (previous['throughput_rps'], current['throughput_rps'])
+        print(f"{name:<28}{p95[0]:>8} -> {p95[1]:<8}({change(*p95)})"
+              f"{rps[0]:>10} -> {rps[1]:<8}({change(*rps)})", file=sys.stderr)
+
+
+def change(before, after):
+    return f"{(after - before) / before * 100:+.1f}%" if before else 'n/a'
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument('--duration', type=float, default=10, help='seconds per scenario')
+    parser.add_argument('--concurrency', type=int, default=16, help='concurrent virtual users')
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn workers')
+    parser.add_argument('--worker-class', choices=('sync', 'gevent'), default='sync', help='gunicorn worker class')
+    parser.add_argument('--port', type=int, default=8901)
+    parser.add_argument('--app-log', default=os.devnull, help='file for the app output')
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    parser.add_argument('--compare', help='previous JSON report to compare against')
+    fake_upstreams.add_fault_arguments(parser)
+    args = parser.parse_args()
+
+    server = fake_upstreams.start(*(('127.0.0.1', 0) + fake_upstreams.faults_from_args(args)))
+    upstream_url = f"http://127.0.0.1:{server.server_address[1]}"
+    report = {
+        'commit': git_commit(),
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'config': {key: value for key, value in vars(args).items()
+                   if key not in ('output', 'compare', 'app_log', 'scenarios')},
+        'scenarios': {}
+    }
+
+    process = None
+    with open(args.app_log, 'ab') as log, tempfile.TemporaryDirectory() as workdir:
+        try:
+            if any(name in HTTP_SCENARIOS for name in args.scenarios):
+                process, base = start_app(args.port, args.workers, upstream_url, log, workdir, args.worker_class)
+                sessions = log_in_users(base, args.concurrency)
+
+            for name in args.scenarios:
+                before = upstream_calls(server)
+                if name == 'combine-moods':
+                    samples, elapsed = run_combine_moods(upstream_url, args.concurrency, args.duration)
+                else:
+                    samples, elapsed = run_load(
+                        http_work(HTTP_SCENARIOS[name], sessions, base), args.concurrency, args.duration)
+                report['scenarios'][name] = summarize(samples, elapsed, before, upstream_calls(server))
+                print(f"{name}: {report['scenarios'][name]['throughput_rps']} rps", file=sys.stderr)
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait(timeout=30)
+            server.shutdown()
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
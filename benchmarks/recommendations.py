@@ -0,0 +1,83 @@
+"""Measure track index build time and recommendation latency.
+
+Builds an index of synthetic tracks in a temporary directory and times
+top-k mood queries against it, with and without a market filter. Run from
+the repository root:
+
+    python benchmarks/recommendations.py [--tracks 1000000] [--queries 200]
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from track_index import FEATURES, MOOD_TARGETS, TrackIndex, build_index  # noqa: E402
+
+MARKETS = ['US', 'GB', 'DE', 'FR', 'JP', 'BR', 'IN', 'AU', 'CA', 'NP']
+
+
+def synthetic_tracks(count, seed=1):
+    rng = random.Random(seed)
+    for i in range(count):
+        features = {name: rng.random() for name in FEATURES}
+        features['tempo'] = rng.uniform(60, 200)
+        yield {
+            'id': f"track{i}",
+            'name': f"Track {i}",
+            'uri': f"spotify:track:track{i}",
+            'artists': [{'name': f"Artist {i % 5000}"}],
+            'album': {'name': f"Album {i % 20000}", 'images': []},
+            'preview_url': None,
+            'external_urls': {'spotify': f"https://open.spotify.com/track/track{i}"},
+            'available_markets': rng.sample(MARKETS, rng.randint(0, len(MARKETS))),
+            'audio_features': features
+        }
+
+
+def time_queries(index, queries, market):
+    moods = list(MOOD_TARGETS)
+    timings = []
+    for i in range(queries):
+        start = time.perf_counter()
+        index.recommend(moods[i % len(moods)], market=market)
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return {
+        'median_ms': round(statistics.median(timings) * 1000, 3),
+        'p95_ms': round(timings[int(len(timings) * 0.95) - 1] * 1000, 3)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tracks', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as path:
+        start = time.perf_counter()
+        count = build_index(synthetic_tracks(args.tracks), path)
+        build = time.perf_counter() - start
+
+        start = time.perf_counter()
+        index = TrackIndex(path)
+        opened = time.perf_counter() - start
+
+        print(json.dumps({
+            'tracks': count,
+            'build_seconds': round(build, 2),
+            'open_ms': round(opened * 1000, 3),
+            'any_market': time_queries(index, args.queries, None),
+            'market_filtered': time_queries(index, args.queries, 'NP')
+        }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
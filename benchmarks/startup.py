@@ -0,0 +1,71 @@
+"""Measure worker startup cost: app import time and first-request latency.
+
+Each measurement runs in a fresh interpreter so nothing is already
+imported. Run from the repository root:
+
+    python benchmarks/startup.py [--runs 5]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Run in the child interpreter. With preload, warm_up() runs before the
+# "first request" just as it does in the gunicorn master.
+PROBE = '''
+import json, sys, time
+preload = sys.argv[1] == 'preload'
+t0 = time.perf_counter()
+import app
+t1 = time.perf_counter()
+if preload:
+    app.warm_up()
+t2 = time.perf_counter()
+client = app.app.test_client()
+client.get('/')
+t3 = time.perf_counter()
+app.mood_detector.analyze_text_mood('a really good day')
+t4 = time.perf_counter()
+print(json.dumps({
+    'import': t1 - t0,
+    'warm_up': t2 - t1,
+    'first_page': t3 - t2,
+    'first_text_mood': t4 - t3,
+}))
+'''
+
+
+def measure(mode, runs):
+    samples = []
+    for _ in range(runs):
+        out = subprocess.run(
+            [sys.executable, '-c', PROBE, mode],
+            cwd=ROOT, capture_output=True, text=True, check=True
+        )
+        samples.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    return {
+        key: round(statistics.median(s[key] for s in samples) * 1000, 2)
+        for key in samples[0]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    report = {
+        'runs': args.runs,
+        'unit': 'ms (median)',
+        'lazy': measure('lazy', args.runs),
+        'preload': measure('preload', args.runs),
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
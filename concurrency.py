@@ -0,0 +1,88 @@
+import json
+import os
+import threading
+
+from werkzeug.wsgi import ClosingIterator
+
+import metrics
+
+# Requests a worker serves at once (0 for no limit), and how long a request
+# over the limit waits for a slot before it is turned away with a 503
+MAX_IN_FLIGHT = int(os.getenv('WORKER_MAX_IN_FLIGHT', '0'))
+QUEUE_TIMEOUT = float(os.getenv('WORKER_QUEUE_TIMEOUT', '5'))
+RETRY_AFTER = int(os.getenv('WORKER_RETRY_AFTER', '1'))
+
+# Never queued or rejected, so health checks and scrapes see a busy worker
+EXEMPT_PATHS = ('/metrics', '/api/stats')
+
+
+class ConcurrencyLimiter:
+    """WSGI middleware capping the requests in flight in this worker.
+
+    Under a green-thread worker each connection is cheap, so without a cap
+    a burst turns into thousands of upstream calls and every request slows
+    down. Requests over the cap wait up to `queue_timeout` seconds for a
+    slot, then get a 503 with Retry-After so clients and load balancers
+    back off.
+    """
+
+    def __init__(self, wsgi_app, limit=MAX_IN_FLIGHT, queue_timeout=QUEUE_TIMEOUT, retry_after=RETRY_AFTER):
+        self.wsgi_app = wsgi_app
+        self.limit = limit
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self._slots = threading.BoundedSemaphore(limit) if limit > 0 else None
+        self._lock = threading.Lock()
+        self._stats = {'in_flight': 0, 'waiting': 0, 'rejected': 0}
+
+    def __call__(self, environ, start_response):
+        if self._slots is None or environ.get('PATH_INFO') in EXEMPT_PATHS:
+            return self.wsgi_app(environ, start_response)
+
+        self._count('waiting', 1)
+        acquired = self._slots.acquire(timeout=self.queue_timeout)
+        self._count('waiting', -1)
+        if not acquired:
+            self._count('rejected', 1)
+            metrics.inc('http_requests_rejected_total')
+            return self._reject(start_response)
+
+        self._count('in_flight', 1)
+        try:
+            app_iter = self.wsgi_app(environ, start_response)
+        except BaseException:
+            self._release()
+            raise
+        # The slot is held until the server closes the response, so
+        # streamed bodies keep it until they're fully sent
+        return ClosingIterator(app_iter, self._release)
+
+    def _release(self):
+        self._count('in_flight', -1)
+        self._slots.release()
+
+    def _reject(self, start_response):
+        body = json.dumps({'error': 'Server busy, please retry shortly'}).encode()
+        start_response('503 Service Unavailable', [
+            ('Content-Type', 'application/json'),
+            ('Content-Length', str(len(body))),
+            ('Retry-After', str(self.retry_after))
+        ])
+        return [body]
+
+    def _count(self, name, amount):
+        with self._lock:
+            self._stats[name] += amount
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update({'limit': self.limit, 'queue_timeout': self.queue_timeout})
+        return stats
+
+
+def init_app(app):
+    """Wrap the app's WSGI callable in a ConcurrencyLimiter and return it"""
+    limiter = ConcurrencyLimiter(app.wsgi_app)
+    app.wsgi_app = limiter
+    return limiter
@@ -1,3 +1,48 @@
-xworkers = 4
+import gc
+import os
+
+# 'sync' serves one request at a time per worker. 'gevent' runs each
+# request in a green thread, so a worker keeps serving others while a
+# request waits on Spotify, OpenWeather, Redis or session files
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'sync')
+
+if worker_class == 'gevent':
+    # Patch sockets, threads and locks before the app is imported, so
+    # requests, redis-py, the thread pools and their locks all yield
+    from gevent import monkey
+    monkey.patch_all()
+
+    # Connections each worker accepts at once; WORKER_MAX_IN_FLIGHT (see
+    # concurrency.py) bounds how many of them run at the same time
+    worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', '100'))
+
+    # Size the pools for many concurrent requests per worker rather than
+    # one; explicit settings win
+    os.environ.setdefault('WORKER_MAX_IN_FLIGHT', '50')
+    os.environ.setdefault('HTTP_POOL_MAXSIZE', '50')
+    os.environ.setdefault('SEARCH_WORKERS', '50')
+    os.environ.setdefault('MOOD_SIGNAL_WORKERS', '50')
+    os.environ.setdefault('REDIS_MAX_CONNECTIONS', '100')
+
+workers = int(os.getenv('GUNICORN_WORKERS', '4'))
 bind = "0.0.0.0:10000"
 timeout = 120
+
+# Import the app once in the master so workers share its memory
+# copy-on-write instead of each importing and warming up separately
+preload_app = os.getenv('GUNICORN_PRELOAD', 'true').lower() in ('1', 'true', 'yes')
+
+
+def when_ready(server):
+    if preload_app:
+        from app import warm_up
+        warm_up()
+        # Keep the garbage collector from touching (and so copying) the
+        # preloaded objects in every worker
+        gc.freeze()
+
+
+def post_worker_init(worker):
+    if not preload_app:
+        from app import warm_up
+        warm_up()
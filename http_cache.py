@@ -0,0 +1,63 @@
+import gzip
+import hashlib
+import os
+from functools import wraps
+
+from flask import make_response, request
+
+import metrics
+
+GZIP_MIN_SIZE = int(os.getenv('GZIP_MIN_SIZE', '1024'))
+GZIP_LEVEL = int(os.getenv('GZIP_LEVEL', '6'))
+
+
+def cached_json(cache_control):
+    """Add validators, caching policy and compression to a JSON view.
+
+    Successful responses get a strong ETag computed from the JSON body
+    (which jsonify emits with sorted keys, so equal payloads hash equally)
+    and the given Cache-Control policy. A GET whose If-None-Match matches
+    gets an empty 304. Bodies of at least GZIP_MIN_SIZE bytes are gzipped
+    when the client accepts it; the gzipped variant has its own ETag.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            response = make_response(view(*args, **kwargs))
+            return finalize_json(response, cache_control)
+        return wrapper
+    return decorator
+
+
+def finalize_json(response, cache_control):
+    if response.is_streamed or response.mimetype != 'application/json':
+        return response
+
+    response.vary.add('Cookie')
+    if response.status_code != 200:
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+
+    response.headers['Cache-Control'] = cache_control
+    body = response.get_data()
+    etag = hashlib.sha256(body).hexdigest()[:32]
+
+    use_gzip = len(body) >= GZIP_MIN_SIZE and 'gzip' in request.accept_encodings
+    if len(body) >= GZIP_MIN_SIZE:
+        response.vary.add('Accept-Encoding')
+    tag = f"{etag}-gzip" if use_gzip else etag
+    response.set_etag(tag)
+
+    if request.method in ('GET', 'HEAD') and (
+            request.if_none_match.contains(etag) or request.if_none_match.contains(f"{etag}-gzip")):
+        metrics.cache_result('etag', 'hit')
+        response.status_code = 304
+        response.set_data(b'')
+        response.headers.pop('Content-Length', None)
+        return response
+
+    metrics.cache_result('etag', 'miss')
+    if use_gzip:
+        response.set_data(gzip.compress(body, compresslevel=GZIP_LEVEL))
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
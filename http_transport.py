@@ -0,0 +1,111 @@
+import atexit
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', '3.05'))
+READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', '10'))
+# Number of per-host pools kept, and keep-alive connections kept per host
+POOL_HOSTS = int(os.getenv('HTTP_POOL_HOSTS', '10'))
+POOL_MAXSIZE = int(os.getenv('HTTP_POOL_MAXSIZE', '10'))
+RETRIES = int(os.getenv('HTTP_RETRIES', '2'))
+BACKOFF_FACTOR = 0.3
+# The longest one request can take: every attempt timing out, plus the
+# backoff sleeps between them
+REQUEST_BUDGET = (CONNECT_TIMEOUT + READ_TIMEOUT) * (RETRIES + 1) + BACKOFF_FACTOR * 2 ** (RETRIES + 1)
+
+_session = None
+_session_pid = None
+_adapter = None
+_lock = threading.Lock()
+
+
+class SharedSession(requests.Session):
+    """The pooled session handed to short-lived clients.
+
+    spotipy closes the session it was given when a client is garbage
+    collected, which would drop the worker's keep-alive connections after
+    every request, so close() does nothing; close_session() closes it.
+    """
+
+    def close(self):
+        pass
+
+
+def _build_adapter():
+    # Only idempotent requests are retried, and 429s are left to the caller:
+    # urllib3 would otherwise sleep out their Retry-After itself, past the
+    # rate limiter's wait budget and before it can pause other callers
+    retry = Retry(
+        total=RETRIES,
+        connect=RETRIES,
+        read=RETRIES,
+        status=RETRIES,
+        backoff_factor=BACKOFF_FACTOR,
+        status_forcelist=(500, 502, 503, 504),
+        allowed_methods=frozenset(['GET', 'HEAD', 'OPTIONS']),
+        respect_retry_after_header=False,
+        raise_on_status=False
+    )
+    return HTTPAdapter(pool_connections=POOL_HOSTS, pool_maxsize=POOL_MAXSIZE, max_retries=retry)
+
+
+def get_session():
+    """Get the process-wide pooled requests session.
+
+    The session is rebuilt after a fork so gunicorn workers never share
+    sockets with the master.
+    """
+    global _session, _session_pid, _adapter
+    pid = os.getpid()
+    if _session is None or _session_pid != pid:
+        with _lock:
+            if _session is None or _session_pid != pid:
+                adapter = _build_adapter()
+                session = SharedSession()
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _adapter = adapter
+                _session = session
+                _session_pid = pid
+    return _session
+
+
+@atexit.register
+def close_session():
+    """Close this worker's pooled connections"""
+    global _session
+    with _lock:
+        if _session is not None and _session_pid == os.getpid():
+            requests.Session.close(_session)
+        _session = None
+
+
+def get_timeout():
+    """(connect, read) timeout tuple for outgoing requests"""
+    return (CONNECT_TIMEOUT, READ_TIMEOUT)
+
+
+def pool_stats():
+    """Connection pool usage per upstream host for this worker"""
+    if _adapter is None or _session_pid != os.getpid():
+        return {'hosts': {}, 'pool_maxsize': POOL_MAXSIZE, 'pool_hosts': POOL_HOSTS}
+
+    pools = _adapter.poolmanager.pools
+    hosts = {}
+    for key in list(pools.keys()):
+        pool = pools.get(key)
+        if pool is None:
+            continue
+        # The queue is pre-filled with None placeholders for unopened slots
+        idle = sum(1 for conn in list(pool.pool.queue) if conn is not None) if pool.pool else 0
+        hosts[f"{key.key_scheme}://{key.key_host}:{key.key_port}"] = {
+            'connections_opened': pool.num_connections,
+            'requests': pool.num_requests,
+            'idle': idle,
+            'maxsize': POOL_MAXSIZE
+        }
+    return {'hosts': hosts, 'pool_maxsize': POOL_MAXSIZE, 'pool_hosts': POOL_HOSTS}
@@ -0,0 +1,246 @@
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import uuid
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text')
+QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+REPEAT_WINDOW = float(os.getenv('LOG_REPEAT_WINDOW', '60'))
+REPEAT_LIMIT = int(os.getenv('LOG_REPEAT_LIMIT', '5'))
+
+_request = contextvars.ContextVar('request_log', default=None)
+
+
+def _route_settings(name, convert):
+    """Parse "route=value,route=value" settings such as LOG_ROUTE_LEVELS"""
+    settings = {}
+    for item in os.getenv(name, '').split(','):
+        if '=' in item:
+            route, value = item.rsplit('=', 1)
+            settings[route.strip()] = convert(value.strip())
+    return settings
+
+
+# e.g. LOG_ROUTE_LEVELS=/metrics=WARNING and LOG_ROUTE_SAMPLE_RATES=/api/search=0.1
+ROUTE_LEVELS = _route_settings('LOG_ROUTE_LEVELS', lambda value: logging.getLevelName(value.upper()))
+ROUTE_SAMPLE_RATES = _route_settings('LOG_ROUTE_SAMPLE_RATES', float)
+
+
+class RequestLog:
+    """Logging state of one request: its sampling decision and summary fields"""
+
+    def __init__(self, route, method):
+        self.id = uuid.uuid4().hex[:12]
+        self.route = route
+        self.method = method
+        self.level = ROUTE_LEVELS.get(route, logging.NOTSET)
+        self.sampled = random.random() < ROUTE_SAMPLE_RATES.get(route, 1.0)
+        self.started = time.perf_counter()
+        self.status = None
+        self.fields = {}
+        self.token = None
+
+
+def annotate(**fields):
+    """Add fields to the current request's summary record"""
+    request_log = _request.get()
+    if request_log is not None:
+        request_log.fields.update(fields)
+
+
+class RequestFilter(logging.Filter):
+    """Apply the route's level and sampling to records logged during a request.
+
+    Warnings and errors from unsampled requests are still kept.
+    """
+
+    def filter(self, record):
+        request_log = _request.get()
+        if request_log is None:
+            return True
+        if record.levelno < request_log.level:
+            return False
+        if not request_log.sampled and record.levelno < logging.WARNING:
+            return False
+        record.request_id = request_log.id
+        return True
+
+
+class RepeatFilter(logging.Filter):
+    """Let through at most `limit` copies of a warning or error per window.
+
+    Copies are matched on the unformatted message, so log with arguments
+    ("Search failed: %s", e) rather than pre-formatted strings. The first
+    copy after a window reports how many were dropped.
+    """
+
+    def __init__(self, window=REPEAT_WINDOW, limit=REPEAT_LIMIT):
+        super().__init__()
+        self.window = window
+        self.limit = limit
+        self._seen = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno < logging.WARNING or self.limit <= 0:
+            return True
+        # Summaries all share one message, so tell them apart by route
+        route = (getattr(record, 'fields', None) or {}).get('route')
+        key = (record.name, record.levelno, str(record.msg), route)
+        now = time.monotonic()
+        with self._lock:
+            started, count, dropped = self._seen.get(key, (now, 0, 0))
+            if now - started >= self.window:
+                started, count = now, 0
+                if dropped:
+                    record.msg = f"{record.msg} ({dropped} similar messages dropped)"
+                    dropped = 0
+            if count >= self.limit:
+                self._seen[key] = (started, count, dropped + 1)
+                return False
+            if len(self._seen) > 1000:
+                self._seen.clear()
+            self._seen[key] = (started, count + 1, dropped)
+        return True
+
+
+class StructuredFormatter(logging.Formatter):
+    """One line per record, as text or JSON, with any structured fields"""
+
+    def __init__(self, as_json=False):
+        super().__init__('%(asctime)s %(levelname)s %(name)s: %(message)s')
+        self.as_json = as_json
+
+    def format(self, record):
+        fields = dict(getattr(record, 'fields', None) or {})
+        request_id = getattr(record, 'request_id', None)
+        if request_id:
+            fields['request_id'] = request_id
+
+        if self.as_json:
+            entry = {
+                'time': self.formatTime(record),
+                'level': record.levelname,
+                'logger': record.name,
+                'message': record.getMessage()
+            }
+            entry.update(fields)
+            if record.exc_info:
+                entry['exception'] = self.formatException(record.exc_info)
+            return json.dumps(entry, default=str)
+
+        line = super().format(record)
+        if fields:
+            line += ' ' + ' '.join(f"{key}={value}" for key, value in fields.items())
+        return line
+
+
+class QueueLogHandler(logging.handlers.QueueHandler):
+    """Queue records for a background thread that writes them.
+
+    Request threads only pay for putting a record on the queue; if the
+    queue is full the record is dropped and counted rather than waited on.
+    The writer thread is (re)started in each process that logs, so it
+    survives gunicorn forking its workers.
+    """
+
+    def __init__(self, handlers, maxsize=QUEUE_SIZE):
+        super().__init__(queue.Queue(maxsize))
+        self.targets = handlers
+        self.maxsize = maxsize
+        self.dropped = 0
+        self._listener = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def emit(self, record):
+        if self._pid != os.getpid():
+            self._start()
+        super().emit(record)
+
+    def _start(self):
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            # A queue inherited through fork may hold the parent's records
+            self.queue = queue.Queue(self.maxsize)
+            self._listener = logging.handlers.QueueListener(self.queue, *self.targets, respect_handler_level=True)
+            self._listener.start()
+            self._pid = os.getpid()
+            atexit.register(self._stop, self._listener)
+
+    @staticmethod
+    def _stop(listener):
+        # Write out whatever is still queued
+        try:
+            listener.stop()
+        except Exception:
+            pass
+
+
+def configure(stream=None):
+    """Send all logging through the queue to stream (stdout by default),
+    replacing any handlers on the root logger"""
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(StructuredFormatter(as_json=LOG_FORMAT == 'json'))
+    handler = QueueLogHandler([output])
+    handler.addFilter(RequestFilter())
+    handler.addFilter(RepeatFilter())
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL)
+    return handler
+
+
+def init_app(app):
+    """Log one summary record per request instead of a line per step"""
+    logger = logging.getLogger('request')
+
+    @app.before_request
+    def start_request_log():
+        from flask import request
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        request_log = RequestLog(route, request.method)
+        request_log.token = _request.set(request_log)
+
+    @app.after_request
+    def record_status(response):
+        request_log = _request.get()
+        if request_log is not None:
+            request_log.status = response.status_code
+        return response
+
+    @app.teardown_request
+    def finish_request_log(exc):
+        request_log = _request.get()
+        if request_log is None:
+            return
+        status = request_log.status or 500
+        fields = {
+            'route': request_log.route,
+            'method': request_log.method,
+            'status': status,
+            'duration_ms': round((time.perf_counter() - request_log.started) * 1000, 2)
+        }
+        fields.update(request_log.fields)
+        level = logging.WARNING if status >= 500 or exc is not None else logging.INFO
+        logger.log(level, 'completed', extra={'fields': fields})
+        _request.reset(request_log.token)
@@ -0,0 +1,359 @@
+import contextvars
+import json
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+import redis
+from werkzeug.wsgi import ClosingIterator
+
+from redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 4, 8, 16, 32)
+
+# Services whose calls per request are always reported, zero included
+UPSTREAM_SERVICES = ('spotify', 'openweather')
+
+FAMILIES = {
+    'http_request_duration_seconds': ('histogram', 'Request latency by route'),
+    'http_requests_total': ('counter', 'Requests by route, method and status'),
+    'http_requests_rejected_total': ('counter', 'Requests turned away because the worker was at its concurrency limit'),
+    'http_request_upstream_calls': ('histogram', 'Upstream calls made per request'),
+    'http_request_service_seconds_total': ('counter', 'Time requests spent in each service'),
+    'span_duration_seconds': ('histogram', 'Duration of timed calls by service and operation'),
+    'spans_total': ('counter', 'Timed calls by service, operation and outcome'),
+    'cache_requests_total': ('counter', 'Cache lookups by cache and result'),
+    'cache_hit_ratio': ('gauge', 'Share of cache lookups answered from the cache'),
+}
+
+# Cache results that avoided doing the work again
+CACHE_HITS = ('hit', 'stale', 'prefix', 'coalesced')
+
+FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', '5'))
+SLOW_REQUEST_THRESHOLD = float(os.getenv('SLOW_REQUEST_THRESHOLD', '0'))
+SLOW_REQUEST_SAMPLE_RATE = float(os.getenv('SLOW_REQUEST_SAMPLE_RATE', '1'))
+NAMESPACE = 'metrics'
+
+_current = contextvars.ContextVar('request_trace', default=None)
+_lock = threading.Lock()
+_values = {}
+_pending = {}
+_pid = None
+_flusher_pid = None
+
+
+class RequestTrace:
+    """Spans recorded while serving one request"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.route = None
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, service, operation, start, duration, outcome):
+        with self._lock:
+            self.spans.append((service, operation, start - self.started, duration, outcome))
+
+    def breakdown(self):
+        with self._lock:
+            spans = list(self.spans)
+        return [
+            {'service': service, 'operation': operation, 'offset_ms': round(offset * 1000, 2),
+             'duration_ms': round(duration * 1000, 2), 'outcome': outcome}
+            for service, operation, offset, duration, outcome in sorted(spans, key=lambda span: span[2])
+        ]
+
+
+def _series(name, labels, le=None):
+    pairs = [f'{key}="{_escape(value)}"' for key, value in sorted(labels.items())]
+    if le is not None:
+        # Last, so a histogram's buckets sort together
+        pairs.append(f'le="{le}"')
+    return f"{name}{{{','.join(pairs)}}}" if pairs else name
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _check_pid():
+    # Don't report anything recorded in the master before forking
+    global _pid
+    if _pid != os.getpid():
+        _pid = os.getpid()
+        _values.clear()
+        _pending.clear()
+
+
+def _add(updates):
+    """Add {series: amount} to this worker's values and to what's pending for Redis"""
+    with _lock:
+        _check_pid()
+        for series, amount in updates.items():
+            _values[series] = _values.get(series, 0) + amount
+            _pending[series] = _pending.get(series, 0) + amount
+    _ensure_flusher()
+
+
+def inc(name, amount=1, **labels):
+    _add({_series(name, labels): amount})
+
+
+def observe(name, value, buckets=DURATION_BUCKETS, **labels):
+    updates = {
+        _series(f"{name}_bucket", labels, le=bound): 1
+        for bound in buckets if value <= bound
+    }
+    updates[_series(f"{name}_bucket", labels, le='+Inf')] = 1
+    updates[_series(f"{name}_sum", labels)] = value
+    updates[_series(f"{name}_count", labels)] = 1
+    _add(updates)
+
+
+def cache_result(cache, result):
+    """Count a cache lookup: hit, stale, prefix, coalesced or miss"""
+    inc('cache_requests_total', cache=cache, result=result)
+
+
+@contextmanager
+def span(service, operation):
+    """Time a call, in the metrics and in the current request's trace"""
+    start = time.perf_counter()
+    outcome = 'ok'
+    try:
+        yield
+    except BaseException:
+        outcome = 'error'
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        observe('span_duration_seconds', duration, service=service, operation=operation)
+        inc('spans_total', service=service, operation=operation, outcome=outcome)
+        trace = _current.get()
+        if trace is not None:
+            trace.add(service, operation, start, duration, outcome)
+
+
+def timed(service, operation=None):
+    """Decorator form of span(), named after the function by default"""
+    def decorator(fn):
+        name = operation or fn.__name__
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(service, name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def propagate(fn):
+    """Run fn in the caller's context, so spans from executor threads land
+    in the request that submitted them"""
+    context = contextvars.copy_context()
+
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        return context.run(fn, *args, **kwargs)
+    return wrapper
+
+
+def init_app(app):
+    """Trace every request: latency, status and the spans it made.
+
+    Wraps the WSGI app so session loading and saving fall inside the trace.
+    Streamed bodies run as the server reads them, so the trace stays current
+    for each chunk and is only finished once the body is closed.
+    """
+    wsgi_app = app.wsgi_app
+
+    def traced_wsgi_app(environ, start_response):
+        trace = RequestTrace()
+        status = []
+
+        def traced_start_response(code, headers, exc_info=None):
+            status.append(code.split(' ', 1)[0])
+            return start_response(code, headers, exc_info)
+
+        def finish():
+            finish_request(trace, environ.get('REQUEST_METHOD'), status[0] if status else '500')
+
+        token = _current.set(trace)
+        try:
+            app_iter = wsgi_app(environ, traced_start_response)
+        except BaseException:
+            finish()
+            raise
+        finally:
+            _current.reset(token)
+
+        callbacks = [app_iter.close] if hasattr(app_iter, 'close') else []
+        return ClosingIterator(_in_trace(trace, app_iter), callbacks + [finish])
+
+    @app.before_request
+    def name_route():
+        from flask import request
+        trace = _current.get()
+        if trace is not None:
+            trace.route = request.url_rule.rule if request.url_rule else 'unmatched'
+
+    app.wsgi_app = traced_wsgi_app
+
+
+def _in_trace(trace, app_iter):
+    """Iterate a response body with trace as the current request trace"""
+    chunks = iter(app_iter)
+    while True:
+        token = _current.set(trace)
+        try:
+            chunk = next(chunks)
+        except StopIteration:
+            return
+        finally:
+            _current.reset(token)
+        yield chunk
+
+
+def finish_request(trace, method, status):
+    duration = time.perf_counter() - trace.started
+    route = trace.route or 'unmatched'
+    observe('http_request_duration_seconds', duration, route=route)
+    inc('http_requests_total', route=route, method=method, status=status)
+
+    calls = dict.fromkeys(UPSTREAM_SERVICES, 0)
+    seconds = {}
+    for service, _, _, span_duration, _ in trace.spans:
+        if service in calls:
+            calls[service] += 1
+        seconds[service] = seconds.get(service, 0) + span_duration
+    for service, count in calls.items():
+        observe('http_request_upstream_calls', count, COUNT_BUCKETS, route=route, service=service)
+    for service, total in seconds.items():
+        inc('http_request_service_seconds_total', total, route=route, service=service)
+
+    if 0 < SLOW_REQUEST_THRESHOLD <= duration and random.random() < SLOW_REQUEST_SAMPLE_RATE:
+        logger.warning("Slow request", extra={'fields': {
+            'route': route,
+            'method': method,
+            'status': status,
+            'duration_ms': round(duration * 1000, 2),
+            'spans': json.dumps(trace.breakdown())
+        }})
+
+
+def _ensure_flusher():
+    global _flusher_pid
+    if _flusher_pid == os.getpid() or get_redis() is None or FLUSH_INTERVAL <= 0:
+        return
+    with _lock:
+        if _flusher_pid == os.getpid():
+            return
+        _flusher_pid = os.getpid()
+        threading.Thread(target=_flush_loop, daemon=True).start()
+
+
+def _flush_loop():
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        flush()
+
+
+def flush():
+    """Add this worker's pending values to the totals shared in Redis"""
+    redis_client = get_redis()
+    if redis_client is None:
+        return False
+    with _lock:
+        _check_pid()
+        pending = dict(_pending)
+        _pending.clear()
+    if not pending:
+        return True
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        for series, amount in pending.items():
+            pipe.hincrbyfloat(NAMESPACE, series, amount)
+        pipe.execute()
+        return True
+    except redis.RedisError as e:
+        logger.warning("Metrics flush error: %s", e)
+        with _lock:
+            for series, amount in pending.items():
+                _pending[series] = _pending.get(series, 0) + amount
+        return False
+
+
+def collect():
+    """All workers' values from Redis, or this worker's when there's no Redis.
+
+    Returns ({series: value}, shared).
+    """
+    if flush():
+        try:
+            raw = get_redis().hgetall(NAMESPACE)
+            return {key.decode() if isinstance(key, bytes) else key: float(value)
+                    for key, value in raw.items()}, True
+        except redis.RedisError as e:
+            logger.warning("Metrics read error: %s", e)
+    with _lock:
+        return dict(_values), False
+
+
+def render():
+    """Prometheus text exposition of the collected metrics"""
+    values, shared = collect()
+    values.update(_hit_ratios(values))
+
+    families = {}
+    for series, value in values.items():
+        name = series.split('{', 1)[0]
+        family = name
+        for suffix in ('_bucket', '_sum', '_count'):
+            if name.endswith(suffix) and name[:-len(suffix)] in FAMILIES:
+                family = name[:-len(suffix)]
+        families.setdefault(family, []).append((series, value))
+
+    lines = [] if shared else ['# Metrics from this worker only (REDIS_URL is not set)']
+    for family in sorted(families):
+        kind, help_text = FAMILIES.get(family, ('untyped', ''))
+        lines.append(f"# HELP {family} {help_text}")
+        lines.append(f"# TYPE {family} {kind}")
+        for series, value in sorted(families[family], key=_series_order):
+            lines.append(f"{series} {_format(value)}")
+    return '\n'.join(lines) + '\n'
+
+
+def _hit_ratios(values):
+    totals = {}
+    prefix = 'cache_requests_total{'
+    for series, value in values.items():
+        if not series.startswith(prefix):
+            continue
+        labels = dict(pair.split('=', 1) for pair in series[len(prefix):-1].split(','))
+        cache = labels['cache'].strip('"')
+        hits, total = totals.get(cache, (0, 0))
+        if labels['result'].strip('"') in CACHE_HITS:
+            hits += value
+        totals[cache] = (hits, total + value)
+    return {
+        _series('cache_hit_ratio', {'cache': cache}): round(hits / total, 4)
+        for cache, (hits, total) in totals.items() if total
+    }
+
+
+def _series_order(item):
+    # Buckets in increasing order of their bound, +Inf last
+    base, has_bound, le = item[0].partition('le="')
+    return base, float(le.split('"', 1)[0].replace('+Inf', 'inf')) if has_bound else 0.0
+
+
+def _format(value):
+    return str(int(value)) if float(value).is_integer() else repr(round(value, 6))
@@ -1,67 +1,259 @@
-import requests
-from textblob import TextBlob
+from http_transport import get_session, get_timeout
+import metrics
+import logging
 import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime
 
+logger = logging.getLogger(__name__)
+
+_pattern_sentiment = None
+_pattern_lock = threading.Lock()
+
+
+def get_sentiment_lexicon():
+    """Get TextBlob's pattern sentiment lexicon, importing and parsing it on first use.
+
+    textblob pulls in nltk, which dominates import time, and only text
+    analysis needs it.
+    """
+    global _pattern_sentiment
+    if _pattern_sentiment is None:
+        with _pattern_lock:
+            if _pattern_sentiment is None:
+                from textblob.en import sentiment
+                if dict.__len__(sentiment) == 0:
+                    sentiment.load()
+                _pattern_sentiment = sentiment
+    return _pattern_sentiment
+
+
+def preload():
+    """Load the sentiment lexicon and numpy up front.
+
+    Called in the gunicorn master when preloading so workers share the
+    parsed data copy-on-write instead of each loading it.
+    """
+    get_sentiment_lexicon()
+    import numpy  # noqa: F401
+
+
+WEATHER_MOODS = {
+    'Clear': ('Happy', 'Energetic', 'Peaceful'),
+    'Rain': ('Melancholic', 'Relaxed', 'Contemplative'),
+    'Clouds': ('Calm', 'Focused', 'Mellow'),
+    'Snow': ('Magical', 'Peaceful', 'Romantic'),
+    'Thunderstorm': ('Intense', 'Dramatic', 'Energetic'),
+}
+
+# Text moods by polarity bucket: > 0.5, > 0, > -0.5, and the rest
+TEXT_MOOD_BUCKETS = (
+    ('Excited', 'Happy', 'Energetic'),
+    ('Positive', 'Upbeat', 'Cheerful'),
+    ('Mellow', 'Calm', 'Relaxed'),
+    ('Melancholic', 'Sad', 'Emotional')
+)
+
+# How much each signal counts when combining moods; within a signal, its
+# first mood counts fully and later ones progressively less
+SIGNAL_WEIGHTS = (('text', 3.0), ('weather', 2.0), ('time', 1.0))
+
+# What a signal contributes when it fails or misses the deadline. Neutral
+# carries no mood, so it is never scored
+NEUTRAL = 'Neutral'
+SIGNAL_DEFAULTS = {'text': [NEUTRAL], 'weather': [NEUTRAL], 'time': []}
+
+# Seconds combine_moods waits for its signals unless the caller says otherwise
+MOOD_DEADLINE = float(os.getenv('MOOD_DEADLINE', '2'))
+SIGNAL_WORKERS = int(os.getenv('MOOD_SIGNAL_WORKERS', '8'))
+
 class MoodDetector:
-    def __init__(self):
+    def __init__(self, base_url=None, weather_ttl=None, weather_error_ttl=None):
         self.weather_api_key = os.getenv('OPENWEATHER_API_KEY')
-        self.base_url = "http://api.openweathermap.org/data/2.5/weather"
+        self.base_url = base_url or os.getenv(
+            'OPENWEATHER_BASE_URL', "http://api.openweathermap.org/data/2.5/weather")
+
+        # Weather moods are cached per city; failures are cached for a
+        # shorter time so an outage doesn't multiply upstream load
+        if weather_ttl is None:
+            weather_ttl = int(os.getenv('WEATHER_CACHE_TTL', '600'))
+        if weather_error_ttl is None:
+            weather_error_ttl = int(os.getenv('WEATHER_ERROR_TTL', '30'))
+        self.weather_ttl = weather_ttl
+        self.weather_error_ttl = weather_error_ttl
+        self.weather_cache_size = int(os.getenv('WEATHER_CACHE_SIZE', '2048'))
+        self._weather_cache = {}
+        self._weather_inflight = {}
+        self._weather_lock = threading.Lock()
 
+        # Memoized text sentiment buckets, keyed by whitespace-normalized text
+        self.sentiment_cache_size = int(os.getenv('SENTIMENT_CACHE_SIZE', '4096'))
+        self._sentiment_cache = OrderedDict()
+        self._sentiment_lock = threading.Lock()
+
+        self._executor = None
+        self._executor_pid = None
+        self._executor_lock = threading.Lock()
+
+    @staticmethod
+    def _city_key(city):
+        return ' '.join(city.split()).casefold()
+
+    @metrics.timed('mood_detector')
     def get_weather_mood(self, city):
-        """Get mood suggestions based on weather"""
+        """Get mood suggestions based on weather.
+
+        Concurrent lookups for the same city share a single upstream call.
+        """
+        key = self._city_key(city)
+        while True:
+            with self._weather_lock:
+                entry = self._weather_cache.get(key)
+                if entry and entry[1] > time.monotonic():
+                    metrics.cache_result('weather', 'hit')
+                    return list(entry[0])
+
+                event = self._weather_inflight.get(key)
+                leader = event is None
+                if leader:
+                    event = threading.Event()
+                    self._weather_inflight[key] = event
+
+            if leader:
+                metrics.cache_result('weather', 'miss')
+                break
+            # Another thread is fetching this city; wait for its result
+            metrics.cache_result('weather', 'coalesced')
+            if not event.wait(get_timeout()[1]):
+                return ['Neutral']
+
+        moods, ok = ['Neutral'], False
+        try:
+            moods, ok = self._fetch_weather_mood(city)
+        finally:
+            ttl = self.weather_ttl if ok else self.weather_error_ttl
+            with self._weather_lock:
+                self._store_weather(key, moods, time.monotonic() + ttl)
+                self._weather_inflight.pop(key, None)
+            event.set()
+        return list(moods)
+
+    def _store_weather(self, key, moods, expires_at):
+        if len(self._weather_cache) >= self.weather_cache_size:
+            now = time.monotonic()
+            for stale_key in [k for k, v in self._weather_cache.items() if v[1] <= now]:
+                del self._weather_cache[stale_key]
+            while len(self._weather_cache) >= self.weather_cache_size:
+                del self._weather_cache[next(iter(self._weather_cache))]
+        self._weather_cache[key] = (tuple(moods), expires_at)
+
+    def _fetch_weather_mood(self, city):
+        """Call the weather API, returning (moods, ok)"""
         try:
             params = {
                 'q': city,
                 'appid': self.weather_api_key,
                 'units': 'metric'
             }
-            response = requests.get(self.base_url, params=params)
-            weather_data = response.json()
-            
-            weather_moods = {
-                'Clear': ['Happy', 'Energetic', 'Peaceful'],
-                'Rain': ['Melancholic', 'Relaxed', 'Contemplative'],
-                'Clouds': ['Calm', 'Focused', 'Mellow'],
-                'Snow': ['Magical', 'Peaceful', 'Romantic'],
-                'Thunderstorm': ['Intense', 'Dramatic', 'Energetic'],
-            }
+            with metrics.span('openweather', 'weather'):
+                response = get_session().get(self.base_url, params=params, timeout=get_timeout())
+                weather_data = response.json()
             
             weather_main = weather_data['weather'][0]['main']
             temp = weather_data['main']['temp']
             
             # Adjust mood based on temperature
             if temp > 25:  # Hot
-                return ['Summer', 'Energetic', 'Party']
+                return ['Summer', 'Energetic', 'Party'], True
             elif temp < 10:  # Cold
-                return ['Cozy', 'Calm', 'Introspective']
+                return ['Cozy', 'Calm', 'Introspective'], True
             
-            return weather_moods.get(weather_main, ['Neutral'])
+            return list(WEATHER_MOODS.get(weather_main, ['Neutral'])), True
         except Exception as e:
-            print(f"Error getting weather mood: {str(e)}")
-            return ['Neutral']
+            logger.warning("Error getting weather mood: %s", e)
+            return ['Neutral'], False
 
     def analyze_text_mood(self, text):
         """Analyze mood from user's text input"""
+        return self.analyze_text_moods([text])[0]
+
+    @metrics.timed('mood_detector')
+    def analyze_text_moods(self, texts):
+        """Analyze moods for many texts in one pass.
+
+        Returns one mood list per input, using the same buckets as
+        analyze_text_mood. Scores are memoized per normalized text.
+        """
+        results = [None] * len(texts)
+        pending = OrderedDict()
+
+        with self._sentiment_lock:
+            for i, text in enumerate(texts):
+                if not isinstance(text, str):
+                    results[i] = ['Neutral']
+                    continue
+                key = ' '.join(text.split())
+                bucket = self._sentiment_cache.get(key)
+                if bucket is not None:
+                    self._sentiment_cache.move_to_end(key)
+                    results[i] = list(TEXT_MOOD_BUCKETS[bucket])
+                    metrics.cache_result('sentiment', 'hit')
+                else:
+                    pending.setdefault(key, []).append(i)
+                    metrics.cache_result('sentiment', 'miss')
+
+        if not pending:
+            return results
+
         try:
-            analysis = TextBlob(text)
-            # Get polarity (-1 to 1) and subjectivity (0 to 1)
-            polarity = analysis.sentiment.polarity
-            subjectivity = analysis.sentiment.subjectivity
-            
-            # Map sentiment to moods
-            if polarity > 0.5:
-                return ['Excited', 'Happy', 'Energetic']
-            elif polarity > 0:
-                return ['Positive', 'Upbeat', 'Cheerful']
-            elif polarity > -0.5:
-                return ['Mellow', 'Calm', 'Relaxed']
-            else:
-                return ['Melancholic', 'Sad', 'Emotional']
+            buckets = self._score_buckets(list(pending))
         except Exception as e:
-            print(f"Error analyzing text mood: {str(e)}")
-            return ['Neutral']
+            logger.error("Error analyzing text mood: %s", e)
+            for indexes in pending.values():
+                for i in indexes:
+                    results[i] = ['Neutral']
+            return results
+
+        with self._sentiment_lock:
+            for (key, indexes), bucket in zip(pending.items(), buckets):
+                self._sentiment_cache[key] = bucket
+                for i in indexes:
+                    results[i] = list(TEXT_MOOD_BUCKETS[bucket])
+            while len(self._sentiment_cache) > self.sentiment_cache_size:
+                self._sentiment_cache.popitem(last=False)
+        return results
+
+    @staticmethod
+    @metrics.timed('textblob', 'sentiment')
+    def _score_buckets(texts):
+        """Score texts against the sentiment lexicon and return bucket indexes.
+
+        This is the same scoring TextBlob uses (mean polarity of the assessed
+        words), with the per-text averaging done for the whole batch at once.
+        """
+        import numpy as np
+
+        pattern_sentiment = get_sentiment_lexicon()
+        polarities = []
+        segments = []
+        for segment, text in enumerate(texts):
+            words = ' '.join(pattern_sentiment.tokenizer(text)).split()
+            for _, polarity, _, _ in pattern_sentiment.assessments((w.lower(), None) for w in words):
+                polarities.append(polarity)
+                segments.append(segment)
+
+        segments = np.asarray(segments, dtype=np.intp)
+        sums = np.bincount(segments, weights=np.asarray(polarities, dtype=float), minlength=len(texts))
+        counts = np.bincount(segments, minlength=len(texts))
+        polarity = sums / np.maximum(counts, 1)
 
+        # Map sentiment to moods
+        return np.select([polarity > 0.5, polarity > 0, polarity > -0.5], [0, 1, 2], 3).tolist()
+
+    @metrics.timed('mood_detector')
     def get_time_based_mood(self):
         """Get mood suggestions based on time of day"""
         hour = datetime.now().hour
@@ -79,15 +271,108 @@ class MoodDetector:
         else:
             return ['Night', 'Calm', 'Peaceful']
 
-    def combine_moods(self, text_input, city=None):
+    def combine_moods(self, text_input, city=None, deadline=None):
         """Combine different mood factors to get final mood suggestions"""
-        moods = set()
-        
-        # Get moods from different sources
-        if text_input:
-            moods.update(self.analyze_text_mood(text_input))
-        if city:
-            moods.update(self.get_weather_mood(city))
-        moods.update(self.get_time_based_mood())
-        
-        return list(moods)[:5]  # Return top 5 mood suggestions
+        return self.score_moods(text_input, city, deadline)['moods']
+
+    def score_moods(self, text_input, city=None, deadline=None):
+        """Scored mood suggestions for one input, see score_moods_batch"""
+        return self.score_moods_batch([(text_input, city)], deadline)[0]
+
+    @metrics.timed('mood_detector')
+    def score_moods_batch(self, inputs, deadline=None, limit=5):
+        """Score moods for many (text, city) pairs in one call.
+
+        The text, weather and time signals are evaluated concurrently; texts
+        are analyzed in one batch and each city's weather is looked up once.
+        A signal not done within `deadline` seconds (MOOD_DEADLINE by
+        default) contributes its default instead, and its lookup finishes in
+        the background. Returns, per input:
+
+            {'moods': [...], 'scores': {mood: score},
+             'signals': {name: {'moods': [...], 'status': 'ok', 'ms': 1.2}}}
+
+        with up to `limit` moods, highest score first and ties by name.
+        Signal timings are for the whole batch.
+        """
+        inputs = list(inputs)
+        deadline = MOOD_DEADLINE if deadline is None else deadline
+        started = time.perf_counter()
+        executor = self._get_executor()
+
+        texts = [text for text, _ in inputs if text]
+        cities = {}
+        for _, city in inputs:
+            if city:
+                cities.setdefault(self._city_key(city), city)
+
+        futures = {}
+        if texts:
+            futures['text'] = executor.submit(metrics.propagate(_timed_call), self.analyze_text_moods, texts)
+        for key, city in cities.items():
+            futures[key] = executor.submit(metrics.propagate(_timed_call), self.get_weather_mood, city)
+        time_signal = self._signal_result(*_timed_call(self.get_time_based_mood))
+
+        wait(futures.values(), timeout=max(0.0, deadline - (time.perf_counter() - started)))
+        elapsed = time.perf_counter() - started
+        outcomes = {key: self._future_result(future, elapsed) for key, future in futures.items()}
+
+        text_moods = iter(outcomes['text']['moods'] if 'text' in outcomes and outcomes['text']['status'] == 'ok'
+                          else [SIGNAL_DEFAULTS['text']] * len(texts))
+        results = []
+        for text, city in inputs:
+            signals = {'time': time_signal}
+            if text:
+                signals['text'] = dict(outcomes['text'], moods=next(text_moods))
+            if city:
+                outcome = outcomes[self._city_key(city)]
+                signals['weather'] = outcome if outcome['status'] == 'ok' else dict(
+                    outcome, moods=SIGNAL_DEFAULTS['weather'])
+            results.append(self._combine(signals, limit))
+        return results
+
+    @staticmethod
+    def _signal_result(moods, seconds, status='ok'):
+        return {'moods': moods, 'status': status, 'ms': round(seconds * 1000, 2)}
+
+    def _future_result(self, future, elapsed):
+        if not future.done():
+            return self._signal_result(None, elapsed, 'timeout')
+        try:
+            return self._signal_result(*future.result())
+        except Exception as e:
+            logger.warning("Mood signal failed: %s", e)
+            return self._signal_result(None, elapsed, 'error')
+
+    @staticmethod
+    def _combine(signals, limit):
+        scores = {}
+        for name, weight in SIGNAL_WEIGHTS:
+            moods = [mood for mood in (signals[name]['moods'] if name in signals else []) if mood != NEUTRAL]
+            for position, mood in enumerate(moods):
+                scores[mood] = scores.get(mood, 0.0) + weight * (len(moods) - position) / len(moods)
+
+        ranked = sorted(scores, key=lambda mood: (-scores[mood], mood))[:limit]
+        return {
+            'moods': ranked or [NEUTRAL],
+            'scores': {mood: round(scores[mood], 3) for mood in ranked},
+            'signals': signals
+        }
+
+    def _get_executor(self):
+        # Threads don't survive a fork, so each worker starts its own pool
+        pid = os.getpid()
+        if self._executor is None or self._executor_pid != pid:
+            with self._executor_lock:
+                if self._executor is None or self._executor_pid != pid:
+                    self._executor = ThreadPoolExecutor(max_workers=SIGNAL_WORKERS,
+                                                        thread_name_prefix='mood-signal')
+                    self._executor_pid = pid
+        return self._executor
+
+
+def _timed_call(fn, *args):
+    """(fn(*args), seconds it took)"""
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
@@ -0,0 +1,100 @@
+import hashlib
+import json
+import os
+import time
+from datetime import datetime
+
+from sqlite_db import SQLiteDatabase
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tracklists (
+    id TEXT PRIMARY KEY,
+    songs TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS playlists (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    saved_at REAL NOT NULL,
+    tracklist_id TEXT NOT NULL REFERENCES tracklists (id),
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS playlists_user_saved ON playlists (user_id, saved_at, id);
+"""
+
+
+class PlaylistHistory:
+    """Saved playlist history per Spotify user, in SQLite.
+
+    Entries are only ever appended. Each distinct track list is stored once
+    and referenced by its content hash, and a user's history is read a page
+    at a time, newest first, through an index on (user, saved time).
+
+    The database file is shared by every worker on the host.
+    """
+
+    def __init__(self, path=None):
+        self.db = SQLiteDatabase(path or os.getenv('PLAYLIST_HISTORY_DB', 'playlist_history.db'), SCHEMA)
+
+    def add(self, user_id, record):
+        """Append a saved playlist to the user's history"""
+        self.add_many(user_id, [record])
+
+    def add_many(self, user_id, records):
+        """Append saved playlists in one transaction, oldest first"""
+        self._insert(user_id, records)
+
+    def list(self, user_id, limit=20, cursor=None):
+        """A page of the user's saved playlists, newest first.
+
+        Returns (playlists, next_cursor); next_cursor is None on the last
+        page. Raises ValueError for a cursor this store didn't hand out.
+        """
+        query = ("SELECT p.id, p.saved_at, p.data, t.songs FROM playlists p "
+                 "JOIN tracklists t ON t.id = p.tracklist_id WHERE p.user_id = ?")
+        params = [user_id]
+        if cursor:
+            query += " AND (p.saved_at, p.id) < (?, ?)"
+            params += self._parse_cursor(cursor)
+        query += " ORDER BY p.saved_at DESC, p.id DESC LIMIT ?"
+        params.append(limit + 1)
+
+        rows = self.db.query(query, params)
+        playlists = [dict(json.loads(data), songs=json.loads(songs)) for _, _, data, songs in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            row_id, saved_at = rows[limit - 1][:2]
+            next_cursor = f"{saved_at!r}_{row_id}"
+        return playlists, next_cursor
+
+    @staticmethod
+    def _parse_cursor(cursor):
+        try:
+            saved_at, row_id = cursor.rsplit('_', 1)
+            return [float(saved_at), int(row_id)]
+        except ValueError:
+            raise ValueError('Invalid cursor')
+
+    def _insert(self, user_id, records):
+        tracklists = {}
+        rows = []
+        for record in records:
+            record = dict(record)
+            songs = json.dumps(record.pop('songs', []), separators=(',', ':'), sort_keys=True)
+            tracklist_id = hashlib.sha256(songs.encode()).hexdigest()[:32]
+            tracklists[tracklist_id] = songs
+            rows.append((user_id, self._saved_at(record), tracklist_id,
+                         json.dumps(record, separators=(',', ':'))))
+        if not rows:
+            return
+
+        self.db.transaction([
+            ("INSERT OR IGNORE INTO tracklists (id, songs) VALUES (?, ?)", tracklists.items()),
+            ("INSERT INTO playlists (user_id, saved_at, tracklist_id, data) VALUES (?, ?, ?, ?)", rows),
+        ])
+
+    @staticmethod
+    def _saved_at(record):
+        try:
+            return datetime.fromisoformat(record['timestamp']).timestamp()
+        except (KeyError, TypeError, ValueError):
+            return time.time()
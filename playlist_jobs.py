@@ -0,0 +1,218 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import redis
+
+logger = logging.getLogger(__name__)
+
+# Spotify accepts at most 100 items per add-items request
+BATCH_SIZE = 100
+
+
+class PlaylistJobs:
+    """Creates playlists and adds their tracks in the background.
+
+    Each job creates the playlist, then adds the tracks batch by batch.
+    Batches of one playlist go in order, since Spotify only accepts an
+    insert position within the current length; jobs run concurrently on a
+    bounded pool. Creating and adding are writes Spotify may have applied
+    even when the call fails, so they aren't retried automatically (the
+    client already waits out rate limits). A batch that fails is recorded
+    with the position it belongs at, so retry() re-inserts just those
+    batches in place.
+
+    Job records are kept in Redis when available so any worker can report
+    status, otherwise in this process.
+    """
+
+    def __init__(self, redis_client=None, max_workers=None, record_ttl=86400, namespace='playlist-job'):
+        self.redis = redis_client
+        self.record_ttl = record_ttl
+        self.namespace = namespace
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers or int(os.getenv('PLAYLIST_JOB_WORKERS', '4')))
+        self._local = {}
+        self._lock = threading.Lock()
+
+    def submit(self, sp, user_id, name, track_uris, public=True, description=None,
+               on_created=None):
+        """Queue a playlist creation and return its job id.
+
+        on_created(job) is called from the worker once the playlist exists.
+        """
+        batches = [track_uris[i:i + BATCH_SIZE] for i in range(0, len(track_uris), BATCH_SIZE)]
+        job = {
+            'id': uuid.uuid4().hex,
+            'user_id': user_id,
+            'status': 'queued',
+            'name': name,
+            'playlist_id': None,
+            'playlist_url': None,
+            'total_tracks': len(track_uris),
+            'added_tracks': 0,
+            'batches_total': len(batches),
+            'batches_done': 0,
+            'failed_batches': [],
+            'error': None,
+            'created_at': time.time(),
+            'updated_at': time.time()
+        }
+        self._save(job)
+        self._executor.submit(self._run, job, sp, batches, public, description, on_created)
+        return job['id']
+
+    def retry(self, sp, job_id):
+        """Re-submit only the failed batches of a job. Returns False if there's nothing to retry."""
+        job = self._claim_retry(job_id)
+        if job is None:
+            return False
+        self._executor.submit(self._retry_failed, job, sp)
+        return True
+
+    @staticmethod
+    def _retryable(job):
+        return bool(job and job['failed_batches'] and job['status'] not in ('queued', 'running'))
+
+    def _claim_retry(self, job_id):
+        """Queue a job with failed batches and return it, or None.
+
+        The check and the update are one atomic step, so concurrent retries
+        can't both re-submit the same batches.
+        """
+        if self.redis is not None:
+            key = f"{self.namespace}:{job_id}"
+            try:
+                with self.redis.pipeline() as pipe:
+                    pipe.watch(key)
+                    raw = pipe.get(key)
+                    job = json.loads(raw) if raw else None
+                    if not self._retryable(job):
+                        return None
+                    job['status'] = 'queued'
+                    job['updated_at'] = time.time()
+                    pipe.multi()
+                    pipe.set(key, json.dumps(job, separators=(',', ':')), ex=self.record_ttl)
+                    pipe.execute()
+                    return job
+            except redis.WatchError:
+                # Another retry claimed it first
+                return None
+            except redis.RedisError as e:
+                logger.warning("Playlist job claim error: %s", e)
+        with self._lock:
+            job = self._local.get(job_id)
+            if not self._retryable(job):
+                return None
+            job['status'] = 'queued'
+            job['updated_at'] = time.time()
+            return json.loads(json.dumps(job))
+
+    def get(self, job_id):
+        if self.redis is not None:
+            try:
+                raw = self.redis.get(f"{self.namespace}:{job_id}")
+                return json.loads(raw) if raw else None
+            except redis.RedisError as e:
+                logger.warning("Playlist job read error: %s", e)
+        with self._lock:
+            job = self._local.get(job_id)
+            return json.loads(json.dumps(job)) if job else None
+
+    @staticmethod
+    def public_view(job):
+        """Job status without the failed batches' track lists"""
+        view = {key: value for key, value in job.items() if key != 'failed_batches'}
+        view['failed_batches'] = [
+            {'index': batch['index'], 'position': batch['position'], 'error': batch['error']}
+            for batch in job['failed_batches']
+        ]
+        return view
+
+    def _save(self, job):
+        job['updated_at'] = time.time()
+        if self.redis is not None:
+            try:
+                self.redis.set(f"{self.namespace}:{job['id']}",
+                               json.dumps(job, separators=(',', ':')), ex=self.record_ttl)
+                return
+            except redis.RedisError as e:
+                logger.warning("Playlist job write error: %s", e)
+        # Store a snapshot, the worker keeps mutating its own copy
+        with self._lock:
+            self._local[job['id']] = json.loads(json.dumps(job))
+
+    def _run(self, job, sp, batches, public, description, on_created):
+        job['status'] = 'running'
+        self._save(job)
+        try:
+            playlist = sp.user_playlist_create(
+                user=job['user_id'],
+                name=job['name'],
+                public=public,
+                description=description or ''
+            )
+        except Exception as e:
+            logger.error("Failed to create playlist: %s", e)
+            job['status'] = 'failed'
+            job['error'] = 'Failed to create playlist'
+            self._save(job)
+            return
+
+        job['playlist_id'] = playlist['id']
+        job['playlist_url'] = playlist['external_urls']['spotify']
+        self._save(job)
+        if on_created:
+            try:
+                on_created(job)
+            except Exception as e:
+                logger.error("Playlist created callback failed: %s", e)
+
+        for index, batch in enumerate(batches):
+            self._add_batch(job, sp, index, index * BATCH_SIZE, batch, append=True)
+        self._finish(job)
+
+    def _retry_failed(self, job, sp):
+        job['status'] = 'running'
+        self._save(job)
+        failed = sorted(job['failed_batches'], key=lambda batch: batch['position'])
+        job['failed_batches'] = []
+        # Earlier positions first, so every later position is valid again
+        for batch in failed:
+            self._add_batch(job, sp, batch['index'], batch['position'], batch['uris'], append=False)
+        self._finish(job)
+
+    def _add_batch(self, job, sp, index, position, uris, append):
+        # Re-inserted batches shift left by any earlier batch that's still missing
+        insert_at = None if append else position - self._missing_before(job, position)
+        try:
+            sp.playlist_add_items(job['playlist_id'], uris, position=insert_at)
+            job['added_tracks'] += len(uris)
+            job['batches_done'] += 1
+        except Exception as e:
+            logger.error("Failed to add batch %s: %s", index, e)
+            job['failed_batches'].append({
+                'index': index,
+                'position': position,
+                'uris': uris,
+                'error': str(e)
+            })
+        self._save(job)
+
+    @staticmethod
+    def _missing_before(job, position):
+        return sum(len(batch['uris']) for batch in job['failed_batches']
+                   if batch['position'] < position)
+
+    def _finish(self, job):
+        if not job['failed_batches']:
+            job['status'] = 'completed'
+        elif job['batches_done']:
+            job['status'] = 'partial'
+        else:
+            job['status'] = 'failed'
+        self._save(job)
@@ -0,0 +1,173 @@
+import json
+import logging
+import os
+import threading
+import time
+
+import redis
+
+logger = logging.getLogger(__name__)
+
+PLAYLIST_FIELDS = 'items(track(id,name,artists,album(name,images),preview_url,external_urls))'
+
+
+class PlaylistSnapshots:
+    """Local copies of the editorial mood playlists.
+
+    A background thread checks each playlist's snapshot_id and only
+    downloads its tracks again when the snapshot has changed. Requests are
+    then answered from the already-projected track lists in memory.
+
+    With Redis, one worker per interval does the refresh (guarded by a
+    lock) and the others pick the result up from Redis.
+    """
+
+    def __init__(self, playlists, client_factory, project, redis_client=None,
+                 interval=None, track_limit=20, namespace='playlist-snapshot', restore=None):
+        self.playlists = playlists
+        self.client_factory = client_factory
+        self.project = project
+        # Turns the tracks of a snapshot read back from Redis into project()'s output
+        self.restore = restore
+        self.redis = redis_client
+        self.interval = interval if interval is not None else int(os.getenv('PLAYLIST_SNAPSHOT_INTERVAL', '900'))
+        # Snapshots not confirmed current for this long are reported stale
+        self.max_age = self.interval * 3
+        self.track_limit = track_limit
+        self.namespace = namespace
+        self._snapshots = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._last_refresh = {'started_at': None, 'duration': None, 'errors': {}}
+
+    def start(self):
+        """Start the refresher thread in this process (call after forking)"""
+        if self.interval <= 0:
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def get(self, mood):
+        """Projected tracks for a mood, or None when there's no snapshot yet
+        or it hasn't been confirmed current for max_age (so the caller
+        fetches the playlist itself, even if the refresher has died)"""
+        with self._lock:
+            snapshot = self._snapshots.get(mood)
+        if not self._current(snapshot):
+            # Another worker may have refreshed it
+            snapshot = self._load(mood)
+        return snapshot['tracks'] if self._current(snapshot) else None
+
+    def status(self):
+        now = time.time()
+        moods = {}
+        with self._lock:
+            snapshots = dict(self._snapshots)
+            last_refresh = dict(self._last_refresh)
+        for mood, playlist_id in self.playlists.items():
+            snapshot = snapshots.get(mood)
+            moods[mood] = {
+                'playlist_id': playlist_id,
+                'snapshot_id': snapshot['snapshot_id'] if snapshot else None,
+                'tracks': len(snapshot['tracks']) if snapshot else 0,
+                'age_seconds': round(now - snapshot['fetched_at'], 1) if snapshot else None,
+                'checked_seconds_ago': round(now - snapshot['checked_at'], 1) if snapshot else None,
+                'stale': not self._current(snapshot)
+            }
+        return {'interval': self.interval, 'last_refresh': last_refresh, 'playlists': moods}
+
+    def refresh(self):
+        """Check every playlist and download the ones whose snapshot changed"""
+        started = time.time()
+        try:
+            sp = self.client_factory()
+        except Exception as e:
+            logger.error("Failed to create client for playlist snapshots: %s", e)
+            self._record_refresh(started, {mood: str(e) for mood in self.playlists})
+            return
+
+        errors = {}
+        for mood, playlist_id in self.playlists.items():
+            try:
+                self._refresh_playlist(sp, mood, playlist_id)
+            except Exception as e:
+                logger.error("Failed to refresh %s playlist: %s", mood, e)
+                errors[mood] = str(e)
+        self._record_refresh(started, errors)
+
+    def _record_refresh(self, started, errors):
+        with self._lock:
+            self._last_refresh = {
+                'started_at': started,
+                'duration': round(time.time() - started, 3),
+                'errors': errors
+            }
+
+    def _refresh_playlist(self, sp, mood, playlist_id):
+        current = self._snapshots.get(mood) or self._load(mood)
+        snapshot_id = sp.playlist(playlist_id, fields='snapshot_id')['snapshot_id']
+        now = time.time()
+
+        if current and current['snapshot_id'] == snapshot_id:
+            snapshot = dict(current, checked_at=now)
+        else:
+            results = sp.playlist_tracks(playlist_id, fields=PLAYLIST_FIELDS, limit=self.track_limit)
+            snapshot = {
+                'snapshot_id': snapshot_id,
+                'tracks': self.project(results.get('items', [])),
+                'fetched_at': now,
+                'checked_at': now
+            }
+            logger.info("Downloaded %s playlist snapshot %s", mood, snapshot_id)
+
+        with self._lock:
+            self._snapshots[mood] = snapshot
+        if self.redis is not None:
+            try:
+                self.redis.set(f"{self.namespace}:{mood}", json.dumps(snapshot, separators=(',', ':')))
+            except redis.RedisError as e:
+                logger.warning("Playlist snapshot write error: %s", e)
+
+    def _current(self, snapshot):
+        return snapshot is not None and time.time() - snapshot['checked_at'] <= self.max_age
+
+    def _load(self, mood):
+        if self.redis is None:
+            return None
+        try:
+            raw = self.redis.get(f"{self.namespace}:{mood}")
+        except redis.RedisError as e:
+            logger.warning("Playlist snapshot read error: %s", e)
+            return None
+        if raw is None:
+            return None
+        snapshot = json.loads(raw)
+        if self.restore:
+            snapshot['tracks'] = self.restore(snapshot['tracks'])
+        with self._lock:
+            self._snapshots[mood] = snapshot
+        return snapshot
+
+    def _acquire_refresh(self):
+        if self.redis is None:
+            return True
+        try:
+            return bool(self.redis.set(f"{self.namespace}:lock", os.getpid(), nx=True, px=int(self.interval * 1000)))
+        except redis.RedisError as e:
+            logger.warning("Playlist snapshot lock error: %s", e)
+            return True
+
+    def _run(self):
+        while True:
+            if self._acquire_refresh():
+                self.refresh()
+            else:
+                for mood in self.playlists:
+                    try:
+                        self._load(mood)
+                    except Exception as e:
+                        logger.error("Failed to load %s playlist snapshot: %s", mood, e)
+            time.sleep(self.interval)
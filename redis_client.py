@@ -0,0 +1,30 @@
+import os
+import threading
+import redis
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_redis():
+    """Get a Redis client backed by the process-wide connection pool.
+
+    Returns None when REDIS_URL isn't configured so callers can fall back
+    to in-process storage.
+    """
+    global _pool
+    url = os.getenv('REDIS_URL')
+    if not url:
+        return None
+
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = redis.ConnectionPool.from_url(
+                    url,
+                    max_connections=int(os.getenv('REDIS_MAX_CONNECTIONS', '20')),
+                    socket_timeout=float(os.getenv('REDIS_SOCKET_TIMEOUT', '1.0')),
+                    socket_connect_timeout=float(os.getenv('REDIS_CONNECT_TIMEOUT', '1.0')),
+                    health_check_interval=30
+                )
+    return redis.Redis(connection_pool=_pool)
@@ -0,0 +1,309 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import redis
+
+import metrics
+from single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# Stats counters that are lookup results, as reported in the metrics
+LOOKUP_RESULTS = {
+    'hits': 'hit',
+    'stale_hits': 'stale',
+    'prefix_hits': 'prefix',
+    'coalesced': 'coalesced',
+    'misses': 'miss'
+}
+
+# How long a request waits for an identical search already in flight,
+# here or in another worker, before calling Spotify itself
+COALESCE_WAIT = float(os.getenv('SEARCH_COALESCE_WAIT', '5'))
+
+# Searches that found nothing are kept this long, without a stale period,
+# so a transient upstream quirk or a brand-new release isn't hidden for long
+EMPTY_TTL = int(os.getenv('SEARCH_CACHE_EMPTY_TTL', '60'))
+
+
+def normalize_query(query):
+    """Lowercase with whitespace runs collapsed, so queries that differ only
+    in case or spacing share a cache entry"""
+    return ' '.join(query.lower().split())
+
+
+class PrefixTrie:
+    """Strings mapped to values, finding the stored strings that prefix another"""
+
+    def __init__(self):
+        self._root = {}
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def insert(self, text, value):
+        node = self._root
+        for char in text:
+            node = node.setdefault(char, {})
+        # Children are keyed by single characters, so None never clashes
+        if None not in node:
+            self._size += 1
+        node[None] = value
+
+    def remove(self, text):
+        path = [self._root]
+        for char in text:
+            node = path[-1].get(char)
+            if node is None:
+                return
+            path.append(node)
+        if None not in path[-1]:
+            return
+        del path[-1][None]
+        self._size -= 1
+        # Drop the nodes that no longer lead to a value
+        for depth in range(len(text), 0, -1):
+            if path[depth]:
+                break
+            del path[depth - 1][text[depth - 1]]
+
+    def prefixes(self, text):
+        """Values stored under proper, non-empty prefixes of text, longest first"""
+        found = []
+        node = self._root
+        for char in text[:-1]:
+            node = node.get(char)
+            if node is None:
+                break
+            if None in node:
+                found.append(node[None])
+        found.reverse()
+        return found
+
+
+class SearchCache:
+    """Two-tier cache for Spotify search results.
+
+    Entries live in an in-process LRU in front of an optional Redis tier
+    shared by every gunicorn worker. An entry is fresh for `ttl` seconds;
+    after that it may still be served for `stale_ttl` seconds while a single
+    background refresh replaces it. Empty results only last `empty_ttl`.
+
+    Identical misses in flight at once share one fetch (see SingleFlight),
+    in this worker and, with Redis, across workers; callers wait at most
+    `coalesce_wait` seconds for it before fetching themselves. The local
+    entries are also
+    indexed by query in a prefix trie, so a caller can answer a longer
+    query from the results of one it extends (see get_or_fetch).
+
+    Values are stored in Redis as JSON; `restore` turns a decoded value
+    back into what fetch() returned.
+    """
+
+    def __init__(self, redis_client=None, max_entries=1024, ttl=3600, stale_ttl=600,
+                 namespace='search', restore=None, coalesce_wait=COALESCE_WAIT, empty_ttl=EMPTY_TTL):
+        self.redis = redis_client
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.namespace = namespace
+        self.restore = restore
+        self.empty_ttl = empty_ttl
+        self._entries = OrderedDict()
+        self._prefixes = {}
+        self._flights = SingleFlight(redis_client, namespace=namespace, wait=coalesce_wait)
+        self._lock = threading.Lock()
+        self._refreshing = set()
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'stale_hits': 0,
+            'prefix_hits': 0,
+            'coalesced': 0,
+            'redis_hits': 0,
+            'refreshes': 0,
+            'errors': 0
+        }
+
+    @staticmethod
+    def make_key(query, market, limit):
+        return json.dumps([normalize_query(query), market, limit])
+
+    def get_or_fetch(self, query, market, limit, fetch, refine=None):
+        """Return cached results for (query, market, limit), calling fetch() on a miss.
+
+        Before going to Redis or fetch(), `refine(value, query, limit)`, if
+        given, is offered this worker's fresh results for shorter queries
+        that prefix this one, longest first, with the query normalized. The
+        first result it doesn't return None for is the answer.
+        """
+        key = self.make_key(query, market, limit)
+        entry = self._get_local(key)
+        if entry is None and refine is not None:
+            value = self._refine_prefix(normalize_query(query), market, limit, refine)
+            if value is not None:
+                self._count('prefix_hits')
+                return value
+        if entry is None:
+            entry = self._get_remote(key)
+
+        if entry is not None:
+            value, fetched_at = entry
+            age = time.time() - fetched_at
+            fresh_for, kept_for = self._lifetime(value)
+            if age < fresh_for:
+                self._count('hits')
+                return value
+            if age < kept_for:
+                self._count('stale_hits')
+                self._refresh_in_background(key, fetch)
+                return value
+
+        return self._fetch_once(key, fetch)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+        stats['in_flight'] = self._flights.in_flight()
+        answered = stats['hits'] + stats['stale_hits'] + stats['prefix_hits'] + stats['coalesced']
+        lookups = answered + stats['misses']
+        stats['hit_ratio'] = answered / lookups if lookups else 0.0
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._prefixes.clear()
+
+    def _lifetime(self, value):
+        """(seconds fresh, seconds kept in all) for a cached value"""
+        if not value:
+            return self.empty_ttl, self.empty_ttl
+        return self.ttl, self.ttl + self.stale_ttl
+
+    def _refine_prefix(self, query, market, limit, refine):
+        now = time.time()
+        with self._lock:
+            trie = self._prefixes.get((market, limit))
+            keys = trie.prefixes(query) if trie else []
+            values = [self._entries[key][0] for key in keys
+                      if key in self._entries
+                      and now - self._entries[key][1] < self._lifetime(self._entries[key][0])[0]]
+        for value in values:
+            refined = refine(value, query, limit)
+            if refined is not None:
+                return refined
+        return None
+
+    def _fetch_once(self, key, fetch):
+        """fetch() and store the result, once for concurrent identical misses"""
+        def lookup():
+            entry = self._get_remote(key)
+            return entry[0] if entry is not None else None
+
+        value, shared = self._flights.run(key, lambda: self._fetch(key, fetch), lookup)
+        if shared:
+            self._count('coalesced')
+        return value
+
+    def _fetch(self, key, fetch):
+        self._count('misses')
+        value = fetch()
+        self._store(key, value)
+        return value
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+        if name in LOOKUP_RESULTS:
+            metrics.cache_result('search', LOOKUP_RESULTS[name])
+
+    def _get_local(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.time() - entry[1] >= self._lifetime(entry[0])[1]:
+                del self._entries[key]
+                self._unindex(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def _get_remote(self, key):
+        if self.redis is None:
+            return None
+        try:
+            raw = self.redis.get(f"{self.namespace}:{key}")
+        except redis.RedisError as e:
+            logger.warning("Search cache read error: %s", e)
+            self._count('errors')
+            return None
+        if raw is None:
+            return None
+
+        record = json.loads(raw)
+        value = self.restore(record['v']) if self.restore else record['v']
+        entry = (value, record['t'])
+        self._count('redis_hits')
+        self._set_local(key, entry)
+        return entry
+
+    def _set_local(self, key, entry):
+        with self._lock:
+            if key not in self._entries:
+                query, market, limit = json.loads(key)
+                self._prefixes.setdefault((market, limit), PrefixTrie()).insert(query, key)
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._unindex(self._entries.popitem(last=False)[0])
+
+    def _unindex(self, key):
+        """Drop an evicted entry from the prefix trie; call with the lock held"""
+        query, market, limit = json.loads(key)
+        trie = self._prefixes.get((market, limit))
+        if trie is not None:
+            trie.remove(query)
+            if not trie:
+                del self._prefixes[(market, limit)]
+
+    def _store(self, key, value):
+        entry = (value, time.time())
+        self._set_local(key, entry)
+        if self.redis is None:
+            return
+        try:
+            self.redis.set(
+                f"{self.namespace}:{key}",
+                json.dumps({'v': value, 't': entry[1]}, separators=(',', ':')),
+                ex=max(1, int(self._lifetime(value)[1]))
+            )
+        except redis.RedisError as e:
+            logger.warning("Search cache write error: %s", e)
+            self._count('errors')
+
+    def _refresh_in_background(self, key, fetch):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                self._store(key, fetch())
+                self._count('refreshes')
+            except Exception as e:
+                logger.warning("Search cache refresh failed: %s", e)
+                self._count('errors')
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=refresh, daemon=True).start()
@@ -0,0 +1,60 @@
+from flask.json.tag import TaggedJSONSerializer
+from flask_session import Session
+from flask_session.sessions import RedisSessionInterface
+
+import metrics
+from redis_client import get_redis
+
+
+class CompactSessionSerializer:
+    """Flask's tagged JSON (as used for cookie sessions) instead of pickle"""
+
+    def __init__(self):
+        self._serializer = TaggedJSONSerializer()
+
+    def dumps(self, value):
+        return self._serializer.dumps(value)
+
+    def loads(self, value):
+        if isinstance(value, bytes):
+            value = value.decode('utf-8')
+        return self._serializer.loads(value)
+
+
+class CompactRedisSessionInterface(RedisSessionInterface):
+    """Redis sessions serialized as compact JSON and only written when modified.
+
+    Flask-Session rewrites the whole session on every request; here a
+    request that only reads the session costs one GET and no writes.
+    Nested values must be reassigned (not mutated in place) to be saved.
+    """
+
+    serializer = CompactSessionSerializer()
+
+    def save_session(self, app, session, response):
+        if session and not session.modified:
+            return
+        super().save_session(app, session, response)
+
+
+def init_session(app):
+    """Use Redis sessions on the shared pool when REDIS_URL is set, otherwise
+    fall back to Flask-Session's configured (filesystem) backend"""
+    redis_client = get_redis()
+    if redis_client is None:
+        Session(app)
+    else:
+        app.config['SESSION_TYPE'] = 'redis'
+        app.session_interface = CompactRedisSessionInterface(
+            redis_client,
+            app.config.get('SESSION_KEY_PREFIX', 'session:'),
+            app.config.get('SESSION_USE_SIGNER', False),
+            app.config.get('SESSION_PERMANENT', True)
+        )
+    time_session_io(app.session_interface)
+
+
+def time_session_io(interface):
+    """Record session loads and saves as spans, whichever backend is in use"""
+    interface.open_session = metrics.timed('session', 'load')(interface.open_session)
+    interface.save_session = metrics.timed('session', 'save')(interface.save_session)
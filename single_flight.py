@@ -0,0 +1,124 @@
+import logging
+import threading
+import time
+import uuid
+
+import redis
+
+from http_transport import REQUEST_BUDGET
+
+logger = logging.getLogger(__name__)
+
+# Delete the lock only while it still holds the caller's token, so a lock
+# that expired and was taken by another worker isn't released from under it
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class _Call:
+    """A call in progress that other threads wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SingleFlight:
+    """Makes one call for concurrent callers asking for the same key.
+
+    Threads in this worker wait for the first caller's result. With Redis,
+    a lock lets one worker make the call while the others poll for the
+    result it stores. The lock lasts `lock_ttl`, which should cover the
+    call's whole timeout budget; waiters give up after `wait` seconds and
+    make the call themselves.
+    """
+
+    def __init__(self, redis_client=None, namespace='single-flight', lock_ttl=REQUEST_BUDGET,
+                 wait=None, poll_interval=0.05):
+        self.redis = redis_client
+        self.namespace = namespace
+        self.lock_ttl = lock_ttl
+        self.wait = wait if wait is not None else lock_ttl
+        self.poll_interval = poll_interval
+        self._release_script = redis_client.register_script(RELEASE_SCRIPT) if redis_client else None
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def run(self, key, fn, lookup=None):
+        """fn(), or the result of an identical call already in flight.
+
+        lookup() returns the result another worker stored, or None while
+        there isn't one. Returns (value, shared), shared being True when
+        another caller's result was used.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            if call.done.wait(self.wait):
+                if call.error is not None:
+                    raise call.error
+                return call.value, True
+            return self._run_shared(key, fn, lookup)
+
+        try:
+            call.value, shared = self._run_shared(key, fn, lookup)
+            return call.value, shared
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
+
+    def _run_shared(self, key, fn, lookup):
+        """Call in this worker, or wait for the worker holding the lock"""
+        token = self._acquire(key)
+        if token is not None:
+            try:
+                return fn(), False
+            finally:
+                self._release(key, token)
+
+        deadline = time.monotonic() + self.wait
+        while time.monotonic() < deadline:
+            time.sleep(self.poll_interval)
+            value = lookup() if lookup else None
+            if value is not None:
+                return value, True
+        logger.warning("Timed out waiting for another worker (%s)", self.namespace)
+        return fn(), False
+
+    def _acquire(self, key):
+        """A token for the lock on key, or None if another worker holds it"""
+        token = uuid.uuid4().hex
+        if self.redis is None:
+            return token
+        try:
+            if self.redis.set(f"{self.namespace}:{key}:lock", token, nx=True, px=int(self.lock_ttl * 1000)):
+                return token
+            return None
+        except redis.RedisError as e:
+            logger.warning("Single-flight lock error: %s", e)
+            return token
+
+    def _release(self, key, token):
+        if self.redis is None:
+            return
+        try:
+            self._release_script(keys=[f"{self.namespace}:{key}:lock"], args=[token])
+        except redis.RedisError as e:
+            logger.warning("Single-flight lock release error: %s", e)
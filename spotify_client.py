@@ -0,0 +1,218 @@
+import logging
+import os
+import random
+import threading
+import time
+
+import redis
+import spotipy
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Overridable so the benchmarks can point the app at local stand-ins
+API_URL = os.getenv('SPOTIFY_API_URL', 'https://api.spotify.com/v1').rstrip('/') + '/'
+ACCOUNTS_URL = os.getenv('SPOTIFY_ACCOUNTS_URL', 'https://accounts.spotify.com').rstrip('/')
+
+INTERACTIVE = 'interactive'
+BACKGROUND = 'background'
+
+# Refill the bucket and take a token if one is available above the
+# caller's reserve. Returns how long to wait before trying again.
+TAKE_TOKEN_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local reserve = tonumber(ARGV[4])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens - 1 >= reserve then
+    tokens = tokens - 1
+else
+    wait = (1 + reserve - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 60)
+return tostring(wait)
+"""
+
+
+def use_endpoints(client):
+    """Point a spotipy client or auth manager at the configured hosts"""
+    if isinstance(client, spotipy.Spotify):
+        client.prefix = API_URL
+    else:
+        client.OAUTH_AUTHORIZE_URL = f"{ACCOUNTS_URL}/authorize"
+        client.OAUTH_TOKEN_URL = f"{ACCOUNTS_URL}/api/token"
+    return client
+
+
+class SpotifyRateLimited(spotipy.exceptions.SpotifyException):
+    """Raised when a call can't be made within the caller's wait budget"""
+
+    def __init__(self, retry_after):
+        retry_after = max(1, int(retry_after + 0.999))
+        super().__init__(429, -1, 'Rate limited by Spotify, please try again shortly',
+                         headers={'Retry-After': str(retry_after)})
+        self.retry_after = retry_after
+
+
+class SpotifyRateLimiter:
+    """Token bucket for Spotify calls, shared by all workers through Redis.
+
+    Interactive calls may use the whole bucket; background calls leave
+    `background_reserve` of it for interactive traffic. A 429 from Spotify
+    pauses every caller until its Retry-After has passed.
+    """
+
+    def __init__(self, redis_client=None, rate=None, capacity=None, background_reserve=0.25,
+                 max_wait=None, namespace='spotify-rate'):
+        self.redis = redis_client
+        self.rate = rate or float(os.getenv('SPOTIFY_RATE_LIMIT', '10'))
+        self.capacity = capacity or float(os.getenv('SPOTIFY_RATE_BURST', '20'))
+        self.background_reserve = background_reserve
+        self.max_wait = max_wait or {
+            INTERACTIVE: float(os.getenv('SPOTIFY_INTERACTIVE_MAX_WAIT', '2')),
+            BACKGROUND: float(os.getenv('SPOTIFY_BACKGROUND_MAX_WAIT', '60'))
+        }
+        self.namespace = namespace
+        self._script = redis_client.register_script(TAKE_TOKEN_SCRIPT) if redis_client else None
+        self._lock = threading.Lock()
+        self._tokens = self.capacity
+        self._ts = time.time()
+        self._cooldown_until = 0.0
+        self._stats = {
+            'calls': 0,
+            'rate_limited_responses': 0,
+            'rejected': 0,
+            'throttled_seconds': {INTERACTIVE: 0.0, BACKGROUND: 0.0}
+        }
+
+    def acquire(self, priority=INTERACTIVE):
+        """Wait for a token, raising SpotifyRateLimited if that would take too long"""
+        reserve = 0 if priority == INTERACTIVE else self.capacity * self.background_reserve
+        max_wait = self.max_wait[priority]
+        waited = 0.0
+        try:
+            while True:
+                wait = self._cooldown_remaining() or self._take(reserve)
+                if wait <= 0:
+                    return
+                if waited + wait > max_wait:
+                    with self._lock:
+                        self._stats['rejected'] += 1
+                    raise SpotifyRateLimited(wait)
+                time.sleep(wait)
+                waited += wait
+        finally:
+            with self._lock:
+                self._stats['throttled_seconds'][priority] += waited
+                self._stats['calls'] += 1
+
+    def pause(self, retry_after):
+        """Hold back every caller for retry_after seconds after a 429"""
+        until = time.time() + retry_after
+        with self._lock:
+            self._stats['rate_limited_responses'] += 1
+            self._cooldown_until = max(self._cooldown_until, until)
+        if self.redis is not None:
+            try:
+                self.redis.set(f"{self.namespace}:cooldown", until, px=int(retry_after * 1000) + 1)
+            except redis.RedisError as e:
+                logger.warning("Rate limiter write error: %s", e)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['throttled_seconds'] = dict(self._stats['throttled_seconds'])
+        return stats
+
+    def _cooldown_remaining(self):
+        until = self._cooldown_until
+        if self.redis is not None:
+            try:
+                shared = self.redis.get(f"{self.namespace}:cooldown")
+                if shared:
+                    until = max(until, float(shared))
+            except redis.RedisError as e:
+                logger.warning("Rate limiter read error: %s", e)
+        return max(0.0, until - time.time())
+
+    def _take(self, reserve):
+        if self._script is not None:
+            try:
+                return float(self._script(
+                    keys=[f"{self.namespace}:bucket"],
+                    args=[self.rate, self.capacity, time.time(), reserve]
+                ))
+            except redis.RedisError as e:
+                logger.warning("Rate limiter error, using local bucket: %s", e)
+
+        with self._lock:
+            now = time.time()
+            self._tokens = min(self.capacity, self._tokens + (now - self._ts) * self.rate)
+            self._ts = now
+            if self._tokens - 1 >= reserve:
+                self._tokens -= 1
+                return 0.0
+            return (1 + reserve - self._tokens) / self.rate
+
+
+class RateLimitedSpotify:
+    """The spotipy calls used by the app, behind the shared rate limiter.
+
+    A 429 pauses all callers for the Retry-After period and the call is
+    retried with jittered backoff while it fits in the priority's wait
+    budget; otherwise SpotifyRateLimited is raised.
+    """
+
+    def __init__(self, sp, limiter, priority=INTERACTIVE, max_attempts=3):
+        self.sp = sp
+        self.limiter = limiter
+        self.priority = priority
+        self.max_attempts = max_attempts
+
+    def search(self, *args, **kwargs):
+        return self._call('search', args, kwargs)
+
+    def playlist(self, *args, **kwargs):
+        return self._call('playlist', args, kwargs)
+
+    def playlist_tracks(self, *args, **kwargs):
+        return self._call('playlist_tracks', args, kwargs)
+
+    def current_user(self):
+        return self._call('current_user', (), {})
+
+    def user_playlist_create(self, *args, **kwargs):
+        return self._call('user_playlist_create', args, kwargs)
+
+    def playlist_add_items(self, *args, **kwargs):
+        return self._call('playlist_add_items', args, kwargs)
+
+    def _call(self, method, args, kwargs):
+        for attempt in range(self.max_attempts):
+            self.limiter.acquire(self.priority)
+            try:
+                with metrics.span('spotify', method):
+                    return getattr(self.sp, method)(*args, **kwargs)
+            except spotipy.exceptions.SpotifyException as e:
+                if e.http_status != 429:
+                    raise
+                retry_after = self._retry_after(e, attempt)
+                self.limiter.pause(retry_after)
+                if attempt == self.max_attempts - 1 or retry_after > self.limiter.max_wait[self.priority]:
+                    raise SpotifyRateLimited(retry_after)
+                # Spread the retries from different workers out a little
+                time.sleep(random.uniform(0, min(1.0, retry_after / 2)))
+
+    @staticmethod
+    def _retry_after(e, attempt):
+        try:
+            return float((e.headers or {}).get('Retry-After'))
+        except (TypeError, ValueError):
+            return 0.5 * 2 ** attempt
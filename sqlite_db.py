@@ -0,0 +1,79 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+POOL_SIZE = int(os.getenv('SQLITE_POOL_SIZE', '4'))
+
+
+class SQLiteDatabase:
+    """A SQLite file shared by every worker on the host.
+
+    Each worker keeps a small pool of connections, in WAL mode so readers
+    don't block the writer. A connection is checked out for one statement
+    or transaction, so any thread or green thread can use it, and
+    connections opened before a fork are never used in the child. The
+    schema is created once per worker.
+    """
+
+    def __init__(self, path, schema, pool_size=POOL_SIZE):
+        self.path = path
+        self.schema = schema
+        self.pool_size = pool_size
+        self._idle = []
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def connection(self):
+        """Check a connection out of the pool for the duration of the block"""
+        connection = self._checkout()
+        try:
+            yield connection
+        finally:
+            self._checkin(connection)
+
+    def query(self, sql, params=()):
+        """Rows returned by one statement"""
+        with self.connection() as connection:
+            return connection.execute(sql, params).fetchall()
+
+    def transaction(self, statements):
+        """Run (sql, rows) executemany statements in one write transaction"""
+        with self.connection() as connection:
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                for sql, rows in statements:
+                    connection.executemany(sql, rows)
+                connection.execute('COMMIT')
+            except Exception:
+                connection.execute('ROLLBACK')
+                raise
+
+    def _checkout(self):
+        pid = os.getpid()
+        with self._lock:
+            if self._pid != pid:
+                # Forget the parent's connections (closing them could disturb
+                # the parent), and create the schema before anything queries
+                self._idle = []
+                connection = self._connect()
+                connection.executescript(self.schema)
+                self._pid = pid
+                return connection
+            if self._idle:
+                return self._idle.pop()
+        return self._connect()
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        return connection
+
+    def _checkin(self, connection):
+        with self._lock:
+            if self._pid == os.getpid() and len(self._idle) < self.pool_size:
+                self._idle.append(connection)
+                return
+        connection.close()
@@ -130,8 +130,8 @@ document.addEventListener('DOMContentLoaded', () => {
             })
             .then(response => response.json())
             .then(data => {
-                if (data.status === 'success') {
-                    alert('Playlist saved to your Spotify account! Check your Spotify app.');
+                if (data.job_id) {
+                    alert('Saving playlist to your Spotify account! Check your Spotify app in a moment.');
                     loadSavedPlaylists();  // Refresh the saved playlists
                 } else {
                     alert('Error saving playlist: ' + data.error);
@@ -166,28 +166,54 @@ document.addEventListener('DOMContentLoaded', () => {
         });
     }
 
-    // Load saved playlists
-    async function loadSavedPlaylists() {
-        try {
-            const response = await fetch('/api/saved-playlists');
-            const playlists = await response.json();
-            
-            savedPlaylistsContent.innerHTML = playlists.map(playlist => `
-                <div class="saved-playlist-item card mb-3">
-                    <div class="card-body">
-                        <h5 class="card-title">${playlist.mood.charAt(0).toUpperCase() + playlist.mood.slice(1)} Playlist</h5>
-                        <p class="card-text">
-                            <small class="text-muted">Created: ${new Date(playlist.timestamp).toLocaleDateString()}</small>
-                        </p>
-                        <div class="song-list">
-                            ${playlist.songs.slice(0, 3).map(song => `
-                                <div class="small">${song.title} - ${song.artist}</div>
-                            `).join('')}
-                            ${playlist.songs.length > 3 ? `<div class="small text-muted">+ ${playlist.songs.length - 3} more songs</div>` : ''}
-                        </div>
+    function renderSavedPlaylist(playlist) {
+        return `
+            <div class="saved-playlist-item card mb-3">
+                <div class="card-body">
+                    <h5 class="card-title">${playlist.mood.charAt(0).toUpperCase() + playlist.mood.slice(1)} Playlist</h5>
+                    <p class="card-text">
+                        <small class="text-muted">Created: ${new Date(playlist.timestamp).toLocaleDateString()}</small>
+                    </p>
+                    <div class="song-list">
+                        ${playlist.songs.slice(0, 3).map(song => `
+                            <div class="small">${song.title} - ${song.artist}</div>
+                        `).join('')}
+                        ${playlist.songs.length > 3 ? `<div class="small text-muted">+ ${playlist.songs.length - 3} more songs</div>` : ''}
                     </div>
                 </div>
-            `).join('');
+            </div>
+        `;
+    }
+
+    // Load saved playlists, a page at a time: the first page replaces the
+    // list, later ones (from the "Load more" button) are appended
+    async function loadSavedPlaylists(cursor = null) {
+        try {
+            const url = cursor ? `/api/saved-playlists?cursor=${encodeURIComponent(cursor)}` : '/api/saved-playlists';
+            const response = await fetch(url);
+            const data = await response.json();
+            if (!response.ok) {
+                throw new Error(data.error || 'Failed to load saved playlists');
+            }
+
+            const html = data.playlists.map(renderSavedPlaylist).join('');
+            const loadMore = savedPlaylistsContent.querySelector('.load-more-playlists');
+            if (loadMore) {
+                loadMore.remove();
+            }
+            if (cursor) {
+                savedPlaylistsContent.insertAdjacentHTML('beforeend', html);
+            } else {
+                savedPlaylistsContent.innerHTML = html;
+            }
+
+            if (data.next_cursor) {
+                const button = document.createElement('button');
+                button.className = 'btn btn-outline-secondary btn-sm load-more-playlists';
+                button.textContent = 'Load more';
+                button.addEventListener('click', () => loadSavedPlaylists(data.next_cursor));
+                savedPlaylistsContent.appendChild(button);
+            }
         } catch (error) {
             console.error('Error loading saved playlists:', error);
         }
@@ -0,0 +1,47 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+import fake_upstreams  # noqa: E402
+import spotify_client  # noqa: E402
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """The fake Spotify API and accounts service with no added latency;
+    faults are set per test through server.spotify_faults"""
+    server = fake_upstreams.start(spotify_faults=fake_upstreams.Faults(latency=0),
+                                  weather_faults=fake_upstreams.Faults(latency=0))
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    monkeypatch.setattr(spotify_client, 'API_URL', f"{url}/v1/")
+    monkeypatch.setattr(spotify_client, 'ACCOUNTS_URL', url)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(scope='session')
+def app_module(tmp_path_factory):
+    """The Flask app module, imported with its files in a scratch directory"""
+    workdir = tmp_path_factory.mktemp('app')
+    os.environ.pop('REDIS_URL', None)
+    os.environ.update({
+        'SPOTIFY_CLIENT_ID': 'test',
+        'SPOTIFY_CLIENT_SECRET': 'test',
+        'USER_DB': str(workdir / 'users.db'),
+        'PLAYLIST_HISTORY_DB': str(workdir / 'playlist_history.db'),
+        'PLAYLIST_SNAPSHOT_INTERVAL': '0',
+    })
+    # Flask-Session keeps session files under the working directory
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        import app
+    finally:
+        os.chdir(cwd)
+    return app
@@ -0,0 +1,32 @@
+import gc
+
+import spotipy
+
+from http_transport import get_session, get_timeout, pool_stats
+from spotify_client import use_endpoints
+
+
+def test_pooled_connections_outlive_short_lived_clients(upstream):
+    for _ in range(3):
+        sp = use_endpoints(spotipy.Spotify(auth='token-user', requests_session=get_session(),
+                                           requests_timeout=get_timeout()))
+        sp.search('summer', type='track', limit=1)
+        del sp
+        gc.collect()
+
+    hosts = pool_stats()['hosts']
+    host, = [stats for name, stats in hosts.items() if name.endswith(f":{upstream.server_address[1]}")]
+    assert host['connections_opened'] == 1
+    assert host['requests'] == 3
+    assert host['idle'] == 1
+
+
+def test_429s_are_not_retried_by_the_transport(upstream):
+    upstream.spotify_faults.rate_limit_rate = 1.0
+    upstream.spotify_faults.retry_after = 3
+
+    response = get_session().get(f"http://127.0.0.1:{upstream.server_address[1]}/v1/search",
+                                 params={'q': 'summer', 'type': 'track'}, timeout=get_timeout())
+
+    assert response.status_code == 429
+    assert upstream.calls['search'] == 1
@@ -0,0 +1,45 @@
+import time
+
+from flask import Flask, Response, stream_with_context
+
+import metrics
+
+
+def streaming_app():
+    app = Flask(__name__)
+
+    @app.route('/stream')
+    def stream():
+        def body():
+            for n in range(2):
+                with metrics.span('spotify', 'search'):
+                    time.sleep(0.05)
+                yield f"{n}\n"
+        return Response(stream_with_context(body()), mimetype='application/x-ndjson')
+
+    metrics.init_app(app)
+    return app
+
+
+def series(values, name, **labels):
+    return values.get(metrics._series(name, labels), 0)
+
+
+def test_streamed_body_is_part_of_the_request_trace(monkeypatch):
+    monkeypatch.setattr(metrics, 'get_redis', lambda: None)
+    before, _ = metrics.collect()
+    client = streaming_app().test_client()
+
+    response = client.get('/stream')
+    assert response.get_data(as_text=True) == '0\n1\n'
+    response.close()
+
+    after, _ = metrics.collect()
+    route = {'route': '/stream'}
+    calls = (series(after, 'http_request_upstream_calls_sum', service='spotify', **route)
+             - series(before, 'http_request_upstream_calls_sum', service='spotify', **route))
+    duration = (series(after, 'http_request_duration_seconds_sum', **route)
+                - series(before, 'http_request_duration_seconds_sum', **route))
+    assert calls == 2
+    assert duration >= 0.1
+    assert series(after, 'http_requests_total', method='GET', status='200', **route) == 1
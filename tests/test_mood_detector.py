@@ -0,0 +1,62 @@
+import threading
+import time
+
+import pytest
+
+from mood_detector import MoodDetector
+
+
+@pytest.fixture
+def detector(upstream):
+    host, port = upstream.server_address
+    return MoodDetector(base_url=f"http://{host}:{port}/data/2.5/weather")
+
+
+def lookup_concurrently(detector, cities):
+    barrier = threading.Barrier(len(cities))
+    results = [None] * len(cities)
+
+    def worker(i):
+        barrier.wait()
+        results[i] = detector.get_weather_mood(cities[i])
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(len(cities))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_concurrent_lookups_for_a_city_share_one_call(upstream, detector):
+    upstream.weather_faults.latency = 0.1
+    upstream.weather_faults.jitter = 0
+
+    results = lookup_concurrently(detector, ['London'] * 8)
+
+    assert upstream.calls['weather'] == 1
+    assert all(moods == results[0] for moods in results)
+    assert results[0] != ['Neutral']
+    assert detector._weather_inflight == {}
+
+
+def test_city_names_are_normalised(upstream, detector):
+    moods = detector.get_weather_mood('London')
+
+    assert detector.get_weather_mood('  london ') == moods
+    assert detector.get_weather_mood('LONDON') == moods
+    assert upstream.calls['weather'] == 1
+
+
+def test_failures_are_cached_briefly(upstream, detector):
+    upstream.weather_faults.error_rate = 1.0
+
+    assert detector.get_weather_mood('Paris') == ['Neutral']
+    calls = upstream.calls['weather']
+    assert calls >= 1
+    assert detector.get_weather_mood('Paris') == ['Neutral']
+    assert upstream.calls['weather'] == calls
+
+    # The failure is kept for the error TTL, not the full weather TTL
+    expires_at = detector._weather_cache['paris'][1]
+    assert expires_at - time.monotonic() <= detector.weather_error_ttl < detector.weather_ttl
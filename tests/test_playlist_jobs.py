@@ -0,0 +1,180 @@
+import threading
+import time
+
+import pytest
+import spotipy
+from spotipy.exceptions import SpotifyException
+
+from http_transport import get_session, get_timeout
+from playlist_jobs import PlaylistJobs
+from spotify_client import use_endpoints
+
+URIS = [f"spotify:track:{n:022d}" for n in range(250)]
+
+
+class StubSpotify:
+    """A playlist as a list of URIs; adding items follows Spotify's rules
+    for `position`, and batches starting with a URI in `fail` are refused"""
+
+    def __init__(self, fail=()):
+        self.tracks = []
+        self.fail = set(fail)
+        self.inserts = []
+
+    def user_playlist_create(self, user, name, public=True, description=''):
+        return {'id': 'playlist1', 'external_urls': {'spotify': 'https://open.spotify.com/playlist/playlist1'}}
+
+    def playlist_add_items(self, playlist_id, uris, position=None):
+        if uris[0] in self.fail:
+            raise SpotifyException(400, -1, 'Injected failure')
+        if position is None:
+            self.tracks.extend(uris)
+        elif position > len(self.tracks):
+            raise SpotifyException(400, -1, 'Index out of bounds')
+        else:
+            self.tracks[position:position] = uris
+        self.inserts.append((URIS.index(uris[0]), position))
+        return {'snapshot_id': 'snapshot'}
+
+
+def wait_for(jobs, job_id):
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        job = jobs.get(job_id)
+        if job['status'] not in ('queued', 'running'):
+            return job
+        time.sleep(0.01)
+    pytest.fail(f"Job {job_id} didn't finish")
+
+
+@pytest.fixture
+def jobs():
+    return PlaylistJobs(max_workers=1)
+
+
+def test_failing_middle_batch_is_retried_in_place(jobs):
+    sp = StubSpotify(fail={URIS[100]})
+    job = wait_for(jobs, jobs.submit(sp, 'user1', 'Mix', URIS))
+
+    assert job['status'] == 'partial'
+    assert (job['added_tracks'], job['batches_done'], job['batches_total']) == (150, 2, 3)
+    assert [(batch['index'], batch['position']) for batch in job['failed_batches']] == [(1, 100)]
+    assert sp.tracks == URIS[:100] + URIS[200:]
+
+    sp.fail.clear()
+    assert jobs.retry(sp, job['id'])
+    job = wait_for(jobs, job['id'])
+
+    assert job['status'] == 'completed'
+    assert job['added_tracks'] == 250
+    assert job['failed_batches'] == []
+    assert sp.tracks == URIS
+
+
+def test_retry_shifts_inserts_past_batches_still_missing(jobs):
+    sp = StubSpotify(fail={URIS[0], URIS[200]})
+    job = wait_for(jobs, jobs.submit(sp, 'user1', 'Mix', URIS))
+    assert sp.tracks == URIS[100:200]
+
+    # The first batch fails again, so the last goes in 100 earlier
+    sp.fail = {URIS[0]}
+    jobs.retry(sp, job['id'])
+    job = wait_for(jobs, job['id'])
+
+    assert job['status'] == 'partial'
+    assert sp.inserts[-1] == (200, 100)
+    assert sp.tracks == URIS[100:]
+    assert [(batch['index'], batch['position']) for batch in job['failed_batches']] == [(0, 0)]
+
+    sp.fail.clear()
+    jobs.retry(sp, job['id'])
+    job = wait_for(jobs, job['id'])
+
+    assert job['status'] == 'completed'
+    assert sp.inserts[-1] == (0, 0)
+    assert sp.tracks == URIS
+
+
+def test_failed_writes_are_not_retried_automatically(jobs):
+    class FlakySpotify(StubSpotify):
+        # Spotify applied the write but the response was lost
+        def playlist_add_items(self, playlist_id, uris, position=None):
+            super().playlist_add_items(playlist_id, uris, position)
+            if uris[0] == URIS[100]:
+                raise SpotifyException(502, -1, 'Bad gateway')
+
+    sp = FlakySpotify()
+    job = wait_for(jobs, jobs.submit(sp, 'user1', 'Mix', URIS))
+
+    assert job['status'] == 'partial'
+    assert sp.tracks == URIS
+    assert [(batch['index'], batch['position']) for batch in job['failed_batches']] == [(1, 100)]
+
+
+@pytest.mark.parametrize('use_redis', [False, True])
+def test_concurrent_retries_resubmit_once(use_redis):
+    redis_client = pytest.importorskip('fakeredis').FakeRedis() if use_redis else None
+    jobs = PlaylistJobs(redis_client=redis_client, max_workers=1)
+    sp = StubSpotify(fail={URIS[100]})
+    job = wait_for(jobs, jobs.submit(sp, 'user1', 'Mix', URIS))
+    sp.fail.clear()
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(jobs.retry(sp, job['id']))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results.count(True) == 1
+    assert wait_for(jobs, job['id'])['status'] == 'completed'
+    assert sp.tracks == URIS
+
+
+def test_nothing_to_retry(jobs):
+    sp = StubSpotify()
+    job = wait_for(jobs, jobs.submit(sp, 'user1', 'Mix', URIS))
+    assert job['status'] == 'completed'
+    assert not jobs.retry(sp, job['id'])
+
+
+def test_job_against_the_spotify_stand_in(jobs, upstream):
+    sp = use_endpoints(spotipy.Spotify(auth='token-user1', requests_session=get_session(),
+                                       requests_timeout=get_timeout()))
+    job = wait_for(jobs, jobs.submit(sp, 'user1', 'Mix', URIS))
+
+    assert job['status'] == 'completed'
+    assert job['playlist_url'].startswith('https://open.spotify.com/playlist/')
+    assert (upstream.calls['create_playlist'], upstream.calls['add_items']) == (1, 3)
+
+
+def test_job_status_route(app_module, monkeypatch):
+    jobs = PlaylistJobs(max_workers=1)
+    monkeypatch.setattr(app_module, 'playlist_jobs', jobs)
+    job = wait_for(jobs, jobs.submit(StubSpotify(fail={URIS[100]}), 'user1', 'Mix', URIS))
+    client = app_module.app.test_client()
+
+    assert client.get(f"/api/playlist-jobs/{job['id']}").status_code == 401
+
+    with client.session_transaction() as session:
+        session['token_info'] = {'access_token': 'token-user1', 'profile': {'id': 'user1'}}
+    response = client.get(f"/api/playlist-jobs/{job['id']}")
+
+    assert response.status_code == 200
+    status = response.get_json()
+    assert set(status) == {
+        'id', 'user_id', 'status', 'name', 'playlist_id', 'playlist_url', 'total_tracks',
+        'added_tracks', 'batches_total', 'batches_done', 'failed_batches', 'error',
+        'created_at', 'updated_at'
+    }
+    assert status['status'] == 'partial'
+    assert status['playlist_url'] == 'https://open.spotify.com/playlist/playlist1'
+    # The failed batch's track list stays on the server
+    failed, = status['failed_batches']
+    assert set(failed) == {'index', 'position', 'error'}
+    assert (failed['index'], failed['position']) == (1, 100)
+    assert 'Injected failure' in failed['error']
+
+    with client.session_transaction() as session:
+        session['token_info'] = {'access_token': 'token-user2', 'profile': {'id': 'user2'}}
+    assert client.get(f"/api/playlist-jobs/{job['id']}").status_code == 404
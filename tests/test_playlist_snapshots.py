@@ -0,0 +1,61 @@
+import json
+import time
+
+import fakeredis
+
+from playlist_snapshots import PlaylistSnapshots
+
+
+class FakeSpotify:
+    def playlist(self, playlist_id, fields=None):
+        return {'snapshot_id': 'snapshot-1'}
+
+    def playlist_tracks(self, playlist_id, fields=None, limit=None):
+        return {'items': [{'track': {'name': 'song'}}]}
+
+
+def build(redis_client=None, interval=60):
+    return PlaylistSnapshots({'Happy': 'playlist-1'}, client_factory=FakeSpotify,
+                             project=lambda items: [item['track']['name'] for item in items],
+                             redis_client=redis_client, interval=interval)
+
+
+def test_snapshots_are_served_while_current():
+    snapshots = build()
+    snapshots.refresh()
+    assert snapshots.get('Happy') == ['song']
+
+
+def test_stale_snapshots_fall_back_to_a_live_fetch():
+    snapshots = build()
+    snapshots.refresh()
+    snapshots._snapshots['Happy']['checked_at'] = time.time() - snapshots.max_age - 1
+
+    assert snapshots.get('Happy') is None
+    assert snapshots.status()['playlists']['Happy']['stale']
+
+
+def test_a_fresher_snapshot_from_another_worker_is_used():
+    redis_client = fakeredis.FakeStrictRedis()
+    snapshots = build(redis_client)
+    build(redis_client).refresh()
+    snapshots._snapshots['Happy'] = {'snapshot_id': 'old', 'tracks': ['old song'],
+                                     'fetched_at': 0, 'checked_at': 0}
+
+    assert snapshots.get('Happy') == ['song']
+
+
+def test_refresher_survives_unreadable_snapshots():
+    redis_client = fakeredis.FakeStrictRedis()
+    # Another worker holds the refresh lock, so this one only loads
+    redis_client.set('playlist-snapshot:lock', 1)
+    redis_client.set('playlist-snapshot:Happy', 'not json')
+    snapshots = build(redis_client, interval=0.05)
+    snapshots.start()
+    time.sleep(0.2)
+    assert snapshots._thread.is_alive()
+
+    redis_client.set('playlist-snapshot:Happy', json.dumps(
+        {'snapshot_id': 'snapshot-1', 'tracks': ['song'], 'fetched_at': time.time(), 'checked_at': time.time()}))
+    time.sleep(0.1)
+    assert snapshots.get('Happy') == ['song']
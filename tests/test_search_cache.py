@@ -0,0 +1,130 @@
+import threading
+import time
+
+import pytest
+
+import search_cache
+from search_cache import SearchCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = time.time()
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(search_cache.time, 'time', clock)
+    return clock
+
+
+def counting_fetch(results):
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        return results
+    return fetch, calls
+
+
+def test_empty_results_expire_after_empty_ttl(clock):
+    cache = SearchCache(ttl=3600, stale_ttl=600, empty_ttl=60)
+    fetch, calls = counting_fetch([])
+
+    assert cache.get_or_fetch('new release', 'US', 20, fetch) == []
+    clock.now += 30
+    cache.get_or_fetch('new release', 'US', 20, fetch)
+    assert len(calls) == 1
+
+    # No stale period: the next lookup searches again
+    clock.now += 31
+    cache.get_or_fetch('new release', 'US', 20, fetch)
+    assert len(calls) == 2
+
+
+def test_results_are_kept_for_ttl(clock):
+    cache = SearchCache(ttl=3600, stale_ttl=600, empty_ttl=60)
+    fetch, calls = counting_fetch(['track'])
+
+    cache.get_or_fetch('summer', 'US', 20, fetch)
+    clock.now += 3000
+    assert cache.get_or_fetch('summer', 'US', 20, fetch) == ['track']
+    assert len(calls) == 1
+
+
+def test_empty_results_are_short_lived_in_redis():
+    fakeredis = pytest.importorskip('fakeredis')
+    redis_client = fakeredis.FakeRedis()
+    cache = SearchCache(redis_client=redis_client, ttl=3600, stale_ttl=600, empty_ttl=60)
+
+    cache.get_or_fetch('new release', 'US', 20, lambda: [])
+    cache.get_or_fetch('summer', 'US', 20, lambda: ['track'])
+
+    assert 0 < redis_client.ttl(f"search:{cache.make_key('new release', 'US', 20)}") <= 60
+    assert redis_client.ttl(f"search:{cache.make_key('summer', 'US', 20)}") > 3600
+
+
+def keep_matching(tracks, query, limit):
+    matches = [track for track in tracks if query in track]
+    return matches if len(tracks) < limit else None
+
+
+def test_longer_queries_are_refined_from_a_cached_prefix():
+    cache = SearchCache()
+    fetch, calls = counting_fetch(['summer hits', 'summer nights', 'sunday'])
+
+    cache.get_or_fetch('Sum', 'US', 20, fetch, refine=keep_matching)
+    assert cache.get_or_fetch('summer', 'US', 20, fetch, refine=keep_matching) == ['summer hits', 'summer nights']
+    assert cache.get_or_fetch('summer  nights', 'US', 20, fetch, refine=keep_matching) == ['summer nights']
+    assert len(calls) == 1
+    assert cache.stats()['prefix_hits'] == 2
+
+
+def test_prefix_results_that_cant_stand_in_are_searched():
+    cache = SearchCache()
+    fetch, calls = counting_fetch(['summer hits', 'summer nights', 'sunday'])
+
+    # A full page may have left out matches, so it can't answer the longer query
+    cache.get_or_fetch('sum', 'US', 3, fetch, refine=keep_matching)
+    cache.get_or_fetch('summer', 'US', 3, fetch, refine=keep_matching)
+    # Other markets have their own results
+    cache.get_or_fetch('summer', 'GB', 20, fetch, refine=keep_matching)
+    assert len(calls) == 3
+
+
+def test_concurrent_searches_share_one_upstream_call(upstream, app_module):
+    upstream.spotify_faults.latency = 0.2
+    upstream.spotify_faults.jitter = 0
+    now = int(time.time())
+    token_info = {
+        'access_token': 'token-user1',
+        'refresh_token': 'refresh-user1',
+        'expires_at': now + 3600,
+        'profile': {'id': 'user1', 'country': 'US', 'fetched_at': now},
+    }
+    clients = []
+    for _ in range(6):
+        client = app_module.app.test_client()
+        with client.session_transaction() as session:
+            session['token_info'] = token_info
+        clients.append(client)
+
+    barrier = threading.Barrier(len(clients))
+    statuses = []
+
+    def search(client):
+        barrier.wait()
+        statuses.append(client.get('/api/search?query=coalesced%20search').status_code)
+
+    threads = [threading.Thread(target=search, args=(client,)) for client in clients]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert statuses == [200] * len(clients)
+    assert upstream.calls['search'] == 1
@@ -0,0 +1,99 @@
+import threading
+import time
+
+import fakeredis
+
+from single_flight import SingleFlight
+
+
+def run_concurrently(fn, n=8):
+    barrier = threading.Barrier(n)
+    results = [None] * n
+
+    def worker(i):
+        barrier.wait()
+        results[i] = fn(i)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(n)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def slow_call(calls, value='value'):
+    def fn():
+        calls.append(1)
+        time.sleep(0.1)
+        return value
+    return fn
+
+
+def test_concurrent_callers_share_one_call():
+    flights = SingleFlight()
+    calls = []
+
+    results = run_concurrently(lambda i: flights.run('k', slow_call(calls)))
+
+    assert len(calls) == 1
+    assert [value for value, _ in results] == ['value'] * 8
+    assert sum(not shared for _, shared in results) == 1
+    assert flights.in_flight() == 0
+
+
+def test_followers_see_the_leaders_error():
+    flights = SingleFlight()
+    calls = []
+
+    def fail():
+        calls.append(1)
+        time.sleep(0.1)
+        raise ValueError('upstream down')
+
+    def call(i):
+        try:
+            flights.run('k', fail)
+        except ValueError as e:
+            return str(e)
+
+    assert run_concurrently(call) == ['upstream down'] * 8
+    assert len(calls) == 1
+
+
+def test_workers_share_one_call_through_redis():
+    client = fakeredis.FakeStrictRedis()
+    store = {}
+    calls = []
+    workers = [SingleFlight(client, namespace='test', poll_interval=0.01) for _ in range(4)]
+
+    def fetch():
+        value = slow_call(calls)()
+        store['k'] = value
+        return value
+
+    results = run_concurrently(lambda i: workers[i % 4].run('k', fetch, lambda: store.get('k')))
+
+    assert len(calls) == 1
+    assert [value for value, _ in results] == ['value'] * 8
+    assert not client.exists('test:k:lock')
+
+
+def test_release_keeps_a_lock_taken_over_by_another_worker():
+    client = fakeredis.FakeStrictRedis()
+    flights = SingleFlight(client, namespace='test')
+
+    token = flights._acquire('k')
+    # The lock expired and another worker took it
+    client.set('test:k:lock', 'other-token')
+    flights._release('k', token)
+
+    assert client.get('test:k:lock') == b'other-token'
+
+
+def test_waiters_call_themselves_once_the_wait_runs_out():
+    client = fakeredis.FakeStrictRedis()
+    client.set('test:k:lock', 'other-token')
+    flights = SingleFlight(client, namespace='test', wait=0.1, poll_interval=0.01)
+
+    assert flights.run('k', lambda: 'mine', lambda: None) == ('mine', False)
@@ -0,0 +1,47 @@
+import time
+
+import pytest
+import spotipy
+
+from http_transport import get_session, get_timeout
+from spotify_client import INTERACTIVE, RateLimitedSpotify, SpotifyRateLimited, SpotifyRateLimiter, use_endpoints
+
+
+def client(limiter):
+    sp = use_endpoints(spotipy.Spotify(auth='token-user', requests_session=get_session(),
+                                       requests_timeout=get_timeout()))
+    return RateLimitedSpotify(sp, limiter, priority=INTERACTIVE)
+
+
+def test_429_reaches_the_limiter_on_the_first_attempt(upstream):
+    upstream.spotify_faults.rate_limit_rate = 1.0
+    upstream.spotify_faults.retry_after = 3
+    limiter = SpotifyRateLimiter(max_wait={INTERACTIVE: 2})
+
+    start = time.monotonic()
+    with pytest.raises(SpotifyRateLimited) as raised:
+        client(limiter).search('summer', type='track', limit=1)
+
+    # Retry-After is over the interactive budget, so there's no retry
+    assert time.monotonic() - start < 1
+    assert upstream.calls['search'] == 1
+    assert raised.value.retry_after == 3
+    assert limiter.stats()['rate_limited_responses'] == 1
+    assert limiter._cooldown_until > time.time() + 2
+
+
+def test_429_sets_the_shared_cooldown(upstream):
+    fakeredis = pytest.importorskip('fakeredis')
+    redis_client = fakeredis.FakeRedis()
+    upstream.spotify_faults.rate_limit_rate = 1.0
+    upstream.spotify_faults.retry_after = 3
+
+    with pytest.raises(SpotifyRateLimited):
+        client(SpotifyRateLimiter(redis_client=redis_client, max_wait={INTERACTIVE: 2})).search('summer', type='track')
+
+    # Another worker's limiter holds its callers back without calling Spotify
+    other = SpotifyRateLimiter(redis_client=redis_client, max_wait={INTERACTIVE: 2})
+    with pytest.raises(SpotifyRateLimited):
+        client(other).search('summer', type='track')
+    assert upstream.calls['search'] == 1
+    assert float(redis_client.get('spotify-rate:cooldown')) > time.time() + 2
@@ -0,0 +1,40 @@
+import sqlite3
+import threading
+
+import pytest
+
+from sqlite_db import SQLiteDatabase
+
+SCHEMA = "CREATE TABLE IF NOT EXISTS items (id INTEGER PRIMARY KEY, name TEXT NOT NULL);"
+
+
+def test_connections_are_reused_across_threads(tmp_path, monkeypatch):
+    db = SQLiteDatabase(str(tmp_path / 'items.db'), SCHEMA, pool_size=2)
+    opened = []
+    connect = db._connect
+    monkeypatch.setattr(db, '_connect', lambda: opened.append(1) or connect())
+
+    db.transaction([("INSERT INTO items (name) VALUES (?)", [('a',), ('b',)])])
+    for _ in range(20):
+        thread = threading.Thread(target=db.query, args=("SELECT name FROM items",))
+        thread.start()
+        thread.join()
+
+    assert len(opened) == 1
+    assert db.query("SELECT name FROM items ORDER BY id") == [('a',), ('b',)]
+
+
+def test_concurrent_checkouts_get_their_own_connections(tmp_path):
+    db = SQLiteDatabase(str(tmp_path / 'items.db'), SCHEMA, pool_size=1)
+    with db.connection() as first, db.connection() as second:
+        assert first is not second
+        assert second.execute("SELECT count(*) FROM items").fetchone() == (0,)
+    # Only pool_size connections stay open once they're returned
+    assert len(db._idle) == 1
+
+
+def test_failed_transaction_rolls_back(tmp_path):
+    db = SQLiteDatabase(str(tmp_path / 'items.db'), SCHEMA)
+    with pytest.raises(sqlite3.IntegrityError):
+        db.transaction([("INSERT INTO items (name) VALUES (?)", [('a',), (None,)])])
+    assert db.query("SELECT count(*) FROM items") == [(0,)]
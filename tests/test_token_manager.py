@@ -0,0 +1,82 @@
+import threading
+import time
+
+import fakeredis
+import pytest
+from spotipy.cache_handler import MemoryCacheHandler
+from spotipy.oauth2 import SpotifyOAuth
+
+from http_transport import get_session
+from spotify_client import use_endpoints
+from token_manager import TokenManager
+
+
+def build_oauth():
+    return use_endpoints(SpotifyOAuth(
+        client_id='test',
+        client_secret='test',
+        redirect_uri='http://127.0.0.1/callback',
+        requests_session=get_session(),
+        cache_handler=MemoryCacheHandler()
+    ))
+
+
+def expiring_token():
+    return {
+        'access_token': 'token-old',
+        'refresh_token': 'refresh-user1',
+        'expires_at': int(time.time()) + 10,
+        'profile': {'id': 'user1'},
+    }
+
+
+def refresh_concurrently(managers, n=8):
+    barrier = threading.Barrier(n)
+    results = [None] * n
+
+    def worker(i):
+        barrier.wait()
+        results[i] = managers[i % len(managers)].fresh(expiring_token())
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(n)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+@pytest.fixture
+def slow_upstream(upstream):
+    upstream.spotify_faults.latency = 0.2
+    upstream.spotify_faults.jitter = 0
+    return upstream
+
+
+def test_concurrent_refreshes_make_one_upstream_call(slow_upstream):
+    manager = TokenManager(build_oauth)
+
+    results = refresh_concurrently([manager])
+
+    assert slow_upstream.calls['token'] == 1
+    assert all(token_info['access_token'] == 'token-user1' for token_info in results)
+    # The rest of the session's token info is kept
+    assert all(token_info['profile'] == {'id': 'user1'} for token_info in results)
+    assert manager.stats()['refreshes'] == 1
+
+
+def test_workers_share_one_refresh_through_redis(slow_upstream):
+    redis_client = fakeredis.FakeStrictRedis()
+    managers = [TokenManager(build_oauth, redis_client=redis_client) for _ in range(4)]
+
+    results = refresh_concurrently(managers)
+
+    assert slow_upstream.calls['token'] == 1
+    assert all(token_info['access_token'] == 'token-user1' for token_info in results)
+
+
+def test_fresh_tokens_are_not_refreshed(upstream):
+    token_info = dict(expiring_token(), expires_at=int(time.time()) + 3600)
+
+    assert TokenManager(build_oauth).fresh(token_info) is token_info
+    assert upstream.calls['token'] == 0
@@ -0,0 +1,156 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+import redis
+
+import metrics
+from http_transport import REQUEST_BUDGET
+from single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# Tokens are refreshed once they expire within this many seconds
+REFRESH_MARGIN = int(os.getenv('SPOTIFY_TOKEN_REFRESH_MARGIN', '300'))
+
+
+class TokenManager:
+    """Refreshes Spotify user tokens ahead of expiry, once per token.
+
+    Every session copy of a login carries the same refresh token, so tokens
+    are keyed by its hash. Concurrent requests for the same token in this
+    worker wait for a single refresh; with Redis, a lock makes one worker
+    do the refresh and the others pick the new token up from Redis (see
+    SingleFlight).
+    """
+
+    def __init__(self, oauth_factory, redis_client=None, margin=REFRESH_MARGIN,
+                 lock_ttl=REQUEST_BUDGET, max_entries=4096, namespace='spotify-token'):
+        self.oauth_factory = oauth_factory
+        self.redis = redis_client
+        self.margin = margin
+        self.lock_ttl = lock_ttl
+        self.max_entries = max_entries
+        self.namespace = namespace
+        self._oauth = None
+        self._oauth_pid = None
+        self._tokens = {}
+        self._refreshes = SingleFlight(redis_client, namespace=namespace, lock_ttl=lock_ttl)
+        self._lock = threading.Lock()
+        self._stats = {'refreshes': 0, 'hits': 0, 'coalesced': 0, 'errors': 0}
+
+    @property
+    def oauth(self):
+        """The worker's SpotifyOAuth, built on first use and again after a fork"""
+        pid = os.getpid()
+        if self._oauth is None or self._oauth_pid != pid:
+            with self._lock:
+                if self._oauth is None or self._oauth_pid != pid:
+                    self._oauth = self.oauth_factory()
+                    self._oauth_pid = pid
+        return self._oauth
+
+    def needs_refresh(self, token_info):
+        return token_info.get('expires_at', 0) - time.time() < self.margin
+
+    def fresh(self, token_info):
+        """token_info, or a refreshed copy of it if it expires soon.
+
+        Fields other than the token's own (such as the cached profile) are
+        kept. Raises the OAuth error if the refresh fails.
+        """
+        if not self.needs_refresh(token_info):
+            return token_info
+
+        key = self._key(token_info['refresh_token'])
+        refreshed = self._get_local(key) or self._get_remote(key)
+        if refreshed is not None:
+            self._count('hits', 'hit')
+        else:
+            refreshed = self._refresh_once(key, token_info['refresh_token'])
+        return dict(token_info, **refreshed)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._tokens)
+        stats['margin'] = self.margin
+        return stats
+
+    @staticmethod
+    def _key(refresh_token):
+        return hashlib.sha256(refresh_token.encode()).hexdigest()[:32]
+
+    def _count(self, name, result=None):
+        with self._lock:
+            self._stats[name] += 1
+        if result:
+            metrics.cache_result('spotify_token', result)
+
+    def _usable(self, token_info):
+        return token_info is not None and not self.needs_refresh(token_info)
+
+    def _get_local(self, key):
+        with self._lock:
+            token_info = self._tokens.get(key)
+        return token_info if self._usable(token_info) else None
+
+    def _get_remote(self, key):
+        if self.redis is None:
+            return None
+        try:
+            raw = self.redis.get(f"{self.namespace}:{key}")
+        except redis.RedisError as e:
+            logger.warning("Token store read error: %s", e)
+            return None
+        if raw is None:
+            return None
+        token_info = json.loads(raw)
+        if not self._usable(token_info):
+            return None
+        self._set_local(key, token_info)
+        return token_info
+
+    def _set_local(self, key, token_info):
+        with self._lock:
+            if len(self._tokens) >= self.max_entries:
+                now = time.time()
+                for stale_key in [k for k, v in self._tokens.items() if v['expires_at'] <= now]:
+                    del self._tokens[stale_key]
+                if len(self._tokens) >= self.max_entries:
+                    self._tokens.clear()
+            self._tokens[key] = token_info
+
+    def _store(self, key, token_info):
+        self._set_local(key, token_info)
+        if self.redis is None:
+            return
+        try:
+            self.redis.set(
+                f"{self.namespace}:{key}",
+                json.dumps(token_info, separators=(',', ':')),
+                ex=max(1, int(token_info['expires_at'] - time.time()))
+            )
+        except redis.RedisError as e:
+            logger.warning("Token store write error: %s", e)
+
+    def _refresh_once(self, key, refresh_token):
+        token_info, shared = self._refreshes.run(
+            key, lambda: self._refresh(key, refresh_token), lambda: self._get_remote(key))
+        if shared:
+            self._count('coalesced', 'coalesced')
+        return token_info
+
+    def _refresh(self, key, refresh_token):
+        try:
+            with metrics.span('spotify', 'refresh_access_token'):
+                token_info = self.oauth.refresh_access_token(refresh_token)
+        except Exception:
+            self._count('errors')
+            raise
+        self._count('refreshes', 'miss')
+        self._store(key, token_info)
+        return token_info
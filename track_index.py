@@ -0,0 +1,265 @@
+"""Local track index for matching moods to tracks without calling Spotify.
+
+An index is a directory built offline from a dataset of tracks:
+
+    meta.json       feature names, market codes and track count
+    features.npy    float32 (tracks x features), values scaled to 0..1
+    markets.npy     uint8 bitmask of markets each track is available in
+    tracks.ndjson   the tracks as JSON arrays of Track fields, one per line
+    offsets.npy     int64 byte offset of every line in tracks.ndjson
+
+The arrays and the records file are memory-mapped, so opening an index is
+cheap and forked workers share its pages. Build one with:
+
+    python track_index.py build tracks.ndjson path/to/index
+
+where each input line is a Spotify track object with its audio features
+under "audio_features".
+"""
+import argparse
+import json
+import logging
+import mmap
+import os
+import sys
+import threading
+from array import array
+
+import numpy as np
+
+import log_pipeline
+from track_model import Track
+
+logger = logging.getLogger(__name__)
+
+FEATURES = ('valence', 'energy', 'danceability', 'acousticness', 'instrumentalness', 'tempo')
+
+# Tempo is stored as a fraction of this many BPM so every feature is 0..1
+TEMPO_SCALE = 250.0
+
+# How much each feature counts towards the distance to a mood
+FEATURE_WEIGHTS = np.array([2.0, 2.0, 1.0, 1.0, 0.5, 0.5], dtype=np.float32)
+
+# Target (valence, energy, danceability, acousticness, instrumentalness, BPM)
+# for the app's moods and the ones MoodDetector suggests
+MOOD_TARGETS = {
+    'happy': (0.85, 0.70, 0.70, 0.20, 0.05, 120),
+    'sad': (0.15, 0.30, 0.35, 0.65, 0.15, 80),
+    'energetic': (0.65, 0.90, 0.75, 0.05, 0.10, 130),
+    'calm': (0.40, 0.20, 0.30, 0.80, 0.60, 75),
+    'romantic': (0.60, 0.40, 0.55, 0.50, 0.05, 95),
+    'excited': (0.80, 0.85, 0.75, 0.10, 0.05, 128),
+    'positive': (0.75, 0.60, 0.65, 0.30, 0.05, 115),
+    'upbeat': (0.80, 0.75, 0.75, 0.15, 0.05, 122),
+    'cheerful': (0.85, 0.60, 0.65, 0.35, 0.05, 112),
+    'mellow': (0.45, 0.35, 0.45, 0.60, 0.30, 90),
+    'relaxed': (0.50, 0.30, 0.45, 0.65, 0.35, 88),
+    'peaceful': (0.45, 0.15, 0.25, 0.85, 0.65, 70),
+    'chill': (0.50, 0.35, 0.55, 0.55, 0.30, 92),
+    'melancholic': (0.20, 0.35, 0.35, 0.60, 0.20, 85),
+    'emotional': (0.25, 0.45, 0.40, 0.55, 0.10, 90),
+    'contemplative': (0.30, 0.25, 0.30, 0.70, 0.50, 80),
+    'focused': (0.40, 0.40, 0.40, 0.50, 0.75, 100),
+    'productive': (0.55, 0.55, 0.55, 0.35, 0.55, 110),
+    'motivated': (0.65, 0.80, 0.65, 0.10, 0.10, 125),
+    'morning': (0.70, 0.55, 0.60, 0.45, 0.10, 110),
+    'night': (0.35, 0.30, 0.45, 0.55, 0.40, 85),
+    'magical': (0.55, 0.40, 0.40, 0.55, 0.50, 95),
+    'intense': (0.35, 0.95, 0.55, 0.05, 0.20, 140),
+    'dramatic': (0.30, 0.75, 0.40, 0.30, 0.40, 110),
+}
+
+# Market column for tracks that carry no market list (available everywhere)
+ANY_MARKET = '*'
+MAX_MARKETS = 256
+
+CHUNK_ROWS = 1 << 18
+
+
+def mood_vector(moods):
+    """Target feature vector for a mood or a list of moods (e.g. combine_moods output).
+
+    Unknown moods are ignored; returns None if none are known.
+    """
+    if isinstance(moods, str):
+        moods = [moods]
+    targets = [MOOD_TARGETS[mood.lower()] for mood in moods if mood.lower() in MOOD_TARGETS]
+    if not targets:
+        return None
+    vector = np.mean(np.asarray(targets, dtype=np.float32), axis=0)
+    vector[-1] = min(vector[-1] / TEMPO_SCALE, 1.0)
+    return vector
+
+
+class TrackIndex:
+    """Read-only, memory-mapped index of tracks and their feature vectors"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        if tuple(meta['features']) != FEATURES:
+            raise ValueError(f"Index at {path} has features {meta['features']}, expected {list(FEATURES)}")
+        self.markets = {code: column for column, code in enumerate(meta['markets'])}
+        self.features = np.load(os.path.join(path, 'features.npy'), mmap_mode='r')
+        self.market_bits = np.load(os.path.join(path, 'markets.npy'), mmap_mode='r')
+        self.offsets = np.load(os.path.join(path, 'offsets.npy'), mmap_mode='r')
+        with open(os.path.join(path, 'tracks.ndjson'), 'rb') as f:
+            self._records = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if meta['count'] else b''
+        self._stats = {'queries': 0}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.features)
+
+    def recommend(self, moods, market=None, k=20):
+        """(Track, score) of up to k tracks closest to the mood(s), available in market"""
+        target = mood_vector(moods)
+        if target is None:
+            return []
+        return [(self.track(row), score) for row, score in self.nearest(target, market, k)]
+
+    def nearest(self, target, market=None, k=20):
+        """(row, score) of the k tracks closest to target, best first.
+
+        The score is 1 for an exact match and 0 for the furthest possible
+        track. Rows are scanned in chunks so memory use stays flat however
+        large the index is.
+        """
+        with self._lock:
+            self._stats['queries'] += 1
+        target = np.asarray(target, dtype=np.float32)
+        mask = self._market_mask(market)
+        rows, distances = [], []
+
+        for start in range(0, len(self.features), CHUNK_ROWS):
+            block = np.asarray(self.features[start:start + CHUNK_ROWS])
+            distance = np.square(block - target) @ FEATURE_WEIGHTS
+            if mask is not None:
+                byte, bit = mask
+                available = self.market_bits[start:start + CHUNK_ROWS, byte] & bit
+                distance[available == 0] = np.inf
+            if len(distance) > k:
+                best = np.argpartition(distance, k)[:k]
+            else:
+                best = np.arange(len(distance))
+            best = best[np.isfinite(distance[best])]
+            rows.append(best + start)
+            distances.append(distance[best])
+
+        if not rows:
+            return []
+        rows = np.concatenate(rows)
+        distances = np.concatenate(distances)
+        order = np.argsort(distances, kind='stable')[:k]
+        scores = 1 - np.sqrt(distances[order] / FEATURE_WEIGHTS.sum())
+        return [(int(row), round(float(score), 4)) for row, score in zip(rows[order], scores)]
+
+    def track(self, row):
+        return Track.load(json.loads(self._records[int(self.offsets[row]):int(self.offsets[row + 1])]))
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update({'path': self.path, 'tracks': len(self), 'markets': len(self.markets) - 1})
+        return stats
+
+    def _market_mask(self, market):
+        if market is None:
+            return None
+        column = self.markets.get(market, self.markets[ANY_MARKET])
+        return column // 8, 1 << (7 - column % 8)
+
+
+def build_index(records, path):
+    """Write an index for an iterable of track objects with audio features.
+
+    Each track is stored once (the first record for an id wins); records
+    missing a feature are skipped. Returns the number of tracks indexed.
+    """
+    os.makedirs(path, exist_ok=True)
+    markets = {ANY_MARKET: 0}
+    seen = set()
+    features = array('f')
+    market_bits = bytearray()
+    offsets = array('q', [0])
+
+    with open(os.path.join(path, 'tracks.ndjson'), 'wb') as out:
+        for record in records:
+            if not record or record.get('id') in seen:
+                continue
+            try:
+                audio = record.get('audio_features') or record
+                vector = [float(audio[name]) for name in FEATURES]
+                track = Track.from_spotify(record)
+                if track is None:
+                    raise ValueError('no track id')
+                line = json.dumps(track, separators=(',', ':')).encode() + b'\n'
+            except (KeyError, IndexError, TypeError, ValueError) as e:
+                logger.warning("Skipping track %s: %s", record.get('id'), e)
+                continue
+
+            vector[-1] = min(vector[-1] / TEMPO_SCALE, 1.0)
+            bits = 0
+            available = record.get('available_markets')
+            for code in (available if available else (ANY_MARKET,)):
+                if code not in markets:
+                    if len(markets) == MAX_MARKETS:
+                        raise ValueError(f"More than {MAX_MARKETS - 1} markets in dataset")
+                    markets[code] = len(markets)
+                bits |= 1 << (MAX_MARKETS - 1 - markets[code])
+            if not available:
+                # Available everywhere: set every market column
+                bits = (1 << MAX_MARKETS) - 1
+
+            seen.add(record['id'])
+            features.extend(vector)
+            market_bits += bits.to_bytes(MAX_MARKETS // 8, 'big')
+            out.write(line)
+            offsets.append(offsets[-1] + len(line))
+
+    count = len(seen)
+    width = (len(markets) + 7) // 8
+    np.save(os.path.join(path, 'features.npy'),
+            np.frombuffer(features, dtype=np.float32).reshape(count, len(FEATURES)))
+    np.save(os.path.join(path, 'markets.npy'),
+            np.frombuffer(bytes(market_bits), dtype=np.uint8).reshape(count, MAX_MARKETS // 8)[:, :width])
+    np.save(os.path.join(path, 'offsets.npy'), np.frombuffer(offsets, dtype=np.int64))
+    # Written last, so a half-built index doesn't open
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump({'features': list(FEATURES), 'markets': list(markets), 'count': count}, f)
+    return count
+
+
+def read_ndjson(filename):
+    with open(filename) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help='build an index from an NDJSON dataset')
+    build.add_argument('dataset')
+    build.add_argument('path')
+    query = commands.add_parser('query', help='print recommendations from an index')
+    query.add_argument('path')
+    query.add_argument('moods', nargs='+')
+    query.add_argument('--market')
+    query.add_argument('-k', type=int, default=20)
+    args = parser.parse_args()
+    # Logs go to stderr, so stdout carries only query results
+    log_pipeline.configure(stream=sys.stderr)
+
+    if args.command == 'build':
+        count = build_index(read_ndjson(args.dataset), args.path)
+        logger.info("Indexed %d tracks in %s", count, args.path)
+    else:
+        for track, score in TrackIndex(args.path).recommend(args.moods, market=args.market, k=args.k):
+            print(track.to_json(score=score))
+
+
+if __name__ == '__main__':
+    main()
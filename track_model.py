@@ -0,0 +1,95 @@
+import json
+from collections import namedtuple
+from json.encoder import encode_basestring_ascii
+
+from flask import Response
+
+FIELDS = ('id', 'name', 'artist', 'album', 'album_image', 'preview_url', 'external_url', 'uri')
+
+# '{"id":%s,"name":%s,...}', filled with already-encoded field values
+_TEMPLATE = '{' + ','.join(f'"{field}":%s' for field in FIELDS) + '}'
+
+
+def _encode(value):
+    return 'null' if value is None else encode_basestring_ascii(value)
+
+
+class Track(namedtuple('Track', FIELDS)):
+    """A track as the front end shows it.
+
+    Tuple-backed, so a cached track costs one small tuple of strings rather
+    than Spotify's nested track object or a dict. Caches and indexes store
+    it as a JSON array; responses encode it straight to a JSON object.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_spotify(cls, track):
+        """Project a Spotify track object, or return None if it has no id"""
+        if not track or not track.get('id'):
+            return None
+        artists = track.get('artists')
+        album = track.get('album') or {}
+        images = album.get('images')
+        return cls(
+            track['id'],
+            track.get('name') or '',
+            artists[0]['name'] if artists else 'Unknown Artist',
+            album.get('name') or 'Unknown Album',
+            images[0]['url'] if images else None,
+            track.get('preview_url'),
+            (track.get('external_urls') or {}).get('spotify', ''),
+            track.get('uri') or f"spotify:track:{track['id']}"
+        )
+
+    @classmethod
+    def load(cls, value):
+        """A track from its stored form: a JSON array, or a dict written by
+        older versions (a projected track or a raw Spotify one)"""
+        if isinstance(value, (list, tuple)):
+            return cls(*value)
+        if 'artists' in value:
+            return cls.from_spotify(value)
+        return cls(*(value.get(field) for field in FIELDS[:-1]),
+                   value.get('uri') or f"spotify:track:{value['id']}")
+
+    def to_json(self, **extra):
+        """The track as a JSON object, with any extra fields appended"""
+        encoded = _TEMPLATE % tuple(map(_encode, self))
+        if extra:
+            encoded = encoded[:-1] + ',' + json.dumps(extra, separators=(',', ':'))[1:]
+        return encoded
+
+
+def project_tracks(tracks):
+    """Tracks from Spotify track objects, skipping unusable ones"""
+    return [track for track in map(Track.from_spotify, tracks) if track is not None]
+
+
+def project_playlist_items(items):
+    """Tracks from playlist items, skipping removed and local tracks"""
+    return project_tracks(item.get('track') for item in items if item)
+
+
+def load_tracks(values):
+    return [Track.load(value) for value in values]
+
+
+def encode_tracks(tracks, scores=None, **fields):
+    """JSON object {"tracks": [...], **fields} with the tracks encoded directly.
+
+    scores, if given, adds a "score" to each track.
+    """
+    if scores is None:
+        encoded = [track.to_json() for track in tracks]
+    else:
+        encoded = [track.to_json(score=score) for track, score in zip(tracks, scores)]
+    body = '{"tracks":[' + ','.join(encoded) + ']'
+    if fields:
+        return body + ',' + json.dumps(fields, separators=(',', ':'))[1:]
+    return body + '}'
+
+
+def tracks_response(tracks, scores=None, **fields):
+    """JSON response of encode_tracks()"""
+    return Response(encode_tracks(tracks, scores, **fields), mimetype='application/json')
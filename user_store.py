@@ -0,0 +1,77 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+from sqlite_db import SQLiteDatabase
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id TEXT PRIMARY KEY,
+    created_at REAL NOT NULL
+);
+"""
+
+
+class UserStore:
+    """Registered users, in a SQLite file shared by every worker.
+
+    Lookups go through a small in-process LRU whose entries expire after
+    `cache_ttl` seconds, so Flask-Login's per-request user_loader is a dict
+    lookup. Writes invalidate this worker's entry; other workers pick up
+    changes within the TTL. Misses aren't cached, so a user registered on
+    another worker is found on the next lookup.
+    """
+
+    def __init__(self, model, path=None, cache_ttl=None, cache_size=None):
+        self.model = model
+        self.db = SQLiteDatabase(path or os.getenv('USER_DB', 'users.db'), SCHEMA)
+        self.cache_ttl = cache_ttl if cache_ttl is not None else float(os.getenv('USER_CACHE_TTL', '60'))
+        self.cache_size = cache_size or int(os.getenv('USER_CACHE_SIZE', '10000'))
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+    def get(self, user_id):
+        """The user with this id, or None"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._cache.get(user_id)
+            if entry is not None and entry[1] > now:
+                self._cache.move_to_end(user_id)
+                self._stats['hits'] += 1
+                metrics.cache_result('user', 'hit')
+                return entry[0]
+            self._stats['misses'] += 1
+        metrics.cache_result('user', 'miss')
+
+        rows = self.db.query("SELECT id FROM users WHERE id = ?", (user_id,))
+        if not rows:
+            return None
+        user = self.model(id=rows[0][0])
+        with self._lock:
+            self._cache[user_id] = (user, now + self.cache_ttl)
+            self._cache.move_to_end(user_id)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return user
+
+    def add(self, user_id):
+        """Register a user (a no-op if they exist) and return them"""
+        self.db.transaction([("INSERT OR IGNORE INTO users (id, created_at) VALUES (?, ?)",
+                              [(user_id, time.time())])])
+        self.invalidate(user_id)
+        return self.get(user_id)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            if self._cache.pop(user_id, None) is not None:
+                self._stats['invalidations'] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['cached'] = len(self._cache)
+        stats['ttl'] = self.cache_ttl
+        return stats